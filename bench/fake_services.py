@@ -0,0 +1,341 @@
+"""Локальные заглушки Telegram Bot API, OpenAI, Unsplash и Mochi для бенчмарка.
+
+Все сервисы живут в одном FastAPI приложении под своими префиксами:
+/telegram, /openai, /unsplash, /images, /mochi. Для каждого сервиса задается
+задержка (среднее и разброс) и доля ответов с ошибкой 500.
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+SERVICES = ("telegram", "openai", "unsplash", "images", "mochi")
+
+
+@dataclass
+class ServiceProfile:
+    """Задержка (нормальное распределение, обрезанное снизу нулем) и доля ошибок"""
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+
+    def sample_delay(self) -> float:
+        return max(0.0, random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+@dataclass
+class TelegramEvent:
+    """Вызов метода Bot API, полученный заглушкой"""
+    method: str
+    params: dict
+    at: float
+
+
+@dataclass
+class FakeState:
+    profiles: Dict[str, ServiceProfile] = field(default_factory=lambda: {name: ServiceProfile() for name in SERVICES})
+    # (сервис, операция) -> длительности обработки в секундах
+    timings: Dict[Tuple[str, str], List[float]] = field(default_factory=dict)
+    errors: Dict[Tuple[str, str], int] = field(default_factory=dict)
+    telegram_events: List[TelegramEvent] = field(default_factory=list)
+    listeners: List[Callable[[TelegramEvent], None]] = field(default_factory=list)
+    # Обновления для getUpdates (режим polling) и последний подтвержденный offset
+    pending_updates: List[dict] = field(default_factory=list)
+    confirmed_offset: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def push_update(self, update: dict) -> None:
+        with self.lock:
+            self.pending_updates.append(update)
+
+    def take_updates(self, offset: int, limit: int) -> List[dict]:
+        """Как getUpdates: offset подтверждает все обновления с меньшим update_id"""
+        with self.lock:
+            if offset:
+                self.confirmed_offset = max(self.confirmed_offset, offset)
+                self.pending_updates = [u for u in self.pending_updates if u["update_id"] >= offset]
+            return self.pending_updates[:limit]
+
+    def record(self, service: str, operation: str, duration: float, failed: bool) -> None:
+        with self.lock:
+            self.timings.setdefault((service, operation), []).append(duration)
+            if failed:
+                self.errors[(service, operation)] = self.errors.get((service, operation), 0) + 1
+
+
+def _fake_translation(text: str) -> str:
+    return (
+        f"Перевод: перевод-{text}\n"
+        "Примеры:\n"
+        f"1. This is {text} - Это {text}\n"
+        f"2. I like {text} - Мне нравится {text}\n"
+        f"3. Where is {text} - Где {text}"
+    )
+
+
+def _fake_structured(text: str) -> str:
+    return json.dumps({
+        "translation": f"перевод-{text}",
+        "examples": [f"This is {text} - Это {text}", f"I like {text} - Мне нравится {text}"],
+        "image_keyword": text.split()[0] if text.split() else "word"
+    }, ensure_ascii=False)
+
+
+def _fake_batch(items: List[str]) -> str:
+    return json.dumps({"items": [dict(json.loads(_fake_structured(item)), text=item) for item in items]},
+                      ensure_ascii=False)
+
+
+_TEXT_RE = re.compile(r'текст[а-я]* "(.*?)"', re.S)
+_BATCH_ITEM_RE = re.compile(r"^\d+\. (.+?)(?: \(с [^)]*\))?$", re.M)
+
+
+def create_app(state: FakeState) -> FastAPI:
+    app = FastAPI()
+    message_ids = iter(range(1_000_000, 10_000_000))
+    mochi_decks: Dict[str, dict] = {}
+    mochi_cards: Dict[str, dict] = {}
+
+    async def simulate(service: str, operation: str) -> Tuple[float, bool]:
+        profile = state.profiles[service]
+        start = time.perf_counter()
+        await asyncio.sleep(profile.sample_delay())
+        return start, profile.should_fail()
+
+    def finish(service: str, operation: str, start: float, failed: bool) -> None:
+        state.record(service, operation, time.perf_counter() - start, failed)
+
+    def error_response() -> JSONResponse:
+        return JSONResponse(status_code=500, content={"ok": False, "error_code": 500, "description": "fake error"})
+
+    # --- Telegram Bot API ---
+
+    async def get_updates(params: dict) -> dict:
+        # Long polling: ждем обновлений не дольше timeout секунд
+        offset, limit = int(params.get("offset", 0) or 0), int(params.get("limit", 100) or 100)
+        deadline = time.monotonic() + float(params.get("timeout", 0) or 0)
+        updates = state.take_updates(offset, limit)
+        while not updates and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+            updates = state.take_updates(offset, limit)
+        return {"ok": True, "result": updates}
+
+    @app.api_route("/telegram/bot{token}/{method}", methods=["GET", "POST"])
+    async def telegram(token: str, method: str, request: Request):
+        params = dict(request.query_params)
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith(("multipart/form-data", "application/x-www-form-urlencoded")):
+            form = await request.form()
+            params.update({key: value for key, value in form.items() if isinstance(value, str)})
+        if method == "getUpdates":
+            return await get_updates(params)
+
+        start, failed = await simulate("telegram", method)
+        finish("telegram", method, start, failed)
+        if failed:
+            return error_response()
+
+        event = TelegramEvent(method, params, time.perf_counter())
+        with state.lock:
+            state.telegram_events.append(event)
+            listeners = list(state.listeners)
+        for listener in listeners:
+            listener(event)
+
+        chat_id = int(params.get("chat_id", 0) or 0)
+        message = {
+            "message_id": next(message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}
+        }
+        if method == "sendPhoto":
+            message["photo"] = [{"file_id": f"photo-{message['message_id']}", "file_unique_id": "u",
+                                 "width": 800, "height": 600}]
+        elif method == "sendAnimation":
+            message["animation"] = {"file_id": "loading-gif", "file_unique_id": "g",
+                                    "width": 200, "height": 200, "duration": 1}
+        elif method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            message["text"] = params.get("text", "")
+
+        if method == "sendMediaGroup":
+            media = json.loads(params.get("media", "[]"))
+            return {"ok": True, "result": [
+                dict(message, message_id=next(message_ids), photo=[
+                    {"file_id": f"photo-{index}-{item.get('media')}", "file_unique_id": "u", "width": 800, "height": 600}
+                ]) for index, item in enumerate(media)
+            ]}
+        if method in ("sendChatAction", "deleteMessage", "answerCallbackQuery", "setWebhook", "deleteWebhook"):
+            return {"ok": True, "result": True}
+        return {"ok": True, "result": message}
+
+    # --- OpenAI chat completions ---
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        match = _TEXT_RE.search(prompt)
+        text = match.group(1) if match else "word"
+
+        if "ключевые слова" in prompt:
+            operation, content = "keyword", text.split()[0] if text.split() else "word"
+        elif "Список:" in prompt:
+            items = _BATCH_ITEM_RE.findall(prompt.split("Список:", 1)[1].split("\n\n", 1)[0])
+            operation, content = "batch", _fake_batch(items)
+        elif body.get("response_format") or body.get("tools"):
+            operation, content = "structured", _fake_structured(text)
+        else:
+            operation, content = "translation", _fake_translation(text)
+
+        start, failed = await simulate("openai", operation)
+        if failed:
+            finish("openai", operation, start, failed)
+            return JSONResponse(status_code=500, content={"error": {"message": "fake error", "type": "server_error"}})
+
+        model = body.get("model", "gpt-4o")
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                 "total_tokens": (len(prompt) + len(content)) // 4}
+        headers = {"x-ratelimit-remaining-requests": "9999", "x-ratelimit-remaining-tokens": "999999",
+                   "x-ratelimit-reset-requests": "1ms", "x-ratelimit-reset-tokens": "1ms"}
+
+        if body.get("tools"):
+            tool = body["tools"][0]["function"]["name"]
+            message = {"role": "assistant", "content": None, "tool_calls": [
+                {"id": "call_1", "type": "function", "function": {"name": tool, "arguments": content}}
+            ]}
+        else:
+            message = {"role": "assistant", "content": content}
+
+        if body.get("stream"):
+            async def events():
+                # Ответ отдается кусками по несколько символов, как при настоящей генерации
+                for index in range(0, len(content), 8):
+                    chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": model, "choices": [{"index": 0, "delta": {"content": content[index:index + 8]},
+                                                          "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    await asyncio.sleep(0.005)
+                last = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                yield f"data: {json.dumps(last)}\n\n"
+                yield "data: [DONE]\n\n"
+                finish("openai", operation, start, False)
+
+            return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+        finish("openai", operation, start, False)
+        return JSONResponse(headers=headers, content={
+            "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": message,
+                         "finish_reason": "tool_calls" if body.get("tools") else "stop"}],
+            "usage": usage
+        })
+
+    # --- Unsplash ---
+
+    @app.get("/unsplash/search/photos")
+    async def unsplash_search(request: Request):
+        start, failed = await simulate("unsplash", "search")
+        finish("unsplash", "search", start, failed)
+        if failed:
+            return error_response()
+        query = request.query_params.get("query", "image")
+        base = str(request.base_url).rstrip("/")
+        return JSONResponse(
+            headers={"X-Ratelimit-Limit": "50", "X-Ratelimit-Remaining": "49"},
+            content={"results": [{"urls": {"regular": f"{base}/images/{query}.jpg"}}]}
+        )
+
+    @app.get("/images/{name}")
+    async def image(name: str):
+        start, failed = await simulate("images", "download")
+        finish("images", "download", start, failed)
+        if failed:
+            return error_response()
+        return Response(content=b"\xff\xd8\xff\xe0" + b"\0" * 100_000, media_type="image/jpeg")
+
+    # --- Mochi ---
+
+    async def mochi_call(operation: str) -> Optional[Response]:
+        start, failed = await simulate("mochi", operation)
+        finish("mochi", operation, start, failed)
+        return error_response() if failed else None
+
+    @app.get("/mochi/api/templates/")
+    async def mochi_templates():
+        return await mochi_call("list_templates") or {"docs": [{"id": "tpl", "name": "Basic"}]}
+
+    @app.get("/mochi/api/templates/{template_id}")
+    async def mochi_template(template_id: str):
+        return await mochi_call("get_template") or {
+            "id": template_id, "name": "Basic",
+            "fields": {"f1": {"id": "f1", "name": "Front"}, "f2": {"id": "f2", "name": "Back"}}
+        }
+
+    @app.get("/mochi/api/decks/")
+    async def mochi_list_decks():
+        return await mochi_call("list_decks") or {"docs": list(mochi_decks.values())}
+
+    @app.post("/mochi/api/decks/")
+    async def mochi_create_deck(request: Request):
+        error = await mochi_call("create_deck")
+        if error:
+            return error
+        body = await request.json()
+        deck = {"id": f"deck{len(mochi_decks) + 1}", "name": body.get("name")}
+        mochi_decks[deck["id"]] = deck
+        return deck
+
+    @app.get("/mochi/api/cards/")
+    async def mochi_list_cards(request: Request):
+        error = await mochi_call("list_cards")
+        if error:
+            return error
+        deck_id = request.query_params.get("deck-id")
+        docs = [card for card in mochi_cards.values() if not deck_id or card.get("deck-id") == deck_id]
+        return {"docs": docs, "bookmark": None}
+
+    @app.post("/mochi/api/cards/")
+    async def mochi_create_card(request: Request):
+        error = await mochi_call("create_card")
+        if error:
+            return error
+        body = await request.json()
+        card = dict(body, id=f"card{len(mochi_cards) + 1}")
+        mochi_cards[card["id"]] = card
+        return card
+
+    @app.post("/mochi/api/cards/{card_id}/attachments/{filename}")
+    async def mochi_attachment(card_id: str, filename: str, request: Request):
+        error = await mochi_call("upload_attachment")
+        if error:
+            return error
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+        return {"size": size}
+
+    @app.get("/mochi/api/cards/{card_id}")
+    async def mochi_get_card(card_id: str):
+        return await mochi_call("get_card") or mochi_cards.get(card_id, {"id": card_id})
+
+    @app.post("/mochi/api/cards/{card_id}")
+    async def mochi_update_card(card_id: str, request: Request):
+        error = await mochi_call("update_card")
+        if error:
+            return error
+        body = await request.json()
+        mochi_cards.setdefault(card_id, {"id": card_id}).update(body)
+        return mochi_cards[card_id]
+
+    return app
@@ -0,0 +1,180 @@
+"""Время холодного запуска бота: импорт main.py и готовность процесса uvicorn.
+
+Импорт замеряется в отдельном процессе с python -X importtime, поэтому
+каждый замер начинается без кэша импортированных модулей. Запуск
+замеряется от старта uvicorn до первого ответа / (liveness) и /ready
+(readiness, после фонового прогрева моделей и цепочек).
+
+Пример:
+    python bench/import_time.py --repeat 5 --json import-time.json
+    python bench/import_time.py --repeat 5 --baseline import-time.json
+
+Внешние сервисы при запуске не нужны: токены подменяются фиктивными.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from typing import Dict, List, Tuple
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def bot_env(data_dir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "TOKEN": "123456:bench",
+        "OPENAI_API_KEY": "bench",
+        "UNSPLASH_ACCESS_KEY": "bench",
+        "CACHE_DB_PATH": os.path.join(data_dir, "cache.sqlite3"),
+        "EXPORT_QUEUE_PATH": os.path.join(data_dir, "export_queue.sqlite3"),
+        "LOADING_GIF_CHAT_ID": "",
+        "BOT_MODE": "webhook"
+    })
+    return env
+
+
+def measure_import(env: Dict[str, str]) -> Tuple[float, Dict[str, float]]:
+    """Время импорта main (секунды) и накопленное время импорта каждого модуля верхнего уровня"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Ошибка импорта main:\n{result.stderr[-3000:]}")
+
+    modules = {}
+    total = None
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Вложенность модуля - отступ имени: два пробела на уровень
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        seconds = int(cumulative) / 1_000_000
+        if name.strip() == "main":
+            total = seconds
+        elif depth == 1:
+            modules[name.strip()] = seconds
+    return total, modules
+
+
+def measure_startup(env: Dict[str, str], port: int, timeout: float = 60) -> Dict[str, float]:
+    """Секунды от запуска uvicorn до первого ответа 200 на / и /ready"""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    times = {}
+    try:
+        deadline = started + timeout
+        while len(times) < 2:
+            if process.poll() is not None:
+                raise SystemExit("Бот завершился при запуске")
+            if time.perf_counter() > deadline:
+                raise SystemExit(f"Бот не стал готов за {timeout} с")
+            for path, name in (("/", "live"), ("/ready", "ready")):
+                if name in times:
+                    continue
+                try:
+                    if httpx.get(f"http://127.0.0.1:{port}{path}", timeout=1).status_code == 200:
+                        times[name] = time.perf_counter() - started
+                except httpx.HTTPError:
+                    pass
+            time.sleep(0.02)
+    finally:
+        process.terminate()
+        process.wait()
+    return times
+
+
+def run(args: argparse.Namespace) -> dict:
+    imports: List[float] = []
+    modules: Dict[str, List[float]] = {}
+    startup: Dict[str, List[float]] = {"live": [], "ready": []}
+
+    with tempfile.TemporaryDirectory(prefix="bot-import-") as data_dir:
+        env = bot_env(data_dir)
+        for _ in range(args.repeat):
+            total, top = measure_import(env)
+            imports.append(total)
+            for name, seconds in top.items():
+                modules.setdefault(name, []).append(seconds)
+            if not args.skip_startup:
+                for name, seconds in measure_startup(env, args.port).items():
+                    startup[name].append(seconds)
+
+    slowest = sorted(((statistics.median(values), name) for name, values in modules.items()), reverse=True)
+    return {
+        "repeat": args.repeat,
+        "import_main": statistics.median(imports),
+        "startup_live": statistics.median(startup["live"]) if startup["live"] else None,
+        "startup_ready": statistics.median(startup["ready"]) if startup["ready"] else None,
+        "modules": {name: seconds for seconds, name in slowest[:args.top]}
+    }
+
+
+def format_seconds(value) -> str:
+    return "-" if value is None else f"{value * 1000:.0f} ms"
+
+
+def print_report(report: dict) -> None:
+    print(f"\nЗамеров: {report['repeat']} (медианы)")
+    print(f"import main    {format_seconds(report['import_main']):>8}")
+    print(f"/ отвечает     {format_seconds(report['startup_live']):>8}")
+    print(f"/ready         {format_seconds(report['startup_ready']):>8}")
+    print("\nСамые долгие импорты main.py:")
+    for name, seconds in report["modules"].items():
+        print(f"  {name:<32} {format_seconds(seconds):>8}")
+
+
+def check_regression(report: dict, baseline_path: str, max_regression: float) -> List[str]:
+    """Сравнивает время импорта и запуска с сохраненным отчетом"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    problems = []
+    for name in ("import_main", "startup_live", "startup_ready"):
+        old, new = baseline.get(name), report[name]
+        if old and new and new > old * (1 + max_regression):
+            problems.append(f"{name}: {format_seconds(old)} -> {format_seconds(new)}")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="число замеров")
+    parser.add_argument("--top", type=int, default=10, help="сколько самых долгих импортов показать")
+    parser.add_argument("--skip-startup", action="store_true", help="замерять только импорт")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--json", help="сохранить отчет в файл")
+    parser.add_argument("--baseline", help="отчет для сравнения (--json предыдущего запуска)")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        problems = check_regression(report, args.baseline, args.max_regression)
+        if problems:
+            print("\nРегрессия времени запуска:\n  " + "\n  ".join(problems))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
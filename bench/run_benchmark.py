@@ -0,0 +1,404 @@
+"""Нагрузочный тест /webhook на локальных заглушках внешних сервисов.
+
+Бот запускается отдельным процессом uvicorn, все внешние API (Telegram,
+OpenAI, Unsplash, Mochi) подменяются заглушками из fake_services.py.
+Обновления воспроизводятся из JSONL файла с заданной частотой.
+
+Пример:
+    python bench/run_benchmark.py --updates bench/sample_updates.jsonl --rate 20 --count 300 \\
+        --latency openai=0.8:0.3 --latency unsplash=0.2 --errors openai=0.01 --callback-ratio 0.3
+
+С --mode polling бот получает те же обновления через getUpdates заглушки
+Telegram, что позволяет сравнить режимы webhook и polling.
+
+Строка JSONL - либо готовое обновление Telegram (с update_id), либо объект
+с полем text (также принимаются word и title, как в requests.jsonl).
+"""
+import os
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_services import SERVICES, FakeState, ServiceProfile, TelegramEvent, create_app  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Перцентиль по методу ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values: List[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None
+    }
+
+
+def parse_profiles(args: argparse.Namespace) -> Dict[str, ServiceProfile]:
+    """--latency service=mean[:jitter] и --errors service=rate"""
+    profiles = {name: ServiceProfile() for name in SERVICES}
+    for item in args.latency:
+        name, value = item.split("=", 1)
+        mean, _, jitter = value.partition(":")
+        profiles[name].latency = float(mean)
+        profiles[name].jitter = float(jitter or 0)
+    for item in args.errors:
+        name, value = item.split("=", 1)
+        profiles[name].error_rate = float(value)
+    return profiles
+
+
+def load_updates(path: str, count: int, users: int) -> List[dict]:
+    """Читает JSONL и приводит строки к обновлениям Telegram с уникальными update_id"""
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    if not rows:
+        raise SystemExit(f"Файл {path} пуст")
+
+    updates = []
+    for index in range(count):
+        row = rows[index % len(rows)]
+        if "update_id" in row:
+            update = json.loads(json.dumps(row))
+        else:
+            text = row.get("text") or row.get("word") or row.get("title")
+            chat_id = 10_000 + index % users
+            update = {"message": {
+                "message_id": index + 1,
+                "date": int(time.time()),
+                "from": {"id": chat_id, "is_bot": False, "first_name": f"Bench{chat_id}"},
+                "chat": {"id": chat_id, "type": "private"},
+                "text": text
+            }}
+        update["update_id"] = index + 1
+        updates.append(update)
+    return updates
+
+
+class Tracker:
+    """Сопоставляет отправленные обновления с ответами, пришедшими в заглушку Telegram"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent_at: Dict[Tuple[int, int], float] = {}
+        self.translation_latency: List[float] = []
+        self.translation_errors = 0
+        self.completed: Dict[Tuple[int, int], float] = {}
+        self.export_sent_at: Dict[Tuple[int, int], float] = {}
+        self.export_latency: List[float] = []
+        self.export_results: Dict[str, int] = {}
+
+    def on_event(self, event: TelegramEvent) -> None:
+        chat_id = int(event.params.get("chat_id", 0) or 0)
+        markup = event.params.get("reply_markup", "")
+
+        if event.method in ("sendPhoto", "sendMessage", "editMessageText") and "add_mochi_" in markup:
+            # callback_data кнопки содержит message_id исходного сообщения пользователя
+            message_id = int(json.loads(markup)["inline_keyboard"][0][0]["callback_data"].rsplit("_", 1)[1])
+            with self.lock:
+                sent_at = self.sent_at.pop((chat_id, message_id), None)
+                if sent_at is not None:
+                    self.translation_latency.append(event.at - sent_at)
+                    self.completed[(chat_id, message_id)] = event.at
+            return
+
+        text = event.params.get("text", "")
+        if event.method == "sendMessage" and text.startswith("Произошла ошибка"):
+            message_id = int(event.params.get("reply_to_message_id", 0) or 0)
+            with self.lock:
+                if self.sent_at.pop((chat_id, message_id), None) is not None:
+                    self.translation_errors += 1
+            return
+
+        if event.method == "editMessageReplyMarkup" and markup:
+            # Промежуточная кнопка "⏳ Добавляется..." не означает завершение экспорта
+            label = json.loads(markup)["inline_keyboard"][0][0]["text"]
+            if label.startswith("⏳"):
+                return
+            key = (chat_id, int(event.params.get("message_id", 0)))
+            with self.lock:
+                sent_at = self.export_sent_at.pop(key, None)
+                if sent_at is not None:
+                    self.export_latency.append(event.at - sent_at)
+                    self.export_results[label] = self.export_results.get(label, 0) + 1
+
+
+def start_fake_server(state: FakeState, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(create_app(state), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def start_bot(args: argparse.Namespace, fake_url: str, data_dir: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "TOKEN": "123456:bench",
+        "TELEGRAM_API_URL": f"{fake_url}/telegram/bot{{0}}/{{1}}",
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{fake_url}/openai/v1",
+        "UNSPLASH_ACCESS_KEY": "bench",
+        "UNSPLASH_API_URL": f"{fake_url}/unsplash",
+        "MOCHI_API_KEY": "bench",
+        "MOCHI_API_URL": f"{fake_url}/mochi/api/",
+        "CACHE_DB_PATH": os.path.join(data_dir, "cache.sqlite3"),
+        "EXPORT_QUEUE_PATH": os.path.join(data_dir, "export_queue.sqlite3"),
+        "LOADING_GIF_CHAT_ID": "",
+        "BOT_MODE": getattr(args, "mode", "webhook")
+    })
+    for item in args.env:
+        key, value = item.split("=", 1)
+        env[key] = value
+
+    log = open(os.path.join(data_dir, "bot.log"), "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.bot_port),
+         "--log-level", "warning"],
+        cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            log.close()
+            with open(log.name, encoding="utf-8") as f:
+                raise SystemExit(f"Бот завершился при запуске:\n{f.read()[-3000:]}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{args.bot_port}/ready", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise SystemExit("Бот не запустился за 60 секунд")
+
+
+async def replay(args: argparse.Namespace, updates: List[dict], tracker: Tracker,
+                 state: Optional[FakeState] = None) -> dict:
+    """Отправляет обновления с частотой args.rate и ждет ответов.
+
+    В режиме polling обновления не отправляются в /webhook, а передаются в getUpdates заглушки state.
+    """
+    polling = getattr(args, "mode", "webhook") == "polling"
+    bot_url = f"http://127.0.0.1:{args.bot_port}"
+    ack_latency: List[float] = []
+    ack_status: Dict[int, int] = {}
+    callbacks: List[asyncio.Task] = []
+    next_update_id = len(updates) + 1
+
+    limits = httpx.Limits(max_connections=200, max_keepalive_connections=200)
+    async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+
+        async def post(update: dict) -> None:
+            if polling:
+                state.push_update(update)
+                return
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{bot_url}/webhook", json=update)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            ack_latency.append(time.perf_counter() - start)
+            ack_status[status] = ack_status.get(status, 0) + 1
+
+        async def click_mochi(chat_id: int, message_id: int) -> None:
+            # Нажимаем кнопку, когда придет ответ с переводом
+            nonlocal next_update_id
+            deadline = time.monotonic() + args.timeout
+            while time.monotonic() < deadline:
+                with tracker.lock:
+                    done = (chat_id, message_id) in tracker.completed
+                if done:
+                    break
+                await asyncio.sleep(0.05)
+            else:
+                return
+
+            bot_message_id = 5_000_000 + message_id
+            update_id = next_update_id
+            next_update_id += 1
+            with tracker.lock:
+                tracker.export_sent_at[(chat_id, bot_message_id)] = time.perf_counter()
+            await post({"update_id": update_id, "callback_query": {
+                "id": str(update_id),
+                "from": {"id": chat_id, "is_bot": False, "first_name": f"Bench{chat_id}"},
+                "chat_instance": "bench",
+                "data": f"add_mochi_{message_id}",
+                "message": {"message_id": bot_message_id, "date": int(time.time()),
+                            "chat": {"id": chat_id, "type": "private"}}
+            }})
+
+        started = time.perf_counter()
+        tasks = []
+        for index, update in enumerate(updates):
+            delay = started + index / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            message = update.get("message")
+            if message:
+                key = (message["chat"]["id"], message["message_id"])
+                with tracker.lock:
+                    tracker.sent_at[key] = time.perf_counter()
+                if random.random() < args.callback_ratio:
+                    callbacks.append(asyncio.create_task(click_mochi(*key)))
+            tasks.append(asyncio.create_task(post(update)))
+
+        await asyncio.gather(*tasks)
+        sending_time = time.perf_counter() - started
+
+        # Ждем ответов на все сообщения и завершения экспорта
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            with tracker.lock:
+                pending = len(tracker.sent_at) + len(tracker.export_sent_at)
+            if not pending and all(task.done() for task in callbacks):
+                break
+            await asyncio.sleep(0.1)
+        await asyncio.gather(*callbacks, return_exceptions=True)
+        elapsed = time.perf_counter() - started
+
+        try:
+            bot_stats = (await client.get(f"{bot_url}/stats")).json()
+        except Exception:
+            bot_stats = None
+
+    with tracker.lock:
+        completed = len(tracker.translation_latency)
+        return {
+            "updates": len(updates),
+            "mode": "polling" if polling else "webhook",
+            "rate": args.rate,
+            "sending_time": sending_time,
+            "elapsed": elapsed,
+            "throughput": completed / elapsed if elapsed else 0,
+            "webhook_ack": summarize(ack_latency),
+            "webhook_status": ack_status,
+            "translation": dict(summarize(tracker.translation_latency),
+                                errors=tracker.translation_errors, lost=len(tracker.sent_at)),
+            "mochi_export": dict(summarize(tracker.export_latency),
+                                 results=tracker.export_results, lost=len(tracker.export_sent_at)),
+            "bot_stats": bot_stats
+        }
+
+
+def stage_report(state: FakeState) -> dict:
+    with state.lock:
+        return {
+            f"{service}.{operation}": dict(summarize(durations), errors=state.errors.get((service, operation), 0))
+            for (service, operation), durations in sorted(state.timings.items())
+        }
+
+
+def format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.0f} ms"
+
+
+def print_report(report: dict) -> None:
+    print(f"\nРежим: {report.get('mode', 'webhook')}, обновлений: {report['updates']}, частота: {report['rate']}/с, "
+          f"время: {report['elapsed']:.1f} с, пропускная способность: {report['throughput']:.2f} переводов/с")
+    for name in ("webhook_ack", "translation", "mochi_export"):
+        row = report[name]
+        extra = {key: value for key, value in row.items() if key not in ("count", "p50", "p95", "p99", "max")}
+        print(f"{name:<14} n={row['count']:<5} p50={format_seconds(row['p50']):>8} "
+              f"p95={format_seconds(row['p95']):>8} p99={format_seconds(row['p99']):>8} {extra or ''}")
+    print(f"Статусы webhook: {report['webhook_status']}")
+    print("\nЭтапы (время ответа заглушек):")
+    for name, row in report["stages"].items():
+        print(f"  {name:<32} n={row['count']:<5} p50={format_seconds(row['p50']):>8} "
+              f"p95={format_seconds(row['p95']):>8} ошибок={row['errors']}")
+
+
+def check_regression(report: dict, baseline_path: str, max_regression: float) -> List[str]:
+    """Сравнивает p95/p99 с сохраненным отчетом"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    problems = []
+    for name, metric in (("webhook_ack", "p99"), ("translation", "p95"), ("translation", "p99"),
+                         ("mochi_export", "p95")):
+        old, new = baseline.get(name, {}).get(metric), report[name][metric]
+        if old and new and new > old * (1 + max_regression):
+            problems.append(f"{name}.{metric}: {format_seconds(old)} -> {format_seconds(new)}")
+    if report["throughput"] < baseline.get("throughput", 0) * (1 - max_regression):
+        problems.append(f"throughput: {baseline['throughput']:.2f} -> {report['throughput']:.2f}")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", default=os.path.join(REPO_ROOT, "bench", "sample_updates.jsonl"))
+    parser.add_argument("--count", type=int, default=200, help="сколько обновлений отправить")
+    parser.add_argument("--rate", type=float, default=10, help="обновлений в секунду")
+    parser.add_argument("--users", type=int, default=20, help="число разных чатов")
+    parser.add_argument("--callback-ratio", type=float, default=0.0, help="доля переводов с нажатием кнопки Mochi")
+    parser.add_argument("--latency", action="append", default=[], metavar="SERVICE=MEAN[:JITTER]")
+    parser.add_argument("--errors", action="append", default=[], metavar="SERVICE=RATE")
+    parser.add_argument("--mode", choices=("webhook", "polling"), default="webhook",
+                        help="как бот получает обновления")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="настройки бота")
+    parser.add_argument("--timeout", type=float, default=60, help="сколько ждать ответов после отправки")
+    parser.add_argument("--fake-port", type=int, default=8765)
+    parser.add_argument("--bot-port", type=int, default=8766)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="сохранить отчет в файл")
+    parser.add_argument("--baseline", help="отчет для сравнения (--json предыдущего запуска)")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    state = FakeState(profiles=parse_profiles(args))
+    tracker = Tracker()
+    state.listeners.append(tracker.on_event)
+
+    start_fake_server(state, args.fake_port)
+    with tempfile.TemporaryDirectory(prefix="bot-bench-") as data_dir:
+        bot = start_bot(args, f"http://127.0.0.1:{args.fake_port}", data_dir)
+        try:
+            report = asyncio.run(replay(args, load_updates(args.updates, args.count, args.users), tracker, state))
+        finally:
+            bot.send_signal(signal.SIGINT)
+            try:
+                bot.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+
+    report["stages"] = stage_report(state)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        problems = check_regression(report, args.baseline, args.max_regression)
+        if problems:
+            print("\nРегрессия производительности:\n  " + "\n  ".join(problems))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
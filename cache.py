@@ -0,0 +1,496 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCache:
+    """LRU кэш в памяти процесса с ограничением по размеру и TTL"""
+
+    def __init__(self, max_entries: int = 10000, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_entry(self, key: str) -> Optional[Tuple[Any, Optional[float]]]:
+        """Возвращает (значение, время истечения) или None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at = entry[1]
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, expires_at: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        if expires_at is None and ttl is not None:
+            expires_at = time.time() + ttl
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Записывает значение, только если ключа нет или он истек. True, если запись добавлена"""
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                return False
+            self._data[key] = (value, now + ttl if ttl is not None else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def transform(self, key: str, func: Callable[[Any], Tuple[Any, Any]], ttl: Optional[float] = None) -> Any:
+        """Атомарно заменяет значение: func(текущее значение или None) -> (новое значение, результат)"""
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            current = entry[0] if entry is not None and (entry[1] is None or entry[1] > now) else None
+            value, result = func(current)
+            self._data[key] = (value, now + ttl if ttl is not None else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def approx_bytes(self) -> int:
+        """Примерный объем данных (размер значений в JSON)"""
+        with self._lock:
+            values = [entry[0] for entry in self._data.values()]
+        return sum(len(json.dumps(value, ensure_ascii=False).encode("utf-8")) for value in values)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._data)
+        }
+
+
+class SQLiteCache:
+    """Кэш в SQLite с TTL и вытеснением давно не использованных записей.
+
+    Несколько кэшей могут жить в одном файле, каждый в своем namespace.
+    """
+
+    # Как часто (в операциях записи) проверять превышение размера
+    EVICT_EVERY = 100
+    # Время последнего обращения обновляется не чаще этого интервала (секунды):
+    # чтение без записи не ждет блокировку файла, которую делят процессы
+    ACCESS_RESOLUTION = 60
+
+    def __init__(self, path: str, namespace: str, max_entries: int = 100000, ttl: Optional[float] = None):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (namespace, accessed_at)"
+            )
+            self._conn.commit()
+
+    def get_entry(self, key: str) -> Optional[Tuple[Any, Optional[float]]]:
+        """Возвращает (значение, время истечения) или None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at, accessed_at FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            value, expires_at, accessed_at = row
+            if expires_at is not None and expires_at <= now:
+                # Просроченную запись удалит _evict при очередной записи
+                self.misses += 1
+                return None
+
+            if now - accessed_at >= self.ACCESS_RESOLUTION:
+                self._conn.execute(
+                    "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                    (now, self.namespace, key)
+                )
+                self._conn.commit()
+            self.hits += 1
+
+        return json.loads(value), expires_at
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, expires_at: Optional[float] = None) -> None:
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        if expires_at is None and ttl is not None:
+            expires_at = now + ttl
+
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, payload, expires_at, now)
+            )
+            self._conn.commit()
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict(now)
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Записывает значение, только если ключа нет или он истек. True, если запись добавлена.
+
+        Проверка атомарна и для нескольких процессов, работающих с одним файлом.
+        """
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl is not None else None
+
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+                (self.namespace, key, now)
+            )
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO cache (namespace, key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, payload, expires_at, now)
+            )
+            self._conn.commit()
+            added = cursor.rowcount == 1
+            if added:
+                self._writes += 1
+                if self._writes % self.EVICT_EVERY == 0:
+                    self._evict(now)
+        return added
+
+    def transform(self, key: str, func: Callable[[Any], Tuple[Any, Any]], ttl: Optional[float] = None) -> Any:
+        """Атомарно заменяет значение: func(текущее значение или None) -> (новое значение, результат).
+
+        Чтение и запись идут в одной транзакции BEGIN IMMEDIATE, поэтому
+        операция атомарна и для нескольких процессов.
+        """
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl is not None else None
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                    (self.namespace, key)
+                ).fetchone()
+                current = json.loads(row[0]) if row is not None and (row[1] is None or row[1] > now) else None
+                value, result = func(current)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at, now)
+                )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict(now)
+        return result
+
+    def _evict(self, now: float) -> None:
+        """Удаляет просроченные записи и самые старые записи сверх лимита"""
+        cursor = self._conn.execute(
+            "DELETE FROM cache WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+            (self.namespace, now)
+        )
+        removed = cursor.rowcount
+
+        (count,) = self._conn.execute(
+            "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        if count > self.max_entries:
+            cursor = self._conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                "SELECT key FROM cache WHERE namespace = ? ORDER BY accessed_at LIMIT ?)",
+                (self.namespace, self.namespace, count - self.max_entries)
+            )
+            removed += cursor.rowcount
+
+        self._conn.commit()
+        if removed:
+            self.evictions += removed
+            logger.info(f"Кэш {self.namespace}: удалено записей {removed}")
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+        return count
+
+    def approx_bytes(self) -> int:
+        """Объем значений в хранилище в байтах"""
+        with self._lock:
+            (total,) = self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(CAST(value AS BLOB))), 0) FROM cache WHERE namespace = ?",
+                (self.namespace,)
+            ).fetchone()
+        return total
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self)
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RedisCache:
+    """Кэш в Redis: общий для процессов на разных машинах.
+
+    Интерфейс как у SQLiteCache, но без approx_bytes, а stats - без size:
+    размер хранилища смотрят средствами Redis. Срок жизни задается средствами
+    Redis, ограничение размера - политикой вытеснения сервера (maxmemory-policy),
+    max_entries не используется. Требуется пакет redis.
+    """
+
+    def __init__(self, url: str, namespace: str, ttl: Optional[float] = None, prefix: str = "bot"):
+        if redis is None:
+            raise RuntimeError("Для бэкенда redis установите пакет redis")
+        self.namespace = namespace
+        self.ttl = ttl
+        self._prefix = f"{prefix}:{namespace}:"
+        self._client = redis.Redis.from_url(url)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, key: str) -> str:
+        return self._prefix + key
+
+    @staticmethod
+    def _dump(value: Any, expires_at: Optional[float]) -> str:
+        # Время истечения хранится вместе со значением: оно нужно TieredCache
+        return json.dumps({"value": value, "expires_at": expires_at}, ensure_ascii=False)
+
+    @staticmethod
+    def _expiry(expires_at: Optional[float], now: float) -> Optional[int]:
+        return max(1, int((expires_at - now) * 1000)) if expires_at is not None else None
+
+    def get_entry(self, key: str) -> Optional[Tuple[Any, Optional[float]]]:
+        """Возвращает (значение, время истечения) или None"""
+        raw = self._client.get(self._key(key))
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        data = json.loads(raw)
+        return data["value"], data["expires_at"]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, expires_at: Optional[float] = None) -> None:
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        if expires_at is None and ttl is not None:
+            expires_at = now + ttl
+        self._client.set(self._key(key), self._dump(value, expires_at), px=self._expiry(expires_at, now))
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Записывает значение, только если ключа нет или он истек. True, если запись добавлена"""
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl is not None else None
+        return bool(self._client.set(
+            self._key(key), self._dump(value, expires_at), px=self._expiry(expires_at, now), nx=True
+        ))
+
+    def transform(self, key: str, func: Callable[[Any], Tuple[Any, Any]], ttl: Optional[float] = None) -> Any:
+        """Атомарно заменяет значение: func(текущее значение или None) -> (новое значение, результат)"""
+        ttl = self.ttl if ttl is None else ttl
+        redis_key = self._key(key)
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(redis_key)
+                    raw = pipe.get(redis_key)
+                    value, result = func(json.loads(raw)["value"] if raw is not None else None)
+                    now = time.time()
+                    expires_at = now + ttl if ttl is not None else None
+                    pipe.multi()
+                    pipe.set(redis_key, self._dump(value, expires_at), px=self._expiry(expires_at, now))
+                    pipe.execute()
+                    return result
+                except redis.WatchError:
+                    # Значение изменил другой процесс: повторяем
+                    continue
+
+    def delete(self, key: str) -> None:
+        self._client.delete(self._key(key))
+
+    def _keys(self):
+        return self._client.scan_iter(match=self._prefix + "*", count=1000)
+
+    def clear(self) -> None:
+        for key in self._keys():
+            self._client.delete(key)
+
+    def __len__(self) -> int:
+        """Число ключей namespace: обходит все ключи (SCAN), поэтому не используется в stats"""
+        return sum(1 for _ in self._keys())
+
+    def stats(self) -> dict:
+        # Только счетчики процесса: /metrics и /stats не обходят ключи Redis
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def close(self) -> None:
+        self._client.close()
+
+
+class TieredCache:
+    """Двухуровневый кэш: LRU в памяти поверх постоянного хранилища"""
+
+    def __init__(self, memory: MemoryCache, storage: SQLiteCache):
+        self.memory = memory
+        self.storage = storage
+        self.hits = 0
+        self.misses = 0
+
+    def get_entry(self, key: str) -> Optional[Tuple[Any, Optional[float]]]:
+        """Возвращает (значение, время истечения) или None"""
+        entry = self.memory.get_entry(key)
+        if entry is None:
+            entry = self.storage.get_entry(key)
+            if entry is not None:
+                # Поднимаем запись в память с тем же сроком жизни
+                self.memory.set(key, entry[0], expires_at=entry[1])
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.storage.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        self.memory.set(key, value, expires_at=expires_at)
+        self.storage.set(key, value, expires_at=expires_at)
+
+    def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        self.storage.delete(key)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory": self.memory.stats(),
+            "storage": self.storage.stats()
+        }
@@ -0,0 +1,111 @@
+import re
+from dataclasses import dataclass, replace
+from typing import Any, List, Optional, Sequence, Tuple
+
+# Нумерация примеров в текстовом ответе LLM ("1. ", "2) ")
+_NUMBER_RE = re.compile(r"^\d+[.)]\s*")
+
+
+@dataclass(slots=True)
+class TranslationCard:
+    """Перевод слова: создается один раз в конвейере перевода и используется до экспорта в Mochi.
+
+    Из одной записи строятся ответ в Telegram (render_telegram) и карточка
+    Mochi (render_mochi). В кэше переводов, хранилище карточек и очереди
+    экспорта хранится компактный список полей (dump/load) вместо словаря
+    с текстом ответа LLM.
+    """
+
+    word: str
+    translation: str
+    examples: Tuple[str, ...] = ()
+    # Язык слова (ru, en, other - см. dictionary.detect_language)
+    source: str = ""
+    image_keyword: Optional[str] = None
+    image_url: Optional[str] = None
+
+    @classmethod
+    def from_fields(cls, word: str, translation: str, examples: Sequence[str] = (), source: str = "",
+                    image_keyword: Optional[str] = None) -> "TranslationCard":
+        """Карточка из структурированного ответа LLM или записи словаря"""
+        return cls(
+            word=word,
+            translation=translation.strip(),
+            examples=tuple(example.strip() for example in examples if example.strip()),
+            source=source,
+            image_keyword=(image_keyword or "").strip() or None
+        )
+
+    @classmethod
+    def parse(cls, word: str, text: str, source: str = "") -> "TranslationCard":
+        """Разбирает текстовый ответ цепочки translation (строки Перевод: и Примеры:)"""
+        translation, examples = text.strip(), []
+        if "Перевод:" in text:
+            translation, _, rest = text.split("Перевод:", 1)[1].partition("Примеры:")
+            examples = [_NUMBER_RE.sub("", line.strip()) for line in rest.splitlines()]
+        return cls.from_fields(word, translation, examples, source)
+
+    def dump(self) -> List[Any]:
+        """Компактное представление для JSON: список полей без пустых в конце"""
+        data = [self.word, self.translation, list(self.examples), self.source, self.image_keyword, self.image_url]
+        while data and not data[-1]:
+            data.pop()
+        return data
+
+    @classmethod
+    def load(cls, data: Any, word: Optional[str] = None) -> "TranslationCard":
+        """Восстанавливает карточку из dump. Словари старого формата ({"translation": текст ответа LLM, ...}) разбираются"""
+        if isinstance(data, dict):
+            card = cls.parse(data.get("word") or word or "", data.get("translation") or "")
+            card.image_keyword = data.get("image_keyword") or None
+            card.image_url = data.get("image_url")
+        else:
+            fields = list(data) + [None] * (6 - len(data))
+            card = cls(
+                word=fields[0] or "",
+                translation=fields[1] or "",
+                examples=tuple(fields[2] or ()),
+                source=fields[3] or "",
+                image_keyword=fields[4],
+                image_url=fields[5]
+            )
+        if word is not None:
+            card.word = word
+        return card
+
+    def with_image(self, image_url: Optional[str]) -> "TranslationCard":
+        return replace(self, image_url=image_url)
+
+    def with_keyword(self, image_keyword: Optional[str]) -> "TranslationCard":
+        return replace(self, image_keyword=image_keyword)
+
+    def _numbered_examples(self, examples: Optional[Sequence[str]] = None) -> str:
+        examples = self.examples if examples is None else examples
+        return "\n".join(f"{index}. {example}" for index, example in enumerate(examples, 1))
+
+    def render_telegram(self, max_length: Optional[int] = None) -> str:
+        """Ответ пользователю с Markdown разметкой.
+
+        С max_length (подпись фото - до 1024 символов) лишние примеры отбрасываются
+        целиком до разметки, поэтому обрезка не разрывает Markdown сущности.
+        """
+        header = f"📝 *Слово:* {self.word}\n\n*Перевод:* "
+        examples = list(self.examples)
+        while True:
+            text = header + self.translation
+            if examples:
+                text += f"\n\n*Примеры:*\n{self._numbered_examples(examples)}"
+            if max_length is None or len(text) <= max_length or not examples:
+                break
+            examples.pop()
+        if max_length is not None and len(text) > max_length:
+            # Без примеров не помещается только очень длинный перевод: он без нашей разметки
+            text = header + self.translation[:max(0, max_length - len(header) - 1)] + "…"
+        return text
+
+    def render_mochi(self) -> Tuple[str, str]:
+        """Лицевая и обратная стороны карточки Mochi: слово, перевод и примеры"""
+        back = f"## {self.translation}"
+        if self.examples:
+            back += f"\n\n{self._numbered_examples()}"
+        return f"# {self.word}", back
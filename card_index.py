@@ -0,0 +1,223 @@
+import os
+import re
+import time
+import sqlite3
+import difflib
+import logging
+import threading
+from typing import Dict, Iterable, Optional, Set
+from shared_state import storage_backend_name
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+_IMAGE_RE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+
+
+def normalize_front(text: str) -> str:
+    """Нормализует лицевую сторону карточки: без изображений, markdown заголовков и лишних пробелов"""
+    text = _IMAGE_RE.sub(" ", text or "")
+    return " ".join(text.replace('#', ' ').lower().split())
+
+
+class CardIndex:
+    """Локальный индекс лицевых сторон карточек по колодам.
+
+    Индекс хранится в SQLite (переживает перезапуск) и общий для процессов,
+    работающих с одним файлом. Точная проверка - запрос по первичному ключу
+    (deck_id, front). Для нечеткого поиска колода загружается в память;
+    копия сбрасывается, когда другой процесс изменил файл (PRAGMA data_version).
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._fronts: Dict[str, Set[str]] = {}
+        self._data_version: Optional[int] = None
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path or ":memory:", check_same_thread=False, timeout=10)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS card_index (
+                    deck_id TEXT NOT NULL,
+                    front TEXT NOT NULL,
+                    PRIMARY KEY (deck_id, front)
+                )"""
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS card_index_decks (
+                    deck_id TEXT PRIMARY KEY,
+                    built_at REAL NOT NULL
+                )"""
+            )
+            self._conn.commit()
+
+    def is_built(self, deck_id: str) -> bool:
+        """Проверяет, что индекс колоды построен и не устарел"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT built_at FROM card_index_decks WHERE deck_id = ?", (deck_id,)
+            ).fetchone()
+        if row is None:
+            return False
+        return self.ttl is None or time.time() - row[0] < self.ttl
+
+    def rebuild(self, deck_id: str, fronts: Iterable[str]) -> None:
+        """Полностью перестраивает индекс колоды"""
+        normalized = {normalize_front(front) for front in fronts}
+        normalized.discard("")
+        with self._lock:
+            self._conn.execute("DELETE FROM card_index WHERE deck_id = ?", (deck_id,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO card_index (deck_id, front) VALUES (?, ?)",
+                [(deck_id, front) for front in normalized]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO card_index_decks (deck_id, built_at) VALUES (?, ?)",
+                (deck_id, time.time())
+            )
+            self._conn.commit()
+            self._fronts[deck_id] = normalized
+        logger.info(f"Индекс колоды {deck_id} построен: {len(normalized)} карточек")
+
+    def add(self, deck_id: str, front_text: str) -> None:
+        """Добавляет карточку в индекс колоды"""
+        front = normalize_front(front_text)
+        if not front:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO card_index (deck_id, front) VALUES (?, ?)", (deck_id, front)
+            )
+            self._conn.commit()
+            if deck_id in self._fronts:
+                self._fronts[deck_id].add(front)
+
+    def invalidate(self, deck_id: str) -> None:
+        """Помечает индекс колоды устаревшим"""
+        with self._lock:
+            self._conn.execute("DELETE FROM card_index_decks WHERE deck_id = ?", (deck_id,))
+            self._conn.commit()
+            self._fronts.pop(deck_id, None)
+
+    def _deck_fronts(self, deck_id: str) -> Set[str]:
+        with self._lock:
+            # data_version меняется только после записи другим соединением: свои записи уже в _fronts
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._fronts.clear()
+                self._data_version = data_version
+            fronts = self._fronts.get(deck_id)
+            if fronts is None:
+                rows = self._conn.execute(
+                    "SELECT front FROM card_index WHERE deck_id = ?", (deck_id,)
+                ).fetchall()
+                fronts = {row[0] for row in rows}
+                self._fronts[deck_id] = fronts
+            return fronts
+
+    def contains(self, deck_id: str, front_text: str) -> bool:
+        """Точное совпадение нормализованной лицевой стороны"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM card_index WHERE deck_id = ? AND front = ?", (deck_id, normalize_front(front_text))
+            ).fetchone()
+        return row is not None
+
+    def find_similar(self, deck_id: str, front_text: str, cutoff: float = 0.85) -> Optional[str]:
+        """Нечеткий поиск: возвращает самую похожую лицевую сторону или None"""
+        front = normalize_front(front_text)
+        with self._lock:
+            fronts = list(self._deck_fronts(deck_id))
+        if front in fronts:
+            return front
+        matches = difflib.get_close_matches(front, fronts, n=1, cutoff=cutoff)
+        return matches[0] if matches else None
+
+    def size(self, deck_id: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM card_index WHERE deck_id = ?", (deck_id,)).fetchone()[0]
+
+
+class RedisCardIndex:
+    """Индекс лицевых сторон карточек в Redis: общий для процессов на разных машинах.
+
+    Интерфейс как у CardIndex. Колода - множество нормализованных лицевых
+    сторон, отметка о построении индекса истекает через ttl средствами Redis.
+    Требуется пакет redis.
+    """
+
+    def __init__(self, url: str, ttl: Optional[float] = None, prefix: str = "bot"):
+        if redis is None:
+            raise RuntimeError("Для бэкенда redis установите пакет redis")
+        self.ttl = ttl
+        self._prefix = f"{prefix}:card_index:"
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+
+    def _fronts_key(self, deck_id: str) -> str:
+        return f"{self._prefix}{deck_id}:fronts"
+
+    def _built_key(self, deck_id: str) -> str:
+        return f"{self._prefix}{deck_id}:built_at"
+
+    def is_built(self, deck_id: str) -> bool:
+        """Проверяет, что индекс колоды построен и не устарел"""
+        return bool(self._client.exists(self._built_key(deck_id)))
+
+    def rebuild(self, deck_id: str, fronts: Iterable[str]) -> None:
+        """Полностью перестраивает индекс колоды"""
+        normalized = {normalize_front(front) for front in fronts}
+        normalized.discard("")
+        pipe = self._client.pipeline(transaction=True)
+        pipe.delete(self._fronts_key(deck_id))
+        if normalized:
+            pipe.sadd(self._fronts_key(deck_id), *normalized)
+        pipe.set(self._built_key(deck_id), time.time(), px=int(self.ttl * 1000) if self.ttl is not None else None)
+        pipe.execute()
+        logger.info(f"Индекс колоды {deck_id} построен: {len(normalized)} карточек")
+
+    def add(self, deck_id: str, front_text: str) -> None:
+        """Добавляет карточку в индекс колоды"""
+        front = normalize_front(front_text)
+        if front:
+            self._client.sadd(self._fronts_key(deck_id), front)
+
+    def invalidate(self, deck_id: str) -> None:
+        """Помечает индекс колоды устаревшим"""
+        self._client.delete(self._built_key(deck_id))
+
+    def contains(self, deck_id: str, front_text: str) -> bool:
+        """Точное совпадение нормализованной лицевой стороны"""
+        return bool(self._client.sismember(self._fronts_key(deck_id), normalize_front(front_text)))
+
+    def find_similar(self, deck_id: str, front_text: str, cutoff: float = 0.85) -> Optional[str]:
+        """Нечеткий поиск: возвращает самую похожую лицевую сторону или None"""
+        front = normalize_front(front_text)
+        if self.contains(deck_id, front):
+            return front
+        fronts = list(self._client.smembers(self._fronts_key(deck_id)))
+        matches = difflib.get_close_matches(front, fronts, n=1, cutoff=cutoff)
+        return matches[0] if matches else None
+
+    def size(self, deck_id: str) -> int:
+        return self._client.scard(self._fronts_key(deck_id))
+
+
+def create_card_index(path: str, ttl: Optional[float] = None):
+    """Индекс карточек в общем хранилище: Redis, если SHARED_STATE_BACKEND=redis, иначе файл SQLite"""
+    if storage_backend_name() == "redis":
+        return RedisCardIndex(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            ttl=ttl,
+            prefix=os.getenv("REDIS_PREFIX", "bot")
+        )
+    return CardIndex(path, ttl=ttl)
@@ -0,0 +1,49 @@
+import os
+import logging
+from typing import Optional
+from shared_state import backend_name, create_backend
+
+logger = logging.getLogger(__name__)
+
+
+class PendingCardStore:
+    """Карточки, ожидающие добавления в Mochi.
+
+    Ключ - (chat_id, message_id): message_id уникален только в пределах чата.
+    Бэкенд - MemoryCache (LRU + TTL в памяти процесса), SQLiteCache
+    (общий файл для нескольких процессов) или RedisCache (несколько машин).
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def _key(chat_id: int, message_id: int) -> str:
+        return f"{chat_id}:{message_id}"
+
+    def put(self, chat_id: int, message_id: int, card: dict) -> None:
+        self.backend.set(self._key(chat_id, message_id), card)
+
+    def get(self, chat_id: int, message_id: int) -> Optional[dict]:
+        return self.backend.get(self._key(chat_id, message_id))
+
+    def delete(self, chat_id: int, message_id: int) -> None:
+        self.backend.delete(self._key(chat_id, message_id))
+
+    def stats(self) -> dict:
+        stats = self.backend.stats()
+        # У RedisCache объема нет: подсчет обходил бы все ключи
+        if hasattr(self.backend, "approx_bytes"):
+            stats["bytes"] = self.backend.approx_bytes()
+        return stats
+
+
+def create_pending_store() -> PendingCardStore:
+    """Создает хранилище по настройкам окружения (PENDING_STORE_BACKEND или SHARED_STATE_BACKEND)"""
+    backend = create_backend(
+        "pending_cards",
+        backend_name("PENDING_STORE_BACKEND"),
+        max_entries=int(os.getenv("PENDING_CARD_MAX_ENTRIES", "10000")),
+        ttl=float(os.getenv("PENDING_CARD_TTL", str(24 * 3600)))
+    )
+    return PendingCardStore(backend)
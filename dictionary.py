@@ -0,0 +1,162 @@
+import os
+import sys
+import mmap
+import logging
+import argparse
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Направление перевода по языку исходного текста: (откуда, куда) для промпта.
+# Для other направления нет: язык определяет модель (см. main.translation_inputs)
+DIRECTIONS = {
+    "ru": ("русского", "английский"),
+    "en": ("английского", "русский")
+}
+
+# Разделитель примеров в файле словаря
+EXAMPLES_SEPARATOR = " | "
+
+_STRIP_CHARS = " \t.,!?;:\"'«»()"
+
+
+def detect_language(text: str, dictionary: Optional["OfflineDictionary"] = None) -> str:
+    """Определяет язык: ru (кириллица), en или other.
+
+    Латиница - еще не английский (bonjour, hola, Straße), поэтому en - только
+    если все слова текста есть в офлайн-словаре. Остальное - other.
+    """
+    cyrillic = latin = 0
+    for char in text:
+        if 'а' <= char.lower() <= 'я' or char in 'ёЁ':
+            cyrillic += 1
+        elif 'a' <= char.lower() <= 'z':
+            latin += 1
+    if cyrillic and cyrillic >= latin:
+        return "ru"
+    if latin and dictionary is not None and all(word in dictionary for word in text.split()):
+        return "en"
+    return "other"
+
+
+def normalize_word(text: str) -> str:
+    """Ключ словаря: нижний регистр, без окружающих знаков препинания"""
+    return " ".join(text.lower().split()).strip(_STRIP_CHARS)
+
+
+class OfflineDictionary:
+    """Офлайн-словарь частых слов.
+
+    Файл - TSV, отсортированный по байтам UTF-8 первого столбца (см. build):
+    слово<TAB>перевод<TAB>примеры через " | "<TAB>ключевое слово для изображения.
+    Файл открывается через mmap и не читается целиком: поиск - бинарный по
+    смещениям, нужные страницы подгружает ОС, поэтому запуск не зависит от
+    размера словаря.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.hits = 0
+        self.misses = 0
+
+    def _line_bounds(self, position: int) -> Tuple[int, int]:
+        start = self._data.rfind(b"\n", 0, position) + 1
+        end = self._data.find(b"\n", position)
+        return start, len(self._data) if end == -1 else end
+
+    def _find(self, key: bytes) -> Optional[bytes]:
+        low, high = 0, len(self._data)
+        while low < high:
+            start, end = self._line_bounds((low + high) // 2)
+            tab = self._data.find(b"\t", start, end)
+            line_key = self._data[start:tab if tab != -1 else end]
+            if line_key < key:
+                low = end + 1
+            elif line_key > key:
+                high = start
+            else:
+                return self._data[start:end]
+        return None
+
+    def __contains__(self, text: str) -> bool:
+        """Есть ли слово в словаре (без учета в статистике попаданий)"""
+        key = normalize_word(text)
+        return bool(key) and self._find(key.encode("utf-8")) is not None
+
+    def lookup(self, text: str) -> Optional[dict]:
+        """Возвращает поля перевода (translation, examples, image_keyword) или None"""
+        key = normalize_word(text)
+        line = self._find(key.encode("utf-8")) if key else None
+        if line is None:
+            self.misses += 1
+            return None
+
+        columns = line.decode("utf-8").rstrip("\r").split("\t")
+        examples = [example.strip() for example in columns[2].split(EXAMPLES_SEPARATOR)] if len(columns) > 2 else []
+        examples = [example for example in examples if example]
+        if len(columns) < 2 or not columns[1].strip() or not examples:
+            # Запись без перевода или примеров не заменит ответ LLM
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return {
+            "translation": columns[1].strip(),
+            "examples": examples,
+            "image_keyword": columns[3].strip() if len(columns) > 3 and columns[3].strip() else key
+        }
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data)
+        }
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+
+def load_dictionary(path: Optional[str]) -> Optional[OfflineDictionary]:
+    """Открывает словарь, если файл задан и существует"""
+    if not path:
+        return None
+    if not os.path.exists(path):
+        logger.warning(f"Файл словаря не найден: {path}")
+        return None
+    dictionary = OfflineDictionary(path)
+    logger.info(f"Офлайн-словарь: {path}")
+    return dictionary
+
+
+def build(source: str, destination: str) -> int:
+    """Нормализует и сортирует TSV для OfflineDictionary. Возвращает число записей"""
+    entries = {}
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            columns = line.rstrip("\r\n").split("\t")
+            if len(columns) < 3 or line.startswith("#"):
+                continue
+            key = normalize_word(columns[0])
+            # При повторе слова остается первая запись (обычно самое частое значение)
+            if key and key not in entries:
+                entries[key] = [key] + [column.strip() for column in columns[1:4]]
+
+    with open(destination, "w", encoding="utf-8", newline="\n") as f:
+        for key in sorted(entries, key=lambda word: word.encode("utf-8")):
+            f.write("\t".join(entries[key]) + "\n")
+    return len(entries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Подготовка офлайн-словаря для бота")
+    parser.add_argument("source", help="TSV: слово, перевод, примеры через ' | ', ключевое слово (необязательно)")
+    parser.add_argument("destination", help="отсортированный файл для DICTIONARY_PATH")
+    args = parser.parse_args()
+    count = build(args.source, args.destination)
+    print(f"Записей: {count}", file=sys.stderr)
@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Результаты обработки задания
+RESULT_ADDED = "added"
+RESULT_EXISTS = "exists"
+RESULT_FAILED = "failed"
+
+
+class ExportQueue:
+    """Постоянная очередь экспорта карточек в Mochi.
+
+    Задания хранятся в SQLite и переживают перезапуск. Задания одного
+    пользователя выполняются строго по порядку, воркер забирает их пачкой
+    (до batch_size за одну транзакцию). Ошибки повторяются с экспоненциальной
+    задержкой, после max_attempts попыток задание попадает в статус dead.
+    """
+
+    def __init__(self, path: str, handler: Callable[[dict], str],
+                 on_finish: Optional[Callable[[dict, str], None]] = None,
+                 workers: int = 2, batch_size: int = 10, max_attempts: int = 5,
+                 base_delay: float = 2, max_delay: float = 300, rate: float = 5,
+                 poll_interval: float = 0.5, lease_timeout: float = 600, retention: float = 7 * 24 * 3600):
+        self.handler = handler
+        self.on_finish = on_finish
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Не больше rate заданий в секунду на все воркеры
+        self.min_interval = 1 / rate if rate > 0 else 0
+        self.poll_interval = poll_interval
+        # Задание в статусе running дольше lease_timeout считается брошенным (процесс упал)
+        self.lease_timeout = lease_timeout
+        # Сколько хранить выполненные задания
+        self.retention = retention
+
+        self._lock = threading.Lock()
+        self._rate_lock = threading.Lock()
+        self._next_slot = 0.0
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # isolation_level=None: транзакции открываются явно (BEGIN IMMEDIATE)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS export_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    idempotency_key TEXT
+                )"""
+            )
+            # Очереди, созданные до появления ключей идемпотентности
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(export_jobs)")}
+            if "idempotency_key" not in columns:
+                self._conn.execute("ALTER TABLE export_jobs ADD COLUMN idempotency_key TEXT")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS export_jobs_status ON export_jobs (status, user_id, id)"
+            )
+            self._conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS export_jobs_idempotency ON export_jobs (idempotency_key)"
+            )
+
+    def enqueue(self, user_id: int, payload: dict, idempotency_key: Optional[str] = None) -> Optional[int]:
+        """Добавляет задание в очередь и возвращает его id.
+
+        Если задание с таким idempotency_key уже есть, новое не создается и возвращается None.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO export_jobs "
+                "(user_id, payload, next_attempt_at, created_at, updated_at, idempotency_key) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, json.dumps(payload, ensure_ascii=False), now, now, now, idempotency_key)
+            )
+        if cursor.rowcount != 1:
+            logger.info(f"Задание экспорта с ключом {idempotency_key} уже в очереди")
+            return None
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def _claim_batch(self) -> List[Tuple[int, int, dict]]:
+        """Забирает пачку готовых заданий одного пользователя"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE export_jobs SET status = 'pending' WHERE status = 'running' AND updated_at < ?",
+                    (now - self.lease_timeout,)
+                )
+
+                # Пользователь, у которого нет выполняющихся заданий и самое раннее задание уже готово
+                row = self._conn.execute(
+                    """SELECT j.user_id FROM export_jobs j
+                    WHERE j.status = 'pending'
+                      AND j.id = (SELECT MIN(id) FROM export_jobs WHERE user_id = j.user_id AND status = 'pending')
+                      AND j.next_attempt_at <= ?
+                      AND NOT EXISTS (SELECT 1 FROM export_jobs r WHERE r.user_id = j.user_id AND r.status = 'running')
+                    ORDER BY j.next_attempt_at LIMIT 1""",
+                    (now,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return []
+
+                rows = self._conn.execute(
+                    "SELECT id, attempts, payload FROM export_jobs "
+                    "WHERE user_id = ? AND status = 'pending' ORDER BY id LIMIT ?",
+                    (row[0], self.batch_size)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE export_jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                    [(now, job_id) for job_id, _, _ in rows]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        return [(job_id, attempts, json.loads(payload)) for job_id, attempts, payload in rows]
+
+    def _set_status(self, job_id: int, status: str, attempts: Optional[int] = None,
+                    next_attempt_at: Optional[float] = None, error: Optional[str] = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE export_jobs SET status = ?, attempts = COALESCE(?, attempts), "
+                "next_attempt_at = COALESCE(?, next_attempt_at), last_error = COALESCE(?, last_error), "
+                "updated_at = ? WHERE id = ?",
+                (status, attempts, next_attempt_at, error, now, job_id)
+            )
+
+    def _renew_lease(self, job_ids: List[int]) -> None:
+        """Продлевает аренду еще не выполненных заданий пачки, чтобы долгая пачка не была забрана повторно"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE export_jobs SET updated_at = ? WHERE id = ? AND status = 'running'",
+                [(now, job_id) for job_id in job_ids]
+            )
+
+    def _wait_rate_limit(self) -> None:
+        with self._rate_lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.min_interval
+        if delay > 0:
+            time.sleep(delay)
+
+    def _finish(self, payload: dict, result: str) -> None:
+        if self.on_finish:
+            try:
+                self.on_finish(payload, result)
+            except Exception as e:
+                logger.error(f"Ошибка обработки результата экспорта: {e}")
+
+    def _process_batch(self, batch: List[Tuple[int, int, dict]]) -> None:
+        for index, (job_id, attempts, payload) in enumerate(batch):
+            self._wait_rate_limit()
+            # Аренда выдана при захвате пачки: продлеваем ее перед каждым заданием
+            if index:
+                self._renew_lease([rest_id for rest_id, _, _ in batch[index:]])
+            try:
+                result = self.handler(payload)
+                self._set_status(job_id, "done", attempts=attempts + 1)
+                self._finish(payload, result)
+            except Exception as e:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    logger.error(f"Задание экспорта {job_id} не выполнено после {attempts} попыток: {e}")
+                    self._set_status(job_id, "dead", attempts=attempts, error=str(e))
+                    self._finish(payload, RESULT_FAILED)
+                    continue
+
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+                logger.warning(f"Ошибка экспорта задания {job_id} (попытка {attempts}), повтор через {delay} с: {e}")
+                self._set_status(job_id, "pending", attempts=attempts,
+                                 next_attempt_at=time.time() + delay, error=str(e))
+                # Остальные задания пользователя ждут, чтобы не нарушить порядок
+                for rest_id, _, _ in batch[index + 1:]:
+                    self._set_status(rest_id, "pending")
+                return
+
+    def _worker(self) -> None:
+        while not self._stop.is_set():
+            try:
+                batch = self._claim_batch()
+            except Exception as e:
+                logger.error(f"Ошибка чтения очереди экспорта: {e}")
+                batch = []
+
+            if not batch:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            self._process_batch(batch)
+
+    def start(self) -> None:
+        """Запускает воркеры и удаляет старые выполненные задания"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM export_jobs WHERE status = 'done' AND updated_at < ?",
+                (time.time() - self.retention,)
+            )
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"mochi-export-{index}", daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Запущено воркеров экспорта в Mochi: {self.workers}")
+
+    def stop(self, timeout: float = 30) -> None:
+        """Останавливает воркеры, дожидаясь текущих пачек"""
+        self._stop.set()
+        self._wakeup.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM export_jobs GROUP BY status"
+            ).fetchall()
+        return dict(rows)
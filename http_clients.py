@@ -0,0 +1,90 @@
+import os
+import logging
+import importlib.util
+import httpx
+import requests
+from telebot import apihelper
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class HttpClients:
+    """Общие HTTP клиенты всех исходящих запросов бота.
+
+    Синхронные запросы (Telegram через telebot, Mochi, Unsplash) идут через
+    один HTTPAdapter requests, асинхронные (OpenAI, Unsplash) - через один
+    httpx.AsyncClient, синхронные запросы OpenAI - через httpx.Client.
+    Пулы соединений ведутся отдельно для каждого хоста, соединения
+    переиспользуются (keep-alive), поэтому TLS рукопожатие происходит один
+    раз на соединение, а не на каждый запрос. HTTP/2 для httpx включается,
+    если установлен пакет h2.
+    """
+
+    def __init__(self, pool_size: int = 20, max_hosts: int = 10, connect_timeout: float = 5,
+                 read_timeout: float = 30, keepalive_expiry: float = 60, http2: bool = False):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.http2 = http2
+
+        self.adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=pool_size)
+        self.session = self.create_session()
+
+        timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        limits = httpx.Limits(
+            max_connections=pool_size * max_hosts,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.client = httpx.Client(timeout=timeout, limits=limits, http2=http2)
+        self.async_client = httpx.AsyncClient(timeout=timeout, limits=limits, http2=http2)
+
+    def create_session(self) -> requests.Session:
+        """Сессия requests с общим пулом соединений (свои заголовки и хуки у каждой сессии)"""
+        session = requests.Session()
+        self.mount(session)
+        return session
+
+    def mount(self, session: requests.Session) -> None:
+        """Переключает сессию, созданную сторонней библиотекой, на общий пул"""
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+
+    def install_telebot(self) -> None:
+        """telebot по умолчанию создает сессию в каждом потоке и пересоздает ее раз в 10 минут"""
+        apihelper.session = self.session
+        apihelper.SESSION_TIME_TO_LIVE = None
+        apihelper.CONNECT_TIMEOUT = self.connect_timeout
+
+    def close(self) -> None:
+        self.client.close()
+        self.session.close()
+
+    async def aclose(self) -> None:
+        await self.async_client.aclose()
+        self.close()
+
+
+def create_http_clients() -> HttpClients:
+    """Создает общие клиенты по настройкам окружения"""
+    http2_setting = os.getenv("HTTP2", "auto")
+    http2_available = importlib.util.find_spec("h2") is not None
+    if http2_setting == "auto":
+        http2 = http2_available
+    else:
+        http2 = http2_setting == "1"
+        if http2 and not http2_available:
+            logger.warning("HTTP2=1, но пакет h2 не установлен: используется HTTP/1.1")
+            http2 = False
+
+    clients = HttpClients(
+        pool_size=int(os.getenv("HTTP_POOL_SIZE", "20")),
+        max_hosts=int(os.getenv("HTTP_POOL_HOSTS", "10")),
+        connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+        read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", "30")),
+        keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60")),
+        http2=http2
+    )
+    logger.info(f"HTTP клиенты: пул {clients.pool_size} на хост, HTTP/2: {http2}")
+    return clients
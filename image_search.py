@@ -0,0 +1,174 @@
+import os
+import asyncio
+import logging
+import threading
+import requests
+import httpx
+from concurrent.futures import Future
+from typing import Dict, Optional
+from shared_state import run_io
+
+logger = logging.getLogger(__name__)
+
+UNSPLASH_API_URL = "https://api.unsplash.com"
+
+
+class ImageSearch:
+    """Поиск изображений в Unsplash с кэшем и объединением одинаковых запросов.
+
+    Пустой результат тоже кэшируется (на более короткий срок), а одновременные
+    запросы по одному ключевому слову делят один запрос к Unsplash.
+    """
+
+    def __init__(self, cache, async_client: httpx.AsyncClient, ttl: float = 7 * 24 * 3600,
+                 negative_ttl: float = 3600, timeout: float = 5, api_url: str = UNSPLASH_API_URL,
+                 session: Optional[requests.Session] = None):
+        self.search_url = f"{api_url.rstrip('/')}/search/photos"
+        self.cache = cache
+        self.async_client = async_client
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        # Пул соединений для синхронных запросов (общий, если передана сессия)
+        self._owns_session = session is None
+        self.session = session or requests.Session()
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_async: Dict[str, asyncio.Future] = {}
+        self.requests_count = 0
+        self.errors_count = 0
+        self.coalesced_count = 0
+        self.negative_hits = 0
+        self.ratelimit_limit: Optional[int] = None
+        self.ratelimit_remaining: Optional[int] = None
+
+    @staticmethod
+    def _cache_key(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def _params(self, query: str) -> Optional[dict]:
+        """Параметры запроса к Unsplash или None, если ключ не задан"""
+        access_key = os.getenv("UNSPLASH_ACCESS_KEY")
+
+        if not access_key:
+            logger.warning("UNSPLASH_ACCESS_KEY не найден в .env")
+            return None
+
+        return {
+            "query": query,
+            "per_page": 1,
+            "client_id": access_key
+        }
+
+    def _from_cache(self, key: str) -> Optional[dict]:
+        cached = self.cache.get(key)
+        if cached is not None and cached["url"] is None:
+            self.negative_hits += 1
+        return cached
+
+    def _handle_response(self, key: str, status_code: int, headers, data_getter) -> Optional[str]:
+        """Разбирает ответ Unsplash, обновляет квоты и кэш"""
+        self._update_ratelimit(headers)
+
+        if status_code != 200:
+            # Ошибки (в том числе превышение квоты) не кэшируем
+            self.errors_count += 1
+            logger.warning(f"Unsplash вернул статус {status_code}")
+            return None
+
+        data = data_getter()
+        image_url = None
+        if data.get("results") and len(data["results"]) > 0:
+            image_url = data["results"][0]["urls"]["regular"]
+
+        self.cache.set(key, {"url": image_url}, ttl=self.ttl if image_url else self.negative_ttl)
+        return image_url
+
+    def _update_ratelimit(self, headers) -> None:
+        limit = headers.get("X-Ratelimit-Limit")
+        remaining = headers.get("X-Ratelimit-Remaining")
+        if limit is not None:
+            self.ratelimit_limit = int(limit)
+        if remaining is not None:
+            self.ratelimit_remaining = int(remaining)
+
+    def get_image_url(self, query: str) -> Optional[str]:
+        """Получает URL изображения через Unsplash API"""
+        key = self._cache_key(query)
+        cached = self._from_cache(key)
+        if cached is not None:
+            return cached["url"]
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced_count += 1
+
+        if not owner:
+            return future.result()
+
+        image_url = None
+        try:
+            params = self._params(query)
+            if params:
+                self.requests_count += 1
+                response = self.session.get(self.search_url, params=params, timeout=self.timeout)
+                image_url = self._handle_response(key, response.status_code, response.headers, response.json)
+        except Exception as e:
+            self.errors_count += 1
+            logger.error(f"Ошибка получения изображения: {e}")
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            future.set_result(image_url)
+
+        return image_url
+
+    async def get_image_url_async(self, query: str) -> Optional[str]:
+        """Асинхронно получает URL изображения через Unsplash API"""
+        key = self._cache_key(query)
+        cached = await run_io(self._from_cache, key)
+        if cached is not None:
+            return cached["url"]
+
+        future = self._inflight_async.get(key)
+        if future is not None:
+            self.coalesced_count += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight_async[key] = future
+        image_url = None
+        try:
+            params = self._params(query)
+            if params:
+                self.requests_count += 1
+                response = await self.async_client.get(self.search_url, params=params, timeout=self.timeout)
+                image_url = await run_io(self._handle_response, key, response.status_code, response.headers, response.json)
+        except Exception as e:
+            self.errors_count += 1
+            logger.error(f"Ошибка получения изображения: {e}")
+        finally:
+            del self._inflight_async[key]
+            future.set_result(image_url)
+
+        return image_url
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests_count,
+            "errors": self.errors_count,
+            "coalesced": self.coalesced_count,
+            "negative_hits": self.negative_hits,
+            "ratelimit_limit": self.ratelimit_limit,
+            "ratelimit_remaining": self.ratelimit_remaining,
+            "cache": self.cache.stats()
+        }
+
+    def close(self) -> None:
+        if self._owns_session:
+            self.session.close()
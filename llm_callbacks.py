@@ -0,0 +1,77 @@
+import time
+from typing import Any, Dict
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from metrics import LLMUsage
+from rate_limit import FairLLMScheduler
+
+# Модуль импортируется вместе с langchain_openai при создании первой модели (см. llm_router.create_model_router)
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """Callback LangChain: длительность запросов к модели, расход токенов и стоимость в LLMUsage"""
+
+    def __init__(self, usage: LLMUsage):
+        self.usage = usage
+        self._started: Dict[Any, float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs) -> None:
+        start = self._started.pop(run_id, None)
+        elapsed = time.perf_counter() - start if start is not None else None
+        self.usage.record(elapsed, *self._usage(response))
+
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs) -> None:
+        self._started.pop(run_id, None)
+        self.usage.record_error()
+
+    @staticmethod
+    def _usage(response: LLMResult):
+        """Токены из usage_metadata сообщения (в том числе при потоковой генерации) или из llm_output"""
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    input_tokens += usage.get("input_tokens", 0)
+                    output_tokens += usage.get("output_tokens", 0)
+        if not input_tokens and not output_tokens:
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            input_tokens = token_usage.get("prompt_tokens", 0)
+            output_tokens = token_usage.get("completion_tokens", 0)
+        return input_tokens, output_tokens
+
+
+class RateLimitHeadersHandler(BaseCallbackHandler):
+    """Callback LangChain: передает заголовки x-ratelimit-* ответов OpenAI в планировщик.
+
+    Заголовки попадают в response_metadata, если ChatOpenAI создан с include_response_headers=True.
+    """
+
+    def __init__(self, scheduler: FairLLMScheduler, throttle_seconds: float = 5):
+        self.scheduler = scheduler
+        self.throttle_seconds = throttle_seconds
+
+    def on_llm_end(self, response: LLMResult, **kwargs) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                headers = getattr(message, "response_metadata", {}).get("headers")
+                if headers:
+                    self.scheduler.update_from_headers(headers)
+                    return
+
+    def on_llm_error(self, error: BaseException, **kwargs) -> None:
+        # 429 после всех повторов клиента: даем лимиту восстановиться
+        if getattr(error, "status_code", None) == 429:
+            headers = getattr(getattr(error, "response", None), "headers", {}) or {}
+            try:
+                delay = float(headers.get("retry-after"))
+            except (TypeError, ValueError):
+                delay = self.throttle_seconds
+            self.scheduler.pause(delay)
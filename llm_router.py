@@ -0,0 +1,275 @@
+import os
+import asyncio
+import logging
+import threading
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from http_clients import HttpClients
+from metrics import LLM_FALLBACKS, LLM_HEDGES, LLM_ROUTED, LLMUsage
+from rate_limit import FairLLMScheduler
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+    from langchain_core.runnables import Runnable
+
+logger = logging.getLogger(__name__)
+
+# Цены по умолчанию в долларах за миллион токенов: (входные, выходные)
+DEFAULT_PRICES = {
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6)
+}
+
+
+def parse_prices(value: str) -> Dict[str, Tuple[float, float]]:
+    """Разбирает LLM_PRICES: модель=цена входных/цена выходных токенов через запятую"""
+    prices = dict(DEFAULT_PRICES)
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        model, price = item.split("=", 1)
+        input_price, _, output_price = price.partition("/")
+        prices[model.strip()] = (float(input_price), float(output_price or input_price))
+    return prices
+
+
+class ModelRouter:
+    """Выбор модели для каждого запроса к LLM.
+
+    Цепочки регистрируются по типу (kind) функцией, которая строит цепочку
+    для заданной модели. Простые запросы (типы из fast_kinds и короткий
+    текст) идут в быструю дешевую модель, остальные - в сильную. При ошибке
+    или таймауте запрос повторяется на следующей модели списка. Для
+    асинхронных запросов можно включить hedging: если ответ не пришел за
+    hedge_after секунд, тот же запрос отправляется второй модели и
+    используется ответ, пришедший первым. Дублирующий запрос не занимает
+    отдельный слот планировщика.
+
+    Модели создаются функцией create_model при первом запросе к ним, цепочки -
+    при первом запросе каждого типа к модели; prewarm создает все заранее.
+    Асинхронные запросы строят цепочку в отдельном потоке: первое создание
+    модели импортирует langchain_openai и не должно останавливать event loop.
+    """
+
+    def __init__(self, create_model: Callable[[str], "ChatOpenAI"], usage: Dict[str, LLMUsage],
+                 strong_model: str, fast_model: Optional[str] = None, fallback_models: Optional[List[str]] = None,
+                 fast_kinds: Tuple[str, ...] = ("keyword",), simple_max_words: int = 2,
+                 simple_max_chars: int = 40, hedge_after: float = 0):
+        self.create_model = create_model
+        self.model_names = list(usage)
+        self.models: Dict[str, "ChatOpenAI"] = {}
+        self.usage = usage
+        self.strong_model = strong_model
+        self.fast_model = fast_model or strong_model
+        self.fallback_models = fallback_models or []
+        self.fast_kinds = fast_kinds
+        self.simple_max_words = simple_max_words
+        self.simple_max_chars = simple_max_chars
+        self.hedge_after = hedge_after
+        self._builders: Dict[str, Callable[["ChatOpenAI"], "Runnable"]] = {}
+        self._chains: Dict[Tuple[str, str], "Runnable"] = {}
+        self._lock = threading.RLock()
+
+    def register(self, kind: str, build: Callable[["ChatOpenAI"], "Runnable"]) -> None:
+        """Регистрирует тип запроса: build(модель) возвращает цепочку"""
+        self._builders[kind] = build
+
+    def model(self, name: str) -> "ChatOpenAI":
+        with self._lock:
+            if name not in self.models:
+                self.models[name] = self.create_model(name)
+            return self.models[name]
+
+    def chain(self, kind: str, model: str) -> "Runnable":
+        key = (kind, model)
+        chain = self._chains.get(key)
+        if chain is None:
+            with self._lock:
+                if key not in self._chains:
+                    self._chains[key] = self._builders[kind](self.model(model))
+                chain = self._chains[key]
+        return chain
+
+    async def achain(self, kind: str, model: str) -> "Runnable":
+        """chain для корутин: еще не созданная цепочка строится в отдельном потоке"""
+        chain = self._chains.get((kind, model))
+        if chain is None:
+            chain = await asyncio.to_thread(self.chain, kind, model)
+        return chain
+
+    async def _ainvoke(self, kind: str, model: str, inputs: dict) -> Any:
+        return await (await self.achain(kind, model)).ainvoke(inputs)
+
+    def prewarm(self) -> None:
+        """Создает все модели и цепочки, чтобы первый запрос не тратил на это время"""
+        for kind in self._builders:
+            for model in self.model_names:
+                self.chain(kind, model)
+
+    def is_simple(self, text: str) -> bool:
+        """Короткий текст: отдельное слово или словосочетание"""
+        return len(text.split()) <= self.simple_max_words and len(text) <= self.simple_max_chars
+
+    def route(self, kind: str, text: str) -> List[str]:
+        """Модели в порядке попыток: выбранная, затем запасные"""
+        if kind in self.fast_kinds or self.is_simple(text):
+            primary = self.fast_model
+        else:
+            primary = self.strong_model
+
+        models = [primary]
+        for model in [self.strong_model, self.fast_model] + self.fallback_models:
+            if model not in models:
+                models.append(model)
+        LLM_ROUTED.labels(kind, primary).inc()
+        return models
+
+    def _fallback(self, kind: str, model: str, error: Exception) -> None:
+        logger.warning(f"Ошибка запроса {kind} к {model}, пробуем следующую модель: {error}")
+
+    def invoke(self, kind: str, text: str, inputs: dict) -> Any:
+        """Синхронный запрос с переходом на запасные модели"""
+        models = self.route(kind, text)
+        for index, model in enumerate(models):
+            if index:
+                LLM_FALLBACKS.labels(kind, model).inc()
+            try:
+                return self.chain(kind, model).invoke(inputs)
+            except Exception as e:
+                if index == len(models) - 1:
+                    raise
+                self._fallback(kind, model, e)
+
+    async def ainvoke(self, kind: str, text: str, inputs: dict) -> Any:
+        """Асинхронный запрос с hedging и переходом на запасные модели"""
+        models = self.route(kind, text)
+        start = 0
+        if self.hedge_after > 0 and len(models) > 1:
+            try:
+                return await self._hedged(kind, models[0], models[1], inputs)
+            except Exception as e:
+                if len(models) == 2:
+                    raise
+                self._fallback(kind, models[1], e)
+            start = 2
+
+        for index in range(start, len(models)):
+            model = models[index]
+            if index:
+                LLM_FALLBACKS.labels(kind, model).inc()
+            try:
+                return await self._ainvoke(kind, model, inputs)
+            except Exception as e:
+                if index == len(models) - 1:
+                    raise
+                self._fallback(kind, model, e)
+
+    async def _hedged(self, kind: str, primary: str, secondary: str, inputs: dict) -> Any:
+        """Запрос к primary; если он не успел за hedge_after, параллельно тот же запрос к secondary"""
+        tasks = {asyncio.create_task(self._ainvoke(kind, primary, inputs)): primary}
+        hedged = False
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if not done:
+                hedged = True
+                LLM_HEDGES.labels(kind, "started").inc()
+                logger.info(f"Нет ответа {kind} от {primary} за {self.hedge_after} с, запрос к {secondary}")
+                tasks[asyncio.create_task(self._ainvoke(kind, secondary, inputs))] = secondary
+            else:
+                # Ошибка primary без hedging: сразу запрос к secondary
+                task = done.pop()
+                if task.exception() is None:
+                    return task.result()
+                self._fallback(kind, primary, task.exception())
+                LLM_FALLBACKS.labels(kind, secondary).inc()
+                del tasks[task]
+                tasks[asyncio.create_task(self._ainvoke(kind, secondary, inputs))] = secondary
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if hedged and tasks[task] != primary:
+                            LLM_HEDGES.labels(kind, "won").inc()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def astream(self, kind: str, text: str, inputs: dict) -> AsyncIterator[Any]:
+        """Потоковая генерация. На запасную модель переходим, только пока не получено ни одного фрагмента"""
+        models = self.route(kind, text)
+        for index, model in enumerate(models):
+            if index:
+                LLM_FALLBACKS.labels(kind, model).inc()
+            received = False
+            try:
+                chain = await self.achain(kind, model)
+                async for chunk in chain.astream(inputs):
+                    received = True
+                    yield chunk
+                return
+            except Exception as e:
+                if received or index == len(models) - 1:
+                    raise
+                self._fallback(kind, model, e)
+
+    def stats(self) -> dict:
+        return {
+            "strong_model": self.strong_model,
+            "fast_model": self.fast_model,
+            "hedge_after": self.hedge_after,
+            "models": {model: usage.stats() for model, usage in self.usage.items()}
+        }
+
+
+def create_model_router(scheduler: FairLLMScheduler, http_clients: Optional[HttpClients] = None) -> ModelRouter:
+    """Создает модели и маршрутизатор по настройкам окружения"""
+    strong_model = os.getenv("LLM_MODEL", "gpt-4o")
+    fast_model = os.getenv("LLM_FAST_MODEL", "gpt-4o-mini") or strong_model
+    fallback_models = [model.strip() for model in os.getenv("LLM_FALLBACK_MODELS", "").split(",") if model.strip()]
+    fast_kinds = tuple(kind.strip() for kind in os.getenv("LLM_FAST_KINDS", "keyword").split(",") if kind.strip())
+    timeout = float(os.getenv("LLM_TIMEOUT", "30"))
+    max_retries = int(os.getenv("LLM_MAX_RETRIES", "2"))
+    prices = parse_prices(os.getenv("LLM_PRICES", ""))
+
+    usage = {
+        model: LLMUsage(model, prices.get(model))
+        for model in dict.fromkeys([strong_model, fast_model] + fallback_models)
+    }
+
+    def create_model(model: str) -> "ChatOpenAI":
+        # langchain_openai и openai импортируются при первом запросе к LLM, а не при запуске бота
+        from langchain_openai import ChatOpenAI
+        from llm_callbacks import LLMMetricsHandler, RateLimitHeadersHandler
+        return ChatOpenAI(
+            model=model,
+            temperature=0,
+            timeout=timeout,
+            max_retries=max_retries,
+            # Расход токенов приходит и при потоковой генерации
+            stream_usage=True,
+            # Заголовки x-ratelimit-* нужны планировщику запросов
+            include_response_headers=True,
+            # Все модели используют общий пул соединений с OpenAI
+            http_client=http_clients.client if http_clients is not None else None,
+            http_async_client=http_clients.async_client if http_clients is not None else None,
+            callbacks=[LLMMetricsHandler(usage[model]), RateLimitHeadersHandler(scheduler)]
+        )
+
+    router = ModelRouter(
+        create_model,
+        usage,
+        strong_model=strong_model,
+        fast_model=fast_model,
+        fallback_models=fallback_models,
+        fast_kinds=fast_kinds,
+        simple_max_words=int(os.getenv("LLM_ROUTER_SIMPLE_MAX_WORDS", "2")),
+        simple_max_chars=int(os.getenv("LLM_ROUTER_SIMPLE_MAX_CHARS", "40")),
+        hedge_after=float(os.getenv("LLM_HEDGE_AFTER", "0"))
+    )
+    logger.info(f"Модели LLM: сильная {strong_model}, быстрая {fast_model}, запасные {fallback_models}")
+    return router
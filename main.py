@@ -1,17 +1,40 @@
 import os
+import re
+import math
+import time
+import asyncio
+import hashlib
 import logging
+import threading
+import contextvars
 import telebot
-import requests
-from typing import Optional
-from mochi_ import MochiConnect
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from http_clients import create_http_clients
+from card import TranslationCard
+from card_index import create_card_index
+from dictionary import DIRECTIONS, detect_language, load_dictionary
+from card_store import create_pending_store
+from shared_state import backend_name, create_backend, run_io, storage_backend_name
+from update_dedup import create_update_dedup
+from export_queue import ExportQueue, RESULT_ADDED, RESULT_EXISTS, RESULT_FAILED
+from cache import MemoryCache, TieredCache
+from image_search import ImageSearch, UNSPLASH_API_URL
+from telegram_media import TelegramMediaCache
+from update_queue import UpdateQueue
+from polling import UpdatePoller
+from metrics import profiled, render_latest, stage, stats_collector
+from llm_router import create_model_router
+from rate_limit import FairLLMScheduler, UserRateLimiter, current_user
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, Field
 from fastapi.responses import JSONResponse
 from fastapi import FastAPI, Request, Response
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema.output_parser import StrOutputParser
 from telebot.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 
+if TYPE_CHECKING:
+    from mochi_ import MochiConnect
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -22,24 +45,67 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 app = FastAPI()
+
+# Адрес Bot API можно переопределить (локальный Bot API сервер, тестовые стенды)
+if os.getenv("TELEGRAM_API_URL"):
+    telebot.apihelper.API_URL = os.environ["TELEGRAM_API_URL"]
+
+# Бот создается при импорте: обработчики его не регистрируют (обновления разбирает _handle_update),
+# но объект нужен модулям ниже (TelegramMediaCache, UpdatePoller). Конструктор не обращается к сети
+# (~0.3 мс), а сам telebot нужен каждому процессу для разбора обновлений (telebot.types) и общей сессии
+# HTTP (http_clients.install_telebot); большую часть его импорта занимает requests, который нужен и так
 bot = telebot.TeleBot(os.environ["TOKEN"])
 
-# Хранилище для временных данных карточек
-user_cards = {}
+LOADING_GIF_URL = "https://i.gifer.com/8cEp.gif"
+
+# Общие HTTP клиенты с пулами соединений для Telegram, OpenAI, Unsplash и Mochi
+http_clients = create_http_clients()
+http_clients.install_telebot()
+
+# Очередь запросов к LLM: ограничение параллельности и частоты, пользователи обслуживаются по кругу
+llm_scheduler = FairLLMScheduler(
+    max_concurrent=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+    rate=float(os.getenv("LLM_RATE_LIMIT", "0")),
+    burst=int(os.getenv("LLM_RATE_BURST", "10")),
+    min_remaining_requests=int(os.getenv("LLM_MIN_REMAINING_REQUESTS", "5")),
+    min_remaining_tokens=int(os.getenv("LLM_MIN_REMAINING_TOKENS", "5000"))
+)
 
-# Настройка LangChain с OpenAI
-llm = ChatOpenAI(
-    model="gpt-4o",
-    temperature=0
+# Ограничение частоты сообщений одного пользователя (при общем бэкенде - на все процессы бота)
+rate_limit_backend = backend_name("RATE_LIMIT_BACKEND")
+user_limiter = UserRateLimiter(
+    rate_per_minute=float(os.getenv("USER_RATE_LIMIT_PER_MINUTE", "20")),
+    burst=int(os.getenv("USER_RATE_LIMIT_BURST", "10")),
+    backend=create_backend("rate_limits", rate_limit_backend) if rate_limit_backend != "memory" else None
 )
 
-# Создаем шаблон промпта
-prompt_template = ChatPromptTemplate.from_messages([
+# Настройка LangChain с OpenAI: простые запросы - быстрой модели, сложные - сильной
+llm_router = create_model_router(llm_scheduler, http_clients)
+
+
+def chat_prompt(messages: List[Tuple[str, str]]) -> Any:
+    """Шаблон промпта LangChain. Импорт langchain откладывается до первого запроса к LLM"""
+    from langchain_core.prompts import ChatPromptTemplate
+    return ChatPromptTemplate.from_messages(messages)
+
+
+def text_chain(messages: List[Tuple[str, str]]):
+    """Построитель цепочки промпт -> модель -> текст ответа"""
+    def build(llm):
+        from langchain_core.output_parsers import StrOutputParser
+        return chat_prompt(messages) | llm | StrOutputParser()
+    return build
+
+
+def structured_chain(messages: List[Tuple[str, str]], schema: type):
+    """Построитель цепочки промпт -> модель со структурированным ответом schema"""
+    return lambda llm: chat_prompt(messages) | llm.with_structured_output(schema)
+
+
+# Сообщения промпта перевода
+TRANSLATION_MESSAGES = [
     ("system", "Ты профессиональный переводчик."),
-    ("user", """Определи язык текста "{text}".
-Если текст на русском - переведи на английский.
-Если текст на английском - переведи на русский.
-Если текст на другом языке - переведи на английский.
+    ("user", """{direction}
 
 Предоставь:
 1. Перевод слова/фразы
@@ -59,27 +125,325 @@ prompt_template = ChatPromptTemplate.from_messages([
 1. [пример на исходном языке] - [перевод]
 2. [пример на исходном языке] - [перевод]
 3. [пример на исходном языке] - [перевод]""")
-])
+]
 
-# Создаем цепочку
-translation_chain = prompt_template | llm | StrOutputParser()
+# Цепочки строятся при первом запросе к каждой модели
+llm_router.register("translation", text_chain(TRANSLATION_MESSAGES))
 
-# Создаем промпт для извлечения ключевого слова
-keyword_prompt = ChatPromptTemplate.from_messages([
+# Промпт для извлечения ключевого слова
+KEYWORD_MESSAGES = [
     ("system", "Ты помощник, который извлекает ключевые слова из текста."),
     ("user", """Из текста "{text}" извлеки ОДНО главное существительное, которое лучше всего подходит для поиска изображения.
 Если это одно слово - верни его.
 Если это предложение - верни самое важное существительное.
 Верни ТОЛЬКО слово на английском языке, без объяснений.""")
-])
+]
+
+llm_router.register("keyword", text_chain(KEYWORD_MESSAGES))
+
+
+class TranslationResult(BaseModel):
+    """Структурированный ответ: перевод, примеры и ключевое слово для изображения за один запрос"""
+    translation: str = Field(description="Перевод слова или фразы")
+    examples: List[str] = Field(
+        description="Ровно 3 примера в формате: пример на исходном языке - перевод"
+    )
+    image_keyword: str = Field(
+        description="Одно главное существительное на английском для поиска изображения"
+    )
+
+
+STRUCTURED_MESSAGES = [
+    ("system", "Ты профессиональный переводчик."),
+    ("user", """{direction}
+
+Заполни поля:
+translation - перевод слова/фразы.
+examples - 3 примера использования в предложениях с переводом, каждый в формате: [пример на исходном языке] - [перевод].
+image_keyword - ОДНО главное существительное на английском, которое лучше всего подходит для поиска изображения.
+
+Требования:
+1. Не используй кавычки и скобки.
+2. В примерах ВСЕГДА первым идет пример на языке исходного текста "{text}", вторым - его перевод.""")
+]
+
+# Одна цепочка вместо двух: перевод, примеры и ключевое слово в одном запросе к LLM
+llm_router.register("structured", structured_chain(STRUCTURED_MESSAGES, TranslationResult))
+
+class BatchTranslationItem(TranslationResult):
+    """Перевод одного элемента списка"""
+    text: str = Field(description="Элемент списка без изменений")
+
+
+class BatchTranslationResult(BaseModel):
+    """Переводы всех элементов списка в исходном порядке"""
+    items: List[BatchTranslationItem]
+
+
+BATCH_MESSAGES = [
+    ("system", "Ты профессиональный переводчик."),
+    ("user", """Переведи каждый элемент списка.
+Если направление перевода указано в скобках после элемента - переводи так.
+Для остальных элементов определи язык: русский переведи на английский, английский - на русский, другой язык - на английский.
+
+Список:
+{items}
+
+Для каждого элемента заполни поля:
+text - элемент списка без изменений (без направления в скобках).
+translation - перевод слова/фразы.
+examples - 3 примера использования в предложениях с переводом, каждый в формате: [пример на исходном языке] - [перевод].
+image_keyword - ОДНО главное существительное на английском, которое лучше всего подходит для поиска изображения.
+
+Требования:
+1. Не используй кавычки и скобки.
+2. В примерах ВСЕГДА первым идет пример на языке исходного элемента, вторым - его перевод.
+3. Сохрани порядок и количество элементов.""")
+]
+
+# Список слов переводится одним запросом к LLM
+llm_router.register("batch", structured_chain(BATCH_MESSAGES, BatchTranslationResult))
+
+# 0 - всегда использовать два отдельных запроса (перевод и ключевое слово)
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "1") == "1"
+
+# Пакетный режим: список слов (по строкам или через запятую) переводится одним запросом
+BATCH_MODE = os.getenv("BATCH_MODE", "1") == "1"
+# Не больше 10 - ограничение Telegram на число фото в альбоме
+BATCH_MAX_ITEMS = min(10, int(os.getenv("BATCH_MAX_ITEMS", "10")))
+# Список через запятую - не меньше стольких элементов по одному слову; иначе это фраза ("Ну, ладно", "yes, please")
+BATCH_MIN_COMMA_ITEMS = int(os.getenv("BATCH_MIN_COMMA_ITEMS", "3"))
+# Список по строкам - каждая строка не длиннее стольких слов и без знаков препинания; иначе это текст (письмо, стихи)
+BATCH_MAX_LINE_WORDS = int(os.getenv("BATCH_MAX_LINE_WORDS", "3"))
+
+# Путь к файлу с постоянными кэшами
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "data/cache.sqlite3")
+
+# Офлайн-словарь частых слов: отдельные слова из него переводятся без запроса к LLM
+dictionary = load_dictionary(os.getenv("DICTIONARY_PATH"))
+
+# Кэш переводов: temperature=0, поэтому ответ для одного и того же текста детерминирован
+translation_cache = TieredCache(
+    MemoryCache(max_entries=int(os.getenv("TRANSLATION_CACHE_MEMORY_SIZE", "5000"))),
+    create_backend(
+        "translations",
+        storage_backend_name(),
+        max_entries=int(os.getenv("TRANSLATION_CACHE_MAX_ENTRIES", "100000")),
+        ttl=float(os.getenv("TRANSLATION_CACHE_TTL", str(30 * 24 * 3600)))
+    )
+)
+
+# Хранилище для временных данных карточек (до нажатия кнопки "Добавить в Mochi")
+pending_cards = create_pending_store()
+
+# Недавно принятые update_id: повторная доставка от Telegram не обрабатывается второй раз
+update_dedup = create_update_dedup()
+
+# Поиск изображений: кэш ключевое слово -> URL (в том числе "ничего не найдено")
+image_search = ImageSearch(
+    TieredCache(
+        MemoryCache(max_entries=int(os.getenv("IMAGE_CACHE_MEMORY_SIZE", "5000"))),
+        create_backend("images", storage_backend_name(), max_entries=int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "100000")))
+    ),
+    http_clients.async_client,
+    ttl=float(os.getenv("IMAGE_CACHE_TTL", str(7 * 24 * 3600))),
+    negative_ttl=float(os.getenv("IMAGE_CACHE_NEGATIVE_TTL", "3600")),
+    api_url=os.getenv("UNSPLASH_API_URL", UNSPLASH_API_URL),
+    session=http_clients.session
+)
+
+# file_id отправленных изображений и GIF загрузки: повторные отправки не скачивают файл заново
+media_cache = TelegramMediaCache(
+    bot,
+    TieredCache(
+        MemoryCache(max_entries=int(os.getenv("FILE_ID_CACHE_MEMORY_SIZE", "5000"))),
+        create_backend("file_ids", storage_backend_name(), max_entries=int(os.getenv("FILE_ID_CACHE_MAX_ENTRIES", "100000")))
+    )
+)
+
+# Счетчики кэшей в /metrics
+stats_collector.add_cache("translations", translation_cache)
+stats_collector.add_cache("images", image_search.cache)
+stats_collector.add_cache("file_ids", media_cache.cache)
+stats_collector.add_cache("pending_cards", pending_cards.backend)
+if dictionary is not None:
+    stats_collector.add_cache("dictionary", dictionary)
+
+_translation_cache_version: Optional[str] = None
+
+
+def translation_cache_version() -> str:
+    """Версия промптов и модели: при их изменении старые записи кэша перестают использоваться"""
+    global _translation_cache_version
+    if _translation_cache_version is None:
+        _translation_cache_version = hashlib.sha256(
+            f"{chat_prompt(TRANSLATION_MESSAGES).pretty_repr()}|{chat_prompt(STRUCTURED_MESSAGES).pretty_repr()}|"
+            f"{sorted(llm_router.model_names)}|0".encode("utf-8")
+        ).hexdigest()[:16]
+    return _translation_cache_version
+
+
+def normalize_text(text: str) -> str:
+    """Нормализует текст для ключа кэша"""
+    return " ".join(text.lower().split())
+
+
+def translation_cache_key(text: str) -> str:
+    """Ключ кэша переводов: нормализованный текст + версия промпта и модели"""
+    raw = f"{translation_cache_version()}:{normalize_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _structured_to_card(text: str, result: TranslationResult) -> TranslationCard:
+    return TranslationCard.from_fields(
+        text, result.translation, result.examples, text_language(text), result.image_keyword
+    )
+
+
+def _text_to_card(text: str, ai_response: str) -> TranslationCard:
+    """Карточка из текстового ответа цепочки translation"""
+    return TranslationCard.parse(text, ai_response, text_language(text))
+
+
+def text_language(text: str) -> str:
+    """Язык текста: ru (кириллица), en (только слова из офлайн-словаря) или other"""
+    return detect_language(text, dictionary)
+
+
+def translation_inputs(text: str) -> dict:
+    """Переменные промпта: направление перевода, если язык определен локально, иначе его выбирает модель"""
+    language = text_language(text)
+    if language in DIRECTIONS:
+        source, target = DIRECTIONS[language]
+        direction = f'Переведи текст "{text}" с {source} на {target}.'
+    else:
+        direction = (
+            f'Определи язык текста "{text}".\n'
+            "Если текст на русском - переведи на английский.\n"
+            "Если текст на английском - переведи на русский.\n"
+            "Если текст на другом языке - переведи на английский."
+        )
+    return {"text": text, "direction": direction}
+
+
+def local_translation(text: str) -> Optional[TranslationCard]:
+    """Перевод без запроса к LLM: кэш переводов или офлайн-словарь (только для отдельных слов)"""
+    cached = translation_cache.get(translation_cache_key(text))
+    if cached is not None:
+        logger.info(f"Перевод найден в кэше: {text}")
+        return TranslationCard.load(cached, word=text)
+
+    if dictionary is not None and len(text.split()) == 1:
+        entry = dictionary.lookup(text)
+        if entry is not None:
+            logger.info(f"Перевод найден в словаре: {text}")
+            return TranslationCard.from_fields(text, source=text_language(text), **entry)
+    return None
+
+
+def structured_translate(text: str) -> Optional[TranslationCard]:
+    """Перевод и ключевое слово одним запросом. None, если ответ не удалось разобрать"""
+    try:
+        with llm_scheduler.slot(), stage("llm_structured"):
+            return _structured_to_card(text, llm_router.invoke("structured", text, translation_inputs(text)))
+    except Exception as e:
+        logger.error(f"Ошибка структурированного перевода, используем два запроса: {e}")
+        return None
+
+
+async def structured_translate_async(text: str) -> Optional[TranslationCard]:
+    """Асинхронный перевод и ключевое слово одним запросом"""
+    try:
+        async with llm_scheduler.slot_async():
+            with stage("llm_structured"):
+                return _structured_to_card(text, await llm_router.ainvoke("structured", text, translation_inputs(text)))
+    except Exception as e:
+        logger.error(f"Ошибка структурированного перевода, используем два запроса: {e}")
+        return None
+
+
+def get_translation(text: str) -> TranslationCard:
+    """Возвращает перевод (и ключевое слово, если оно известно), используя кэш переводов"""
+    card = local_translation(text)
+    if card is not None:
+        return card
+
+    key = translation_cache_key(text)
+    card = structured_translate(text) if STRUCTURED_OUTPUT else None
+    if card is None:
+        with llm_scheduler.slot(), stage("llm_translation"):
+            card = _text_to_card(text, llm_router.invoke("translation", text, translation_inputs(text)))
+
+    translation_cache.set(key, card.dump())
+    return card
+
+
+async def get_translation_async(text: str) -> TranslationCard:
+    """Асинхронный вариант get_translation"""
+    card = await run_io(local_translation, text)
+    if card is not None:
+        return card
+
+    return await refresh_translation_async(text)
+
 
-keyword_chain = keyword_prompt | llm | StrOutputParser()
+async def refresh_translation_async(text: str) -> TranslationCard:
+    """Запрашивает перевод у LLM без обращения к кэшу и сохраняет его в кэш"""
+    card = await structured_translate_async(text) if STRUCTURED_OUTPUT else None
+    if card is None:
+        card = _text_to_card(text, await llm_translate_async(text))
+
+    await run_io(translation_cache.set, translation_cache_key(text), card.dump())
+    return card
+
+
+def remember_keyword(text: str, card: TranslationCard, keyword: str) -> TranslationCard:
+    """Сохраняет в кэш перевода ключевое слово, извлеченное отдельным запросом: при попадании в кэш запрос не повторяется"""
+    card = card.with_keyword(keyword)
+    translation_cache.set(translation_cache_key(text), card.dump())
+    return card
+
+
+async def translate_with_image_async(text: str) -> TranslationCard:
+    """Возвращает перевод с URL изображения с минимальным числом запросов к LLM"""
+    key = translation_cache_key(text)
+    card = await run_io(local_translation, text)
+    if card is None and STRUCTURED_OUTPUT:
+        card = await structured_translate_async(text)
+        if card is not None:
+            await run_io(translation_cache.set, key, card.dump())
+
+    if card is not None:
+        if not card.image_keyword:
+            card = await run_io(remember_keyword, text, card, await get_image_search_keyword_async(text))
+        keyword = card.image_keyword
+        with stage("image_search"):
+            image_url = await image_search.get_image_url_async(keyword)
+        logger.info(f"Получен URL изображения: {image_url}")
+        return card.with_image(image_url)
+
+    # Два запроса: перевод выполняется параллельно с поиском изображения
+    ai_response, (keyword, image_url) = await asyncio.gather(
+        llm_translate_async(text),
+        find_image_async(text)
+    )
+    card = _text_to_card(text, ai_response).with_keyword(keyword)
+    await run_io(translation_cache.set, key, card.dump())
+    return card.with_image(image_url)
+
+
+async def llm_translate_async(text: str) -> str:
+    """Перевод отдельным запросом к LLM"""
+    async with llm_scheduler.slot_async():
+        with stage("llm_translation"):
+            return await llm_router.ainvoke("translation", text, translation_inputs(text))
 
 
 def get_image_search_keyword(text: str) -> str:
     """Извлекает ключевое слово для поиска изображения"""
     try:
-        keyword = keyword_chain.invoke({"text": text}).strip()
+        with llm_scheduler.slot(), stage("llm_keyword"):
+            keyword = llm_router.invoke("keyword", text, {"text": text}).strip()
         logger.info(f"Извлечено ключевое слово для поиска: {keyword}")
         return keyword
     except Exception as e:
@@ -88,35 +452,157 @@ def get_image_search_keyword(text: str) -> str:
         return text.split()[0] if text else text
 
 
-def get_image_url(query: str) -> Optional[str]:
-    """Получает URL изображения через Unsplash API"""
+async def get_image_search_keyword_async(text: str) -> str:
+    """Асинхронно извлекает ключевое слово для поиска изображения"""
     try:
-        # Используем Unsplash API для поиска изображений
-        access_key = os.getenv("UNSPLASH_ACCESS_KEY")
+        async with llm_scheduler.slot_async():
+            with stage("llm_keyword"):
+                keyword = (await llm_router.ainvoke("keyword", text, {"text": text})).strip()
+        logger.info(f"Извлечено ключевое слово для поиска: {keyword}")
+        return keyword
+    except Exception as e:
+        logger.error(f"Ошибка извлечения ключевого слова: {e}")
+        return text.split()[0] if text else text
 
-        if not access_key:
-            logger.warning("UNSPLASH_ACCESS_KEY не найден в .env")
-            return None
 
-        url = "https://api.unsplash.com/search/photos"
-        params = {
-            "query": query,
-            "per_page": 1,
-            "client_id": access_key
-        }
+async def find_image_async(text: str) -> Tuple[str, Optional[str]]:
+    """Извлекает ключевое слово и ищет по нему изображение. Возвращает (ключевое слово, URL)"""
+    search_keyword = await get_image_search_keyword_async(text)
+    with stage("image_search"):
+        image_url = await image_search.get_image_url_async(search_keyword)
+    logger.info(f"Получен URL изображения: {image_url}")
+    return search_keyword, image_url
 
-        response = requests.get(url, params=params, timeout=5)
 
-        if response.status_code == 200:
-            data = response.json()
-            if data.get("results") and len(data["results"]) > 0:
-                # Получаем URL изображения
-                return data["results"][0]["urls"]["regular"]
+_LIST_MARKER_RE = re.compile(r"^(?:\d+[.)]|[-•*])\s*")
+# Знаки препинания внутри строки: строка - часть предложения, а не элемент списка
+_SENTENCE_PUNCTUATION_RE = re.compile(r"[.,!?;:…]")
 
+
+def split_batch(text: str) -> Optional[List[str]]:
+    """Разбивает сообщение на список слов (по строкам или через запятую). None - одно слово или фраза.
+
+    По строкам список распознается, только если каждая строка - не больше BATCH_MAX_LINE_WORDS
+    слов без знаков препинания. Через запятую - только если в нем не меньше BATCH_MIN_COMMA_ITEMS
+    элементов и каждый - одно слово. Фразы и многострочный текст переводятся целиком.
+    """
+    if not BATCH_MODE:
         return None
-    except Exception as e:
-        logger.error(f"Ошибка получения изображения: {e}")
-        return None
+
+    lines = [_LIST_MARKER_RE.sub("", line).strip() for line in text.splitlines()]
+    items = [line for line in lines if line]
+    if len(items) > 1:
+        if any(len(item.split()) > BATCH_MAX_LINE_WORDS or _SENTENCE_PUNCTUATION_RE.search(item) for item in items):
+            return None
+    else:
+        items = [item.strip() for item in re.split(r"[,;]", text) if item.strip()]
+        if len(items) < BATCH_MIN_COMMA_ITEMS or any(len(item.split()) > 1 for item in items):
+            return None
+
+    # Без повторов, порядок сохраняется
+    unique = {}
+    for item in items:
+        unique.setdefault(normalize_text(item), item)
+    items = list(unique.values())
+    return items if len(items) > 1 else None
+
+
+def _batch_from_cache(items: List[str]) -> Tuple[Dict[str, TranslationCard], List[str]]:
+    """Переводы из кэша и словаря и список элементов, которых в них нет"""
+    results = {}
+    missing = []
+    for item in items:
+        card = local_translation(item)
+        if card is None:
+            missing.append(item)
+        else:
+            results[item] = card
+    return results, missing
+
+
+def _store_batch(items: List[str], response: BatchTranslationResult, results: Dict[str, TranslationCard]) -> None:
+    """Раскладывает ответ LLM по элементам списка и кэширует переводы"""
+    by_text = {normalize_text(item.text): item for item in response.items}
+    for index, item in enumerate(items):
+        found = by_text.get(normalize_text(item))
+        if found is None and len(response.items) == len(items):
+            # Модель могла изменить написание элемента - сопоставляем по позиции
+            found = response.items[index]
+        if found is not None:
+            results[item] = _structured_to_card(item, found)
+            translation_cache.set(translation_cache_key(item), results[item].dump())
+
+
+def format_batch_items(items: List[str]) -> str:
+    """Нумерованный список с направлением перевода элементов, язык которых определен локально"""
+    lines = []
+    for index, item in enumerate(items, 1):
+        language = text_language(item)
+        if language in DIRECTIONS:
+            source, target = DIRECTIONS[language]
+            lines.append(f"{index}. {item} (с {source} на {target})")
+        else:
+            lines.append(f"{index}. {item}")
+    return "\n".join(lines)
+
+
+def batch_translate(items: List[str]) -> List[TranslationCard]:
+    """Переводит список: кэш, затем один запрос к LLM на все остальные элементы"""
+    results, missing = _batch_from_cache(items)
+    if len(missing) > 1 and STRUCTURED_OUTPUT:
+        try:
+            with llm_scheduler.slot(), stage("llm_batch"):
+                response = llm_router.invoke("batch", max(missing, key=len), {"items": format_batch_items(missing)})
+            _store_batch(missing, response, results)
+        except Exception as e:
+            logger.error(f"Ошибка пакетного перевода, переводим по одному: {e}")
+
+    # Элементы, которых нет в ответе, переводятся по одному
+    for item in items:
+        if item not in results:
+            results[item] = get_translation(item)
+    return [results[item] for item in items]
+
+
+async def batch_translate_async(items: List[str]) -> List[TranslationCard]:
+    """Асинхронный вариант batch_translate"""
+    results, missing = await run_io(_batch_from_cache, items)
+    if len(missing) > 1 and STRUCTURED_OUTPUT:
+        try:
+            async with llm_scheduler.slot_async():
+                with stage("llm_batch"):
+                    response = await llm_router.ainvoke("batch", max(missing, key=len), {"items": format_batch_items(missing)})
+            await run_io(_store_batch, missing, response, results)
+        except Exception as e:
+            logger.error(f"Ошибка пакетного перевода, переводим по одному: {e}")
+
+    rest = [item for item in items if item not in results]
+    for item, card in zip(rest, await asyncio.gather(*(get_translation_async(item) for item in rest))):
+        results[item] = card
+    return [results[item] for item in items]
+
+
+def batch_image_urls(cards: List[TranslationCard]) -> List[TranslationCard]:
+    """Ищет изображения для всех элементов списка параллельно"""
+    def find(card: TranslationCard) -> TranslationCard:
+        if not card.image_keyword:
+            card = remember_keyword(card.word, card, get_image_search_keyword(card.word))
+        return card.with_image(image_search.get_image_url(card.image_keyword))
+
+    with ThreadPoolExecutor(max_workers=len(cards)) as pool:
+        # pool.map не переносит contextvars: без current_user запросы keyword обходят очередь пользователей
+        futures = [pool.submit(contextvars.copy_context().run, find, card) for card in cards]
+        return [future.result() for future in futures]
+
+
+async def batch_image_urls_async(cards: List[TranslationCard]) -> List[TranslationCard]:
+    """Асинхронный вариант batch_image_urls"""
+    async def find(card: TranslationCard) -> TranslationCard:
+        if not card.image_keyword:
+            card = await run_io(remember_keyword, card.word, card, await get_image_search_keyword_async(card.word))
+        return card.with_image(await image_search.get_image_url_async(card.image_keyword))
+
+    return list(await asyncio.gather(*(find(card) for card in cards)))
 
 
 def start_bot(message: Message) -> None:
@@ -133,64 +619,44 @@ def start_bot(message: Message) -> None:
     logger.info("start message sent")
 
 
-def translate_word(message: Message) -> None:
-    logger.info(f"translate_word called for: {message.text}")
-    loading_msg = None
+def build_mochi_keyboard(message_id: int, label: str = "📚 Добавить в Mochi") -> InlineKeyboardMarkup:
+    """Создает кнопку для добавления в Mochi"""
+    keyboard = InlineKeyboardMarkup()
+    add_to_mochi_btn = InlineKeyboardButton(label, callback_data=f"add_mochi_{message_id}")
+    keyboard.add(add_to_mochi_btn)
+    return keyboard
 
-    try:
-        text = message.text.strip()
 
-        # Отправляем GIF с загрузкой (используем известный URL с анимацией загрузки)
-        loading_gif_url = "https://i.gifer.com/8cEp.gif"
-        loading_msg = bot.send_animation(
+def send_loading(message: Message) -> Message:
+    """Отправляет GIF с загрузкой"""
+    with stage("telegram_loading"):
+        return media_cache.send_animation(
             message.chat.id,
-            loading_gif_url,
+            LOADING_GIF_URL,
             caption="⏳ Загрузка перевода и изображения...",
             reply_to_message_id=message.message_id
         )
 
-        # Показываем индикатор "печатает..."
-        bot.send_chat_action(message.chat.id, 'typing')
-
-        # Используем LangChain цепочку для перевода
-        ai_response = translation_chain.invoke({"text": text})
-
-        # Форматируем ответ для пользователя с markdown разметкой
-        formatted_response = f"📝 *Слово:* {text}\n\n{ai_response}"
-
-        # Улучшаем форматирование ответа AI
-        formatted_response = formatted_response.replace("Перевод:", "*Перевод:*")
-        formatted_response = formatted_response.replace("Примеры:", "\n*Примеры:*")
 
-        # Показываем индикатор "загружает фото..."
-        bot.send_chat_action(message.chat.id, 'upload_photo')
-
-        # Извлекаем ключевое слово для поиска изображения
-        search_keyword = get_image_search_keyword(text)
-
-        # Получаем изображение по ключевому слову
-        image_url = get_image_url(search_keyword)
-        logger.info(f"Получен URL изображения: {image_url}")
-
-        # Создаем кнопку для добавления в Mochi
-        keyboard = InlineKeyboardMarkup()
-        add_to_mochi_btn = InlineKeyboardButton("📚 Добавить в Mochi", callback_data=f"add_mochi_{message.message_id}")
-        keyboard.add(add_to_mochi_btn)
+def delete_loading(message: Message, loading_msg: Optional[Message]) -> None:
+    """Удаляет служебное сообщение (GIF с загрузкой или черновик ответа)"""
+    if loading_msg:
+        try:
+            bot.delete_message(message.chat.id, loading_msg.message_id)
+        except Exception as e:
+            logger.error(f"Ошибка удаления loading GIF: {e}")
 
-        # Сохраняем данные карточки для последующего добавления в Mochi
-        user_cards[message.message_id] = {
-            'word': text,
-            'translation': ai_response,
-            'image_url': image_url,
-            'user_id': message.from_user.id
-        }
 
-        if image_url:
+def send_translation(message: Message, card: TranslationCard, keyboard: InlineKeyboardMarkup) -> None:
+    """Отправляет перевод с изображением (если есть) и кнопкой"""
+    formatted_response = card.render_telegram()
+    with stage("telegram_send"):
+        if card.image_url:
             try:
                 # Отправляем фото с подписью и кнопкой (parse_mode для markdown)
-                bot.send_photo(
+                media_cache.send_photo(
                     message.chat.id,
-                    image_url,
+                    card.image_url,
                     caption=formatted_response,
                     parse_mode='Markdown',
                     reply_markup=keyboard,
@@ -205,139 +671,427 @@ def translate_word(message: Message) -> None:
             logger.info("URL изображения не получен, отправляем только текст")
             bot.reply_to(message, formatted_response, parse_mode='Markdown', reply_markup=keyboard)
 
-        # Удаляем GIF с загрузкой
-        if loading_msg:
-            try:
-                bot.delete_message(message.chat.id, loading_msg.message_id)
-            except Exception as e:
-                logger.error(f"Ошибка удаления loading GIF: {e}")
+
+def save_card(message: Message, card: TranslationCard) -> None:
+    """Сохраняет данные карточки для последующего добавления в Mochi"""
+    pending_cards.put(message.chat.id, message.message_id, {
+        'card': card.dump(),
+        'user_id': message.from_user.id
+    })
+
+
+def save_batch_card(message: Message, cards: List[TranslationCard]) -> None:
+    """Сохраняет все слова списка: кнопка "Добавить все в Mochi" экспортирует их одним заданием"""
+    pending_cards.put(message.chat.id, message.message_id, {
+        'cards': [card.dump() for card in cards],
+        'user_id': message.from_user.id
+    })
+
+
+def send_batch(message: Message, cards: List[TranslationCard], skipped: int = 0) -> None:
+    """Отправляет альбом с карточками слов и сводку со всеми переводами и кнопкой Mochi"""
+    # Подпись фото в Telegram - не больше 1024 символов
+    photos = [(card.image_url, card.render_telegram(max_length=1024)) for card in cards if card.image_url]
+
+    with stage("telegram_send"):
+        try:
+            if len(photos) > 1:
+                media_cache.send_photo_group(
+                    message.chat.id, photos, parse_mode='Markdown', reply_to_message_id=message.message_id
+                )
+            elif photos:
+                media_cache.send_photo(
+                    message.chat.id, photos[0][0], caption=photos[0][1], parse_mode='Markdown',
+                    reply_to_message_id=message.message_id
+                )
+        except Exception as e:
+            # Сводка ниже содержит все переводы, поэтому без альбома можно обойтись
+            logger.error(f"Ошибка отправки альбома: {e}")
+
+        lines = [f"📝 *Слова ({len(cards)}):*", ""]
+        lines += [f"• *{card.word}* — {card.translation}" for card in cards]
+        if skipped:
+            lines += ["", f"Не переведено слов сверх лимита: {skipped}"]
+        keyboard = build_mochi_keyboard(message.message_id, f"📚 Добавить все в Mochi ({len(cards)})")
+        bot.reply_to(message, "\n".join(lines), parse_mode='Markdown', reply_markup=keyboard)
+
+
+def translate_word(message: Message) -> None:
+    logger.info(f"translate_word called for: {message.text}")
+    loading_msg = None
+
+    try:
+        text = message.text.strip()
+
+        # Отправляем GIF с загрузкой
+        loading_msg = send_loading(message)
+
+        # Показываем индикатор "печатает..."
+        bot.send_chat_action(message.chat.id, 'typing')
+
+        # Используем LangChain цепочку для перевода (с кэшем)
+        with stage("translation"):
+            card = get_translation(text)
+
+        # Показываем индикатор "загружает фото..."
+        bot.send_chat_action(message.chat.id, 'upload_photo')
+
+        # Ключевое слово для поиска изображения (если не пришло вместе с переводом)
+        if not card.image_keyword:
+            card = remember_keyword(text, card, get_image_search_keyword(text))
+
+        # Получаем изображение по ключевому слову
+        with stage("image_search"):
+            card = card.with_image(image_search.get_image_url(card.image_keyword))
+        logger.info(f"Получен URL изображения: {card.image_url}")
+
+        save_card(message, card)
+        send_translation(message, card, build_mochi_keyboard(message.message_id))
+
+        delete_loading(message, loading_msg)
 
     except Exception as e:
         logger.error(f"Ошибка при переводе: {e}")
         # Удаляем GIF в случае ошибки
-        if loading_msg:
-            try:
-                bot.delete_message(message.chat.id, loading_msg.message_id)
-            except Exception as ex:
-                logger.error(f"Ошибка удаления loading GIF: {ex}")
+        delete_loading(message, loading_msg)
         bot.reply_to(message, f"Произошла ошибка при переводе: {str(e)}\nПопробуйте еще раз.")
 
 
-def handle_add_to_mochi(call: CallbackQuery):
-    logger.info(f"handle_add_to_mochi called for: {call.data}")
+async def translate_word_async(message: Message, show_loading: bool = True) -> None:
+    """Асинхронный вариант translate_word"""
+    logger.info(f"translate_word_async called for: {message.text}")
+    text = message.text.strip()
+
+    # Отправка GIF и индикатора не задерживает запросы к LLM
+    loading_task = asyncio.create_task(asyncio.to_thread(send_loading, message)) if show_loading else None
+    typing_task = asyncio.create_task(asyncio.to_thread(bot.send_chat_action, message.chat.id, 'typing'))
+    loading_msg = None
+
     try:
-        # Извлекаем message_id из callback_data
-        message_id = int(call.data.split('_')[2])
+        with stage("translation"):
+            card = await translate_with_image_async(text)
 
-        if message_id not in user_cards:
-            bot.answer_callback_query(call.id, "❌ Данные карточки не найдены", show_alert=True)
-            return
+        await run_io(save_card, message, card)
+        await asyncio.to_thread(send_translation, message, card, build_mochi_keyboard(message.message_id))
+    except Exception as e:
+        logger.error(f"Ошибка при переводе: {e}")
+        await asyncio.to_thread(
+            bot.reply_to, message, f"Произошла ошибка при переводе: {str(e)}\nПопробуйте еще раз."
+        )
+    finally:
+        await asyncio.gather(typing_task, return_exceptions=True)
+        if loading_task:
+            try:
+                loading_msg = await loading_task
+            except Exception as e:
+                logger.error(f"Ошибка отправки loading GIF: {e}")
+            await asyncio.to_thread(delete_loading, message, loading_msg)
 
-        card_data = user_cards[message_id]
 
-        # Получаем API ключ из переменных окружения
-        mochi_api_key = os.getenv("MOCHI_API_KEY")
-        if not mochi_api_key:
-            bot.answer_callback_query(
-                call.id,
-                "❌ MOCHI_API_KEY не найден в .env файле",
-                show_alert=True
-            )
-            return
+def edit_draft(message: Message, draft: Message, draft_text: str, **kwargs) -> None:
+    """Редактирует черновик ответа, игнорируя ошибки (например, "message is not modified")"""
+    try:
+        bot.edit_message_text(draft_text, message.chat.id, draft.message_id, **kwargs)
+    except Exception as e:
+        logger.debug(f"Ошибка обновления черновика: {e}")
 
-        # Создаем подключение к Mochi
-        mochi = MochiConnect(mochi_api_key)
 
-        # Проверяем подключение
-        if not mochi.check_connection():
-            bot.answer_callback_query(
-                call.id,
-                "❌ Не удалось подключиться к Mochi.\nПроверьте API ключ.",
-                show_alert=True
+async def translate_word_streaming(message: Message) -> None:
+    """Потоковый перевод: ответ LLM показывается по мере генерации правкой сообщения"""
+    logger.info(f"translate_word_streaming called for: {message.text}")
+    text = message.text.strip()
+    key = translation_cache_key(text)
+
+    # Готовый перевод показывать по частям незачем
+    if await run_io(local_translation, text) is not None:
+        await translate_word_async(message, show_loading=False)
+        return
+
+    # Поиск изображения идет параллельно с генерацией перевода
+    image_task = asyncio.create_task(find_image_async(text))
+    header = f"📝 Слово: {text}\n\n"
+    draft = None
+
+    try:
+        draft = await asyncio.to_thread(
+            bot.send_message, message.chat.id, f"{header}⏳ Перевожу...", reply_to_message_id=message.message_id
+        )
+
+        chunks = []
+        edit_task = None
+        last_edit = time.monotonic()
+        async with llm_scheduler.slot_async():
+            with stage("llm_translation_stream"):
+                async for chunk in llm_router.astream("translation", text, translation_inputs(text)):
+                    chunks.append(chunk)
+                    # Telegram ограничивает частоту правок: не чаще STREAM_EDIT_INTERVAL и не больше одной одновременно
+                    now = time.monotonic()
+                    if now - last_edit >= STREAM_EDIT_INTERVAL and (edit_task is None or edit_task.done()):
+                        last_edit = now
+                        edit_task = asyncio.create_task(
+                            asyncio.to_thread(edit_draft, message, draft, header + "".join(chunks) + " ▌")
+                        )
+
+        if edit_task:
+            await edit_task
+
+        # Ответ разбирается один раз, дальше используется карточка
+        card = _text_to_card(text, "".join(chunks))
+        with stage("image_wait"):
+            keyword, image_url = await image_task
+        # Ключевое слово кэшируется вместе с переводом: при попадании в кэш запрос keyword не нужен
+        card = card.with_keyword(keyword)
+        await run_io(translation_cache.set, key, card.dump())
+        card = card.with_image(image_url)
+
+        keyboard = build_mochi_keyboard(message.message_id)
+        await run_io(save_card, message, card)
+
+        if card.image_url:
+            # Заменяем черновик итоговым фото с подписью
+            await asyncio.to_thread(send_translation, message, card, keyboard)
+            await asyncio.to_thread(delete_loading, message, draft)
+        else:
+            await asyncio.to_thread(
+                edit_draft, message, draft, card.render_telegram(), parse_mode='Markdown', reply_markup=keyboard
             )
-            return
+    except Exception as e:
+        logger.error(f"Ошибка при переводе: {e}")
+        image_task.cancel()
+        await asyncio.to_thread(delete_loading, message, draft)
+        await asyncio.to_thread(
+            bot.reply_to, message, f"Произошла ошибка при переводе: {str(e)}\nПопробуйте еще раз."
+        )
 
-        # Создаем уникальное имя колоды для пользователя
-        user_id = card_data['user_id']
-        user_name = call.from_user.first_name or f"User{user_id}"
-        deck_name = f"Vocabulary Bot - {user_name}"
 
-        # Получаем или создаем колоду
-        deck_id = mochi.get_or_create_deck(deck_name)
+def translate_batch(message: Message, items: List[str]) -> None:
+    """Переводит список слов одним запросом к LLM"""
+    logger.info(f"translate_batch called for {len(items)} items")
+    skipped = max(0, len(items) - BATCH_MAX_ITEMS)
+    items = items[:BATCH_MAX_ITEMS]
+    loading_msg = None
 
-        # Парсим перевод и примеры из AI ответа
-        ai_text = card_data['translation']
-        translation = ""
-        examples = ""
-
-        # Извлекаем перевод (строка после "Перевод:")
-        if "Перевод:" in ai_text:
-            parts = ai_text.split("Перевод:", 1)[1]
-            if "Примеры:" in parts:
-                translation = parts.split("Примеры:", 1)[0].strip()
-                examples_text = parts.split("Примеры:", 1)[1].strip()
-                examples = examples_text
-            else:
-                translation = parts.strip()
-
-        # Формируем front и back для Basic flashcard
-        # Front - слово (большой размер через заголовок)
-        front_text = f"# {card_data['word']}"
-
-        # Back - перевод (большой размер) и примеры
-        back_text = f"## {translation or ai_text}"
-        if examples:
-            back_text += f"\n\n{examples}"
-
-        # Проверяем, существует ли уже такая карточка
-        if mochi.card_exists(deck_id, front_text):
-            logger.info(f"Карточка уже существует: {front_text}")
-            bot.answer_callback_query(call.id, "⚠️ Такая карточка уже существует в Mochi!", show_alert=True)
-
-            # Обновляем кнопку на статус "уже существует"
-            exists_keyboard = InlineKeyboardMarkup()
-            exists_btn = InlineKeyboardButton("⚠️ Карточка уже существует", callback_data="done")
-            exists_keyboard.add(exists_btn)
-            try:
-                bot.edit_message_reply_markup(
-                    call.message.chat.id,
-                    call.message.message_id,
-                    reply_markup=exists_keyboard
+    try:
+        loading_msg = send_loading(message)
+        bot.send_chat_action(message.chat.id, 'typing')
+
+        with stage("batch_translation"):
+            cards = batch_translate(items)
+
+        bot.send_chat_action(message.chat.id, 'upload_photo')
+        with stage("image_search"):
+            cards = batch_image_urls(cards)
+
+        save_batch_card(message, cards)
+        send_batch(message, cards, skipped)
+
+        delete_loading(message, loading_msg)
+
+    except Exception as e:
+        logger.error(f"Ошибка при переводе списка: {e}")
+        delete_loading(message, loading_msg)
+        bot.reply_to(message, f"Произошла ошибка при переводе: {str(e)}\nПопробуйте еще раз.")
+
+
+async def translate_batch_async(message: Message, items: List[str]) -> None:
+    """Асинхронный вариант translate_batch"""
+    logger.info(f"translate_batch_async called for {len(items)} items")
+    skipped = max(0, len(items) - BATCH_MAX_ITEMS)
+    items = items[:BATCH_MAX_ITEMS]
+
+    loading_task = asyncio.create_task(asyncio.to_thread(send_loading, message))
+    typing_task = asyncio.create_task(asyncio.to_thread(bot.send_chat_action, message.chat.id, 'typing'))
+    loading_msg = None
+
+    try:
+        with stage("batch_translation"):
+            cards = await batch_translate_async(items)
+        with stage("image_search"):
+            cards = await batch_image_urls_async(cards)
+
+        await run_io(save_batch_card, message, cards)
+        await asyncio.to_thread(send_batch, message, cards, skipped)
+    except Exception as e:
+        logger.error(f"Ошибка при переводе списка: {e}")
+        await asyncio.to_thread(
+            bot.reply_to, message, f"Произошла ошибка при переводе: {str(e)}\nПопробуйте еще раз."
+        )
+    finally:
+        await asyncio.gather(typing_task, return_exceptions=True)
+        try:
+            loading_msg = await loading_task
+        except Exception as e:
+            logger.error(f"Ошибка отправки loading GIF: {e}")
+        await asyncio.to_thread(delete_loading, message, loading_msg)
+
+
+_mochi: Optional["MochiConnect"] = None
+_mochi_lock = threading.Lock()
+
+
+def get_mochi() -> Optional["MochiConnect"]:
+    """Возвращает общее подключение к Mochi (создается при первом обращении)"""
+    global _mochi
+    if _mochi is None:
+        with _mochi_lock:
+            if _mochi is None:
+                # Получаем API ключ из переменных окружения
+                mochi_api_key = os.getenv("MOCHI_API_KEY")
+                if not mochi_api_key:
+                    return None
+                # Клиент Mochi импортируется только при первом экспорте
+                from mochi_ import MochiConnect, MOCHI_BASE_API
+                _mochi = MochiConnect(
+                    mochi_api_key,
+                    base_url=os.getenv("MOCHI_API_URL", MOCHI_BASE_API),
+                    cache_ttl=float(os.getenv("MOCHI_CACHE_TTL", "3600")),
+                    card_index=create_card_index(
+                        CACHE_DB_PATH,
+                        ttl=float(os.getenv("MOCHI_INDEX_TTL", str(24 * 3600)))
+                    ),
+                    duplicate_mode=os.getenv("MOCHI_DUPLICATE_MODE", "exact"),
+                    fuzzy_cutoff=float(os.getenv("MOCHI_FUZZY_CUTOFF", "0.85")),
+                    image_max_width=int(os.getenv("MOCHI_IMAGE_MAX_WIDTH", "0")),
+                    image_quality=int(os.getenv("MOCHI_IMAGE_QUALITY", "75")),
+                    http_clients=http_clients
                 )
-            except Exception as e:
-                logger.error(f"Ошибка обновления кнопки: {e}")
+    return _mochi
 
-            # Удаляем данные карточки
-            del user_cards[message_id]
-            return
 
-        # Добавляем карточку в Mochi
+def export_card(job: dict) -> str:
+    """Добавляет карточку в Mochi (выполняется воркером очереди экспорта)"""
+    with stage("mochi_export"):
+        return _export_card(job)
+
+
+def _export_card(job: dict) -> str:
+    # Получаем общее подключение к Mochi
+    mochi = get_mochi()
+    if mochi is None:
+        raise RuntimeError("MOCHI_API_KEY не найден в .env файле")
+
+    # Проверяем подключение
+    if not mochi.check_connection():
+        raise RuntimeError("Не удалось подключиться к Mochi")
+
+    # Создаем уникальное имя колоды для пользователя
+    deck_name = f"Vocabulary Bot - {job['user_name']}"
+
+    # Получаем или создаем колоду
+    with stage("mochi_deck"):
+        deck_id = mochi.get_or_create_deck(deck_name)
+
+    # Пакетное задание ("Добавить все") содержит список карточек; задания старого формата - поля карточки
+    cards = job.get('cards') or [job.get('card') or job]
+    results = [export_one_card(mochi, deck_id, TranslationCard.load(card)) for card in cards]
+    return RESULT_ADDED if RESULT_ADDED in results else RESULT_EXISTS
+
+
+def export_one_card(mochi: "MochiConnect", deck_id: str, card: TranslationCard) -> str:
+    """Добавляет одну карточку в колоду, если ее там еще нет"""
+    # Front - слово, back - перевод и примеры (Basic flashcard)
+    front_text, back_text = card.render_mochi()
+
+    # Проверяем, существует ли уже такая карточка
+    with stage("mochi_duplicate_check"):
+        exists = mochi.card_exists(deck_id, front_text)
+    if exists:
+        logger.info(f"Карточка уже существует: {front_text}")
+        return RESULT_EXISTS
+
+    # Добавляем карточку в Mochi
+    with stage("mochi_add_card"):
         mochi.add_card(
             deck_id=deck_id,
             front_text=front_text,
             back_text=back_text,
-            image_url=card_data['image_url']
+            image_url=card.image_url
         )
 
-        logger.info(f"Карточка добавлена в Mochi: {front_text}")
-        bot.answer_callback_query(call.id, "✅ Карточка добавлена в Mochi!", show_alert=False)
+    logger.info(f"Карточка добавлена в Mochi: {front_text}")
+    return RESULT_ADDED
 
-        # Обновляем кнопку на успешное сообщение
-        success_keyboard = InlineKeyboardMarkup()
-        success_btn = InlineKeyboardButton("✅ Добавлено в Mochi", callback_data="done")
-        success_keyboard.add(success_btn)
 
-        try:
-            bot.edit_message_reply_markup(
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=success_keyboard
+# Текст кнопки после обработки задания экспорта
+EXPORT_RESULT_BUTTONS = {
+    RESULT_ADDED: "✅ Добавлено в Mochi",
+    RESULT_EXISTS: "⚠️ Карточка уже существует",
+    RESULT_FAILED: "❌ Не удалось добавить в Mochi"
+}
+
+
+def set_mochi_button(chat_id: int, message_id: int, text: str) -> None:
+    """Заменяет кнопку под сообщением с переводом на статус"""
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton(text, callback_data="done"))
+    try:
+        bot.edit_message_reply_markup(chat_id, message_id, reply_markup=keyboard)
+    except Exception as e:
+        logger.error(f"Ошибка обновления кнопки: {e}")
+
+
+def on_export_finished(job: dict, result: str) -> None:
+    """Показывает результат экспорта на кнопке"""
+    set_mochi_button(job['chat_id'], job['message_id'], EXPORT_RESULT_BUTTONS[result])
+
+
+# Очередь экспорта в Mochi: кнопка отвечает сразу, карточка создается в фоне
+export_queue = ExportQueue(
+    os.getenv("EXPORT_QUEUE_PATH", "data/export_queue.sqlite3"),
+    export_card,
+    on_finish=on_export_finished,
+    workers=int(os.getenv("MOCHI_EXPORT_WORKERS", "2")),
+    batch_size=int(os.getenv("MOCHI_EXPORT_BATCH_SIZE", "10")),
+    max_attempts=int(os.getenv("MOCHI_EXPORT_MAX_ATTEMPTS", "5")),
+    rate=float(os.getenv("MOCHI_EXPORT_RATE", "5"))
+)
+
+
+def handle_add_to_mochi(call: CallbackQuery):
+    logger.info(f"handle_add_to_mochi called for: {call.data}")
+    try:
+        # Извлекаем message_id из callback_data
+        message_id = int(call.data.rsplit('_', 1)[1])
+
+        chat_id = call.message.chat.id
+        card_data = pending_cards.get(chat_id, message_id)
+        if card_data is None:
+            bot.answer_callback_query(call.id, "❌ Данные карточки не найдены", show_alert=True)
+            return
+
+        if not os.getenv("MOCHI_API_KEY"):
+            bot.answer_callback_query(
+                call.id,
+                "❌ MOCHI_API_KEY не найден в .env файле",
+                show_alert=True
             )
-        except Exception as e:
-            logger.error(f"Ошибка обновления кнопки: {e}")
+            return
 
-        # Удаляем данные карточки
-        del user_cards[message_id]
+        user_id = card_data['user_id']
+        with stage("mochi_enqueue"):
+            # Ключ идемпотентности: повторное нажатие кнопки не создаст второе задание
+            job = {
+                'chat_id': chat_id,
+                'message_id': call.message.message_id,
+                'user_name': call.from_user.first_name or f"User{user_id}"
+            }
+            if 'cards' in card_data:
+                # Все слова списка - одно задание экспорта
+                job['cards'] = card_data['cards']
+            else:
+                job['card'] = card_data.get('card') or TranslationCard.load(card_data).dump()
+            job_id = export_queue.enqueue(user_id, job, idempotency_key=f"add_mochi:{chat_id}:{message_id}")
+
+        if job_id is None:
+            bot.answer_callback_query(call.id, "⏳ Карточка уже добавляется в Mochi", show_alert=False)
+            return
+
+        # Данные карточки теперь хранятся в очереди экспорта
+        pending_cards.delete(chat_id, message_id)
+
+        with stage("telegram_send"):
+            bot.answer_callback_query(call.id, "⏳ Карточка добавляется в Mochi", show_alert=False)
+            set_mochi_button(chat_id, call.message.message_id, "⏳ Добавляется в Mochi...")
 
     except Exception as e:
         error_msg = str(e)
@@ -348,32 +1102,266 @@ def handle_add_to_mochi(call: CallbackQuery):
 # FastAPI endpoints
 @app.get("/")
 async def root():
+    """Проверка, что процесс жив (liveness)"""
     return {"status": "Bot is running"}
 
 
+@app.get("/ready")
+async def ready():
+    """Готовность принимать обновления (readiness): 503, пока идет запуск или прогрев"""
+    if not _ready:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "ready"}
+
+
+def check_rate_limit(message: Message) -> bool:
+    """True, если пользователь превысил лимит (предупреждение отправляется один раз)"""
+    retry_after, notify = user_limiter.check(message.from_user.id)
+    if not retry_after:
+        return False
+
+    logger.info(f"Пользователь {message.from_user.id} превысил лимит запросов")
+    if notify:
+        bot.reply_to(
+            message,
+            f"⏳ Слишком много запросов. Попробуйте еще раз через {math.ceil(retry_after)} с."
+        )
+    return True
+
+
+def process_update(json_data: dict) -> None:
+    """Обрабатывает одно обновление Telegram"""
+    with profiled("update"), stage("update"):
+        _process_update(json_data)
+
+
+def _process_update(json_data: dict) -> None:
+    # Обрабатываем сообщения
+    if 'message' in json_data:
+        message = telebot.types.Message.de_json(json_data['message'])
+        logger.info(f"Message from {message.from_user.first_name}: {message.text}")
+        current_user.set(message.from_user.id)
+
+        if message.text and message.text.startswith('/start'):
+            start_bot(message)
+        elif not (message.text or "").strip():
+            # Стикеры, фото и другие сообщения без текста не переводим
+            return
+        elif not check_rate_limit(message):
+            items = split_batch(message.text)
+            if items:
+                translate_batch(message, items)
+            else:
+                translate_word(message)
+
+    # Обрабатываем callback queries
+    elif 'callback_query' in json_data:
+        callback_query = telebot.types.CallbackQuery.de_json(json_data['callback_query'])
+        logger.info(f"Callback query: {callback_query.data}")
+        current_user.set(callback_query.from_user.id)
+        handle_add_to_mochi(callback_query)
+
+
+async def handle_update(json_data: dict) -> None:
+    """Обрабатывает обновление, не блокируя event loop"""
+    if not ASYNC_PIPELINE:
+        await asyncio.to_thread(process_update, json_data)
+        return
+
+    # Версия кэша строит шаблоны промптов (импорт langchain): не в event loop
+    if _translation_cache_version is None:
+        await asyncio.to_thread(translation_cache_version)
+
+    with profiled("update"), stage("update"):
+        await _handle_update(json_data)
+
+
+async def _handle_update(json_data: dict) -> None:
+    if 'message' in json_data:
+        message = telebot.types.Message.de_json(json_data['message'])
+        logger.info(f"Message from {message.from_user.first_name}: {message.text}")
+        current_user.set(message.from_user.id)
+
+        if message.text and message.text.startswith('/start'):
+            await asyncio.to_thread(start_bot, message)
+            return
+        if not (message.text or "").strip():
+            # Стикеры, фото и другие сообщения без текста не переводим
+            return
+        if await asyncio.to_thread(check_rate_limit, message):
+            return
+
+        items = split_batch(message.text)
+        if items:
+            await translate_batch_async(message, items)
+        elif STREAMING:
+            await translate_word_streaming(message)
+        else:
+            await translate_word_async(message)
+
+    elif 'callback_query' in json_data:
+        callback_query = telebot.types.CallbackQuery.de_json(json_data['callback_query'])
+        logger.info(f"Callback query: {callback_query.data}")
+        current_user.set(callback_query.from_user.id)
+        await asyncio.to_thread(handle_add_to_mochi, callback_query)
+
+
+# Асинхронный конвейер перевода (0 - синхронные обработчики в пуле потоков)
+ASYNC_PIPELINE = os.getenv("ASYNC_PIPELINE", "1") == "1"
+
+# Потоковая выдача перевода правками сообщения (только для асинхронного конвейера)
+STREAMING = os.getenv("STREAMING", "0") == "1"
+# Минимальный интервал между правками сообщения в секундах
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+# Очередь обновлений: webhook только ставит обновление в очередь, обработкой занимаются воркеры
+update_queue = UpdateQueue(
+    handle_update,
+    workers=int(os.getenv("WORKER_COUNT", "4")),
+    max_size=int(os.getenv("UPDATE_QUEUE_MAX_SIZE", "1000"))
+)
+
+# Режим получения обновлений: webhook (POST /webhook) или polling (getUpdates пачками)
+BOT_MODE = os.getenv("BOT_MODE", "webhook")
+if BOT_MODE not in ("webhook", "polling"):
+    raise ValueError(f"Неизвестный BOT_MODE: {BOT_MODE}")
+
+update_poller = UpdatePoller(
+    bot.token,
+    update_queue,
+    update_dedup,
+    limit=int(os.getenv("POLLING_LIMIT", "100")),
+    timeout=int(os.getenv("POLLING_TIMEOUT", "50")),
+    max_attempts=int(os.getenv("POLLING_MAX_ATTEMPTS", "3")),
+    poll_interval=float(os.getenv("POLLING_INTERVAL", "0.1"))
+) if BOT_MODE == "polling" else None
+
+stats_collector.add_gauge("update_queue_size", lambda: update_queue.size)
+stats_collector.add_gauge("update_queue_shed", lambda: update_queue.shed_count)
+stats_collector.add_gauge("update_duplicates", lambda: update_dedup.duplicates_count)
+stats_collector.add_gauge("user_rate_limited", lambda: user_limiter.rejected_count)
+stats_collector.add_gauge("llm_active", lambda: llm_scheduler.active)
+stats_collector.add_gauge("llm_waiting", lambda: llm_scheduler.waiting)
+stats_collector.add_gauge("mochi_export_pending", lambda: export_queue.stats().get("pending", 0))
+stats_collector.add_gauge("unsplash_ratelimit_remaining", lambda: image_search.ratelimit_remaining)
+stats_collector.add_gauge("unsplash_ratelimit_limit", lambda: image_search.ratelimit_limit)
+# Размер хранилища карточек: в Redis не считается (обход всех ключей)
+if hasattr(pending_cards.backend, "approx_bytes"):
+    stats_collector.add_gauge("pending_cards", lambda: len(pending_cards.backend))
+    stats_collector.add_gauge("pending_cards_bytes", lambda: pending_cards.backend.approx_bytes())
+stats_collector.add_gauge("mochi_export_dead", lambda: export_queue.stats().get("dead", 0))
+
+
+# Процесс готов принимать обновления (/ready): после запуска и фонового прогрева
+_ready = False
+
+
+def prewarm() -> None:
+    """Импортирует тяжелые модули и создает модели, цепочки и клиент Mochi заранее"""
+    started = time.perf_counter()
+    llm_router.prewarm()
+    translation_cache_version()
+    get_mochi()
+    logger.info(f"Прогрев завершен за {time.perf_counter() - started:.2f} с")
+
+
+async def _prewarm_and_mark_ready() -> None:
+    global _ready
+    try:
+        await asyncio.to_thread(prewarm)
+    except Exception as e:
+        # Не прогретые объекты будут созданы при первом запросе (вне event loop)
+        logger.error(f"Ошибка прогрева: {e}", exc_info=True)
+    _ready = True
+
+
+@app.on_event("startup")
+async def startup():
+    update_queue.start()
+    export_queue.start()
+    if update_poller is not None:
+        update_poller.start()
+
+    # Модели, цепочки и клиент Mochi создаются в фоне сразу после запуска, а не в первом запросе
+    asyncio.create_task(_prewarm_and_mark_ready())
+
+    # Заранее получаем file_id GIF загрузки, чтобы первая же отправка не скачивала файл
+    loading_gif_chat_id = os.getenv("LOADING_GIF_CHAT_ID")
+    if loading_gif_chat_id:
+        asyncio.create_task(
+            asyncio.to_thread(media_cache.bootstrap_animation, LOADING_GIF_URL, int(loading_gif_chat_id))
+        )
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if update_poller is not None:
+        await update_poller.stop()
+    await update_queue.stop(timeout=float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30")))
+    await asyncio.to_thread(export_queue.stop)
+    image_search.close()
+    if dictionary is not None:
+        dictionary.close()
+    if _mochi is not None:
+        _mochi.close()
+    await http_clients.aclose()
+
+
+def collect_stats() -> dict:
+    """Счетчики кэшей и очереди обновлений (обращается к хранилищам: вызывать вне event loop)"""
+    return {
+        "update_queue": {
+            "size": update_queue.size,
+            "processed": update_queue.processed_count,
+            "failed": update_queue.failed_count,
+            "shed": update_queue.shed_count
+        },
+        "mode": BOT_MODE,
+        "polling": update_poller.stats() if update_poller is not None else None,
+        "translation_cache": translation_cache.stats(),
+        "dictionary": dictionary.stats() if dictionary is not None else None,
+        "pending_cards": pending_cards.stats(),
+        "update_dedup": update_dedup.stats(),
+        "rate_limit": {"users": user_limiter.stats(), "llm": llm_scheduler.stats()},
+        "llm": llm_router.stats(),
+        "mochi_export": export_queue.stats(),
+        "images": image_search.stats(),
+        "telegram_media": media_cache.stats()
+    }
+
+
+@app.get("/stats")
+async def stats():
+    """Счетчики кэшей и очереди обновлений"""
+    return await run_io(collect_stats)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики в формате Prometheus"""
+    # Сборщики метрик читают кэши и очередь экспорта из SQLite или Redis
+    body, content_type = await run_io(render_latest)
+    return Response(content=body, media_type=content_type)
+
+
 @app.post("/webhook")
 async def webhook(request: Request):
     """Обработка webhook от Telegram"""
     try:
         json_data = await request.json()
-        logger.info(f"Received update_id: {json_data.get('update_id')}")
-
-        # Обрабатываем сообщения напрямую
-        if 'message' in json_data:
-            message = telebot.types.Message.de_json(json_data['message'])
-            logger.info(f"Message from {message.from_user.first_name}: {message.text}")
+        update_id = json_data.get('update_id')
+        logger.info(f"Received update_id: {update_id}")
 
-            # Вызываем обработчики напрямую
-            if message.text and message.text.startswith('/start'):
-                start_bot(message)
-            else:
-                translate_word(message)
+        # Повторная доставка уже принятого обновления: подтверждаем без обработки
+        if update_id is not None and not await run_io(update_dedup.first_seen, update_id):
+            logger.info(f"Повтор update_id {update_id}, пропускаем")
+            return Response(status_code=200)
 
-        # Обрабатываем callback queries
-        elif 'callback_query' in json_data:
-            callback_query = telebot.types.CallbackQuery.de_json(json_data['callback_query'])
-            logger.info(f"Callback query: {callback_query.data}")
-            handle_add_to_mochi(callback_query)
+        # Если очередь переполнена, отвечаем 503 - Telegram повторит доставку позже
+        if not update_queue.submit(json_data):
+            if update_id is not None:
+                await run_io(update_dedup.forget, update_id)
+            return Response(status_code=503)
 
         return Response(status_code=200)
     except Exception as e:
@@ -384,6 +1372,12 @@ async def webhook(request: Request):
 @app.get("/set-webhook")
 async def set_webhook():
     """Установка webhook URL"""
+    if BOT_MODE == "polling":
+        return JSONResponse(
+            status_code=409,
+            content={"error": "BOT_MODE=polling: webhook is not used"}
+        )
+
     webhook_url = os.getenv("WEBHOOK_URL")
     if not webhook_url:
         return JSONResponse(
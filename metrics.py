@@ -0,0 +1,232 @@
+import os
+import time
+import random
+import pstats
+import logging
+import cProfile
+import threading
+from io import StringIO
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+from prometheus_client import REGISTRY, Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм в секундах: от быстрых обращений к кэшу до долгих ответов LLM
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_SECONDS = Histogram(
+    "bot_stage_seconds", "Длительность этапов обработки", ["stage"], buckets=LATENCY_BUCKETS
+)
+STAGE_ERRORS = Counter(
+    "bot_stage_errors_total", "Этапы, завершившиеся исключением", ["stage"]
+)
+LLM_SECONDS = Histogram(
+    "bot_llm_request_seconds", "Длительность запросов к LLM", ["model"], buckets=LATENCY_BUCKETS
+)
+LLM_ERRORS = Counter(
+    "bot_llm_errors_total", "Ошибки запросов к LLM", ["model"]
+)
+LLM_TOKENS = Counter(
+    "bot_llm_tokens_total", "Токены, израсходованные на запросы к LLM", ["model", "type"]
+)
+LLM_COST = Counter(
+    "bot_llm_cost_usd_total", "Стоимость запросов к LLM в долларах по ценам LLM_PRICES", ["model"]
+)
+LLM_ROUTED = Counter(
+    "bot_llm_routed_total", "Выбор модели маршрутизатором", ["kind", "model"]
+)
+LLM_FALLBACKS = Counter(
+    "bot_llm_fallbacks_total", "Повторы запроса на запасной модели после ошибки или таймаута", ["kind", "model"]
+)
+LLM_HEDGES = Counter(
+    "bot_llm_hedges_total", "Дублирующие запросы к второй модели: started - отправлен, won - ответил первым",
+    ["kind", "outcome"]
+)
+MOCHI_SECONDS = Histogram(
+    "bot_mochi_request_seconds", "Длительность запросов к Mochi API", ["operation", "status"],
+    buckets=LATENCY_BUCKETS
+)
+PROFILES_SAVED = Counter(
+    "bot_profiles_saved_total", "Сохраненные профили медленных запросов", ["name"]
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Замеряет длительность этапа (работает и внутри корутин: with stage(...): await ...)"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+class LLMUsage:
+    """Длительность запросов к модели, расход токенов и стоимость (для /stats и /metrics).
+
+    prices - цены в долларах за миллион входных и выходных токенов.
+    Заполняется callback LangChain из llm_callbacks.
+    """
+
+    def __init__(self, model: str, prices: Optional[Tuple[float, float]] = None):
+        self.model = model
+        self.prices = prices
+        self.requests = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+
+    def record(self, elapsed: Optional[float], input_tokens: int, output_tokens: int) -> None:
+        self.requests += 1
+        if elapsed is not None:
+            self.seconds += elapsed
+            LLM_SECONDS.labels(self.model).observe(elapsed)
+
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        if input_tokens:
+            LLM_TOKENS.labels(self.model, "input").inc(input_tokens)
+        if output_tokens:
+            LLM_TOKENS.labels(self.model, "output").inc(output_tokens)
+        if self.prices and (input_tokens or output_tokens):
+            cost = (input_tokens * self.prices[0] + output_tokens * self.prices[1]) / 1_000_000
+            self.cost += cost
+            LLM_COST.labels(self.model).inc(cost)
+
+    def record_error(self) -> None:
+        self.errors += 1
+        LLM_ERRORS.labels(self.model).inc()
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_seconds": self.seconds / self.requests if self.requests else 0.0,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cost_usd": round(self.cost, 6)
+        }
+
+
+class StatsCollector:
+    """Экспортирует счетчики кэшей и очередей, которые уже считаются в их stats()"""
+
+    def __init__(self):
+        self.caches: Dict[str, Any] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+
+    def add_cache(self, name: str, cache) -> None:
+        self.caches[name] = cache
+
+    def add_gauge(self, name: str, getter: Callable[[], float]) -> None:
+        self.gauges[name] = getter
+
+    def collect(self):
+        hits = CounterMetricFamily("bot_cache_hits", "Попадания в кэш", labels=["cache"])
+        misses = CounterMetricFamily("bot_cache_misses", "Промахи кэша", labels=["cache"])
+        hit_rate = GaugeMetricFamily("bot_cache_hit_rate", "Доля попаданий в кэш", labels=["cache"])
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            total = stats["hits"] + stats["misses"]
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            hit_rate.add_metric([name], stats["hits"] / total if total else 0.0)
+        yield hits
+        yield misses
+        yield hit_rate
+
+        for name, getter in self.gauges.items():
+            try:
+                value = getter()
+            except Exception as e:
+                logger.debug(f"Ошибка получения метрики {name}: {e}")
+                continue
+            if value is None:
+                # Значение еще неизвестно (например, квота до первого ответа API)
+                continue
+            gauge = GaugeMetricFamily(f"bot_{name}", name)
+            gauge.add_metric([], value)
+            yield gauge
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+def mochi_operation(method: str, url: str, base_url: str) -> str:
+    """Имя операции Mochi без идентификаторов: "POST cards/:id/attachments/:id" """
+    if not url.startswith(base_url):
+        return f"{method} image_download"
+    parts = [part for part in url[len(base_url):].split("?")[0].split("/") if part]
+    names = ("cards", "decks", "templates", "attachments")
+    return f"{method} " + "/".join(part if part in names else ":id" for part in parts)
+
+
+def mochi_response_hook(base_url: str) -> Callable:
+    """Хук requests: длительность каждого запроса к Mochi (до получения заголовков ответа)"""
+    def hook(response, *args, **kwargs):
+        operation = mochi_operation(response.request.method, response.request.url, base_url)
+        MOCHI_SECONDS.labels(operation, str(response.status_code)).observe(response.elapsed.total_seconds())
+        return response
+    return hook
+
+
+# Профилирование медленных запросов: профилируется доля PROFILE_SAMPLE_RATE обработок,
+# профиль сохраняется, если обработка заняла не меньше PROFILE_SLOW_SECONDS
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", "2"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "data/profiles")
+
+# Одновременно может работать только один профилировщик
+_profile_lock = threading.Lock()
+
+
+@contextmanager
+def profiled(name: str) -> Iterator[None]:
+    """Выборочно профилирует блок и сохраняет профиль, если он выполнялся медленно.
+
+    В корутинах профиль охватывает весь поток event loop, то есть и другие
+    задачи, выполнявшиеся в это время.
+    """
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE or not _profile_lock.acquire(False):
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _profile_lock.release()
+        duration = time.perf_counter() - start
+        if duration >= PROFILE_SLOW_SECONDS:
+            _save_profile(name, profiler, duration)
+
+
+def _save_profile(name: str, profiler: cProfile.Profile, duration: float) -> Optional[str]:
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{name}-{int(time.time() * 1000)}.prof")
+        profiler.dump_stats(path)
+        summary = StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(15)
+        logger.warning(f"Медленная обработка {name}: {duration:.2f} с, профиль {path}\n{summary.getvalue()}")
+        PROFILES_SAVED.labels(name).inc()
+        return path
+    except Exception as e:
+        logger.error(f"Ошибка сохранения профиля: {e}")
+        return None
+
+
+def render_latest():
+    """Тело и Content-Type ответа /metrics"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,20 +1,173 @@
+import time
 import uuid
 import logging
+import threading
 import requests
 from mochi.auth import Auth
-from typing import Optional
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 from mochi.client import Mochi
+from mochi.constant import MOCHI_BASE_API
+from requests.adapters import HTTPAdapter
+from card_index import CardIndex
+from http_clients import HttpClients
+from metrics import mochi_response_hook
 
 logger = logging.getLogger(__name__)
 
 
+# Расширения файлов для поддерживаемых типов изображений
+IMAGE_EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'image/avif': 'avif'
+}
+
+# Размер блока при потоковой передаче изображения
+CHUNK_SIZE = 64 * 1024
+
+
+def detect_image_type(content_type: Optional[str], head: bytes) -> str:
+    """Определяет тип изображения по заголовку ответа или по первым байтам файла"""
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in IMAGE_EXTENSIONS:
+        return content_type
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[4:12] == b'ftypavif':
+        return 'image/avif'
+    return 'image/jpeg'
+
+
+class _SizedStream:
+    """Поток блоков известной длины: requests отправит Content-Length вместо chunked"""
+
+    def __init__(self, chunks: Iterable[bytes], length: int):
+        self.chunks = chunks
+        self.length = length
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self.chunks)
+
+    def __len__(self) -> int:
+        return self.length
+
+
+def _is_not_found(error: Exception) -> bool:
+    """Проверяет, что ошибка - ответ 404 от Mochi API"""
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code == 404
+
+
 class MochiConnect:
-    """Класс для работы с Mochi API через mochi-api-client"""
+    """Класс для работы с Mochi API через mochi-api-client.
+
+    Рассчитан на долгое использование одним экземпляром: шаблон, ID его полей и
+    соответствие имен колод их ID кэшируются на cache_ttl секунд и сбрасываются
+    при ответе 404.
+    """
 
-    def __init__(self, api_key: str):
+    # Максимальный размер страницы в API Mochi
+    PAGE_SIZE = 100
+
+    def __init__(self, api_key: str, cache_ttl: float = 3600, pool_size: int = 10,
+                 card_index: Optional[CardIndex] = None, duplicate_mode: str = "exact",
+                 fuzzy_cutoff: float = 0.85, base_url: str = MOCHI_BASE_API,
+                 image_max_width: int = 0, image_quality: int = 75,
+                 http_clients: Optional[HttpClients] = None):
         self.api_key = api_key
+        self.base_url = base_url
         auth = Auth.Token(api_key)
-        self.client = Mochi(auth=auth) # type: ignore
+        self.client = Mochi(auth=auth, base_url=base_url) # type: ignore
+        self.cache_ttl = cache_ttl
+        # Индекс лицевых сторон карточек для проверки дубликатов
+        self.card_index = card_index or CardIndex()
+        self.duplicate_mode = duplicate_mode
+        self.fuzzy_cutoff = fuzzy_cutoff
+        # Уменьшение изображения на стороне источника (0 - без изменений)
+        self.image_max_width = image_max_width
+        self.image_quality = image_quality
+
+        # Отдельная сессия для вложений и скачивания изображений:
+        # у сессии клиента жестко заданы Content-Type: application/json и авторизация Mochi
+        if http_clients is not None:
+            # Общий пул соединений бота
+            self.session = http_clients.create_session()
+            http_clients.mount(self.client.session)
+        else:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            for session in (self.client.session, self.session):
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+
+        # Хук замеряет длительность каждого запроса к API (и скачивания изображений)
+        hook = mochi_response_hook(base_url)
+        for session in (self.client.session, self.session):
+            session.hooks['response'].append(hook)
+
+        self._lock = threading.Lock()
+        self._template: Optional[Tuple[dict, Optional[str], Optional[str]]] = None
+        self._template_loaded_at = 0.0
+        self._decks: Dict[str, str] = {}
+        self._decks_loaded_at = 0.0
+
+    def invalidate_cache(self) -> None:
+        """Сбрасывает кэш шаблона и колод"""
+        with self._lock:
+            self._template = None
+            self._template_loaded_at = 0.0
+            self._decks = {}
+            self._decks_loaded_at = 0.0
+
+    def _fresh(self, loaded_at: float) -> bool:
+        return time.monotonic() - loaded_at < self.cache_ttl
+
+    def get_template_fields(self) -> Tuple[Optional[dict], Optional[str], Optional[str]]:
+        """Возвращает (шаблон, ID поля front, ID поля back), используя кэш"""
+        with self._lock:
+            if self._template is not None and self._fresh(self._template_loaded_at):
+                return self._template
+
+        template = self.get_basic_template()
+        front_field_id = None
+        back_field_id = None
+
+        if template:
+            # Ищем ID полей "front" и "back" (или похожие)
+            fields_info = template.get('fields', {})
+            logger.info(f"Поля шаблона: {fields_info}")
+            for field_id, field_data in fields_info.items():
+                field_name = field_data.get('name', '').lower()
+                if 'front' in field_name or field_name == 'name':
+                    front_field_id = field_id
+                elif 'back' in field_name:
+                    back_field_id = field_id
+
+            logger.info(f"Front field ID: {front_field_id}, Back field ID: {back_field_id}")
+
+            # Кэшируем только найденный шаблон, чтобы временная ошибка не закрепилась
+            with self._lock:
+                self._template = (template, front_field_id, back_field_id)
+                self._template_loaded_at = time.monotonic()
+
+        return template, front_field_id, back_field_id
+
+    def _load_decks(self) -> Dict[str, str]:
+        decks = self.client.decks.list_decks()
+        deck_ids = {deck['name']: deck['id'] for deck in decks if deck.get('name')}
+        with self._lock:
+            self._decks = deck_ids
+            self._decks_loaded_at = time.monotonic()
+        return deck_ids
 
     def get_basic_template(self) -> Optional[dict]:
         """Получает шаблон Basic (с полями Front и Back)"""
@@ -42,65 +195,152 @@ class MochiConnect:
 
     def get_or_create_deck(self, deck_name: str) -> str:
         """Получает или создает колоду по имени и возвращает deck_id"""
-        # Получаем список всех колод
-        decks = self.client.decks.list_decks()
+        with self._lock:
+            if self._fresh(self._decks_loaded_at) and deck_name in self._decks:
+                return self._decks[deck_name]
 
-        # Ищем колоду с нужным именем
-        for deck in decks:
-            if deck.get('name') == deck_name:
-                return deck['id']
+        # Получаем актуальный список колод
+        deck_id = self._load_decks().get(deck_name)
+        if deck_id:
+            return deck_id
 
         # Если не найдена, создаем новую
         new_deck = self.client.decks.create_deck(name=deck_name)
+        with self._lock:
+            self._decks[deck_name] = new_deck['id']
         return new_deck['id']
 
-    def card_exists(self, deck_id: str, front_text: str) -> bool:
-        """Проверяет, существует ли карточка с таким front текстом в колоде"""
+    def iter_cards(self, deck_id: str) -> Iterator[dict]:
+        """Перебирает все карточки колоды постранично (list_cards клиента возвращает только первую страницу)"""
+        bookmark = None
+        while True:
+            params = {"deck-id": deck_id, "limit": self.PAGE_SIZE}
+            if bookmark:
+                params["bookmark"] = bookmark
+            response = self.client.session.get(f"{self.base_url}cards/", params=params, timeout=30)
+            response.raise_for_status()
+            data = response.json()
+
+            docs = data.get("docs", [])
+            yield from docs
+
+            next_bookmark = data.get("bookmark")
+            if len(docs) < self.PAGE_SIZE or not next_bookmark or next_bookmark == bookmark:
+                return
+            bookmark = next_bookmark
+
+    def _card_front(self, card: dict, front_field_id: Optional[str]) -> str:
+        """Лицевая сторона карточки: поле front шаблона или первая часть content"""
+        fields = card.get('fields') or {}
+        if front_field_id and front_field_id in fields:
+            return fields[front_field_id].get('value', '')
+        content = card.get('content', '')
+        if content:
+            return content.split('\n---\n', 1)[0]
+        return card.get('name', '')
+
+    def build_index(self, deck_id: str) -> None:
+        """Строит индекс лицевых сторон колоды по всем страницам карточек"""
+        _, front_field_id, _ = self.get_template_fields()
+        fronts = [self._card_front(card, front_field_id) for card in self.iter_cards(deck_id)]
+        self.card_index.rebuild(deck_id, fronts)
+
+    def card_exists(self, deck_id: str, front_text: str, mode: Optional[str] = None) -> bool:
+        """Проверяет, существует ли карточка с таким front текстом в колоде.
+
+        mode="exact" - совпадение нормализованного текста, mode="fuzzy" - похожий текст
+        (difflib, порог fuzzy_cutoff). По умолчанию используется duplicate_mode.
+        """
+        mode = mode or self.duplicate_mode
         try:
-            # Получаем все карточки из колоды
-            cards = self.client.cards.list_cards(deck_id=deck_id)
-
-            # Нормализуем искомый текст (убираем markdown заголовки и пробелы)
-            normalized_search = front_text.replace('#', '').strip().lower()
-
-            # Проверяем каждую карточку
-            for card in cards:
-                # Проверяем в полях
-                fields = card.get('fields', {})
-                for field_id, field_data in fields.items():
-                    field_value = field_data.get('value', '')
-                    normalized_field = field_value.replace('#', '').strip().lower()
-                    if normalized_search in normalized_field or normalized_field in normalized_search:
-                        logger.info(f"Найдена существующая карточка: {card.get('id')}")
-                        return True
-
-                # Также проверяем content для карточек без шаблона
-                content = card.get('content', '')
-                normalized_content = content.replace('#', '').strip().lower()
-                if normalized_search in normalized_content:
-                    logger.info(f"Найдена существующая карточка (по content): {card.get('id')}")
-                    return True
-
-            return False
+            if not self.card_index.is_built(deck_id):
+                self.build_index(deck_id)
+
+            if mode == "fuzzy":
+                match = self.card_index.find_similar(deck_id, front_text, self.fuzzy_cutoff)
+                if match:
+                    logger.info(f"Найдена похожая карточка: {match}")
+                return match is not None
+
+            exists = self.card_index.contains(deck_id, front_text)
+            if exists:
+                logger.info(f"Найдена существующая карточка: {front_text}")
+            return exists
         except Exception as e:
             logger.error(f"Ошибка проверки дубликатов: {e}")
             # В случае ошибки разрешаем создание карточки
             return False
 
-    def upload_attachment(self, card_id: str, filename: str, file_data: bytes) -> bool:
-        """Загружает вложение к карточке через API эндпоинт"""
+    def _image_source_url(self, image_url: str) -> str:
+        """URL изображения с уменьшением и пережатием на стороне Unsplash (imgix), если оно включено"""
+        if not self.image_max_width:
+            return image_url
+
+        parts = urlsplit(image_url)
+        if not parts.netloc.endswith('images.unsplash.com'):
+            return image_url
+
+        query = dict(parse_qsl(parts.query))
+        query.update({'w': str(self.image_max_width), 'q': str(self.image_quality), 'fit': 'max'})
+        return urlunsplit(parts._replace(query=urlencode(query)))
+
+    def upload_image_from_url(self, card_id: str, image_url: str) -> Optional[str]:
+        """Загружает изображение по URL в вложения карточки, не держа файл в памяти целиком.
+
+        Скачивание и отправка идут блоками по CHUNK_SIZE. Возвращает имя файла вложения или None.
+        """
         try:
-            url = f"https://app.mochi.cards/api/cards/{card_id}/attachments/{filename}"
+            with self.session.get(self._image_source_url(image_url), stream=True, timeout=10) as img_response:
+                img_response.raise_for_status()
+                chunks = img_response.iter_content(CHUNK_SIZE)
+                head = next(chunks, b'')
 
-            # Создаем multipart/form-data запрос точно как в curl примере
-            # -F file="@/path/to/file" соответствует files={'file': ...}
-            files = {'file': file_data}
+                content_type = detect_image_type(img_response.headers.get('Content-Type'), head)
+                filename = f"{uuid.uuid4().hex[:8]}.{IMAGE_EXTENSIONS[content_type]}"
+                content_length = img_response.headers.get('Content-Length')
+
+                def body() -> Iterator[bytes]:
+                    yield head
+                    yield from chunks
+
+                uploaded = self.upload_attachment_stream(
+                    card_id, filename, body(), content_type,
+                    int(content_length) if content_length and 'Content-Encoding' not in img_response.headers else None
+                )
+            return filename if uploaded else None
+        except Exception as e:
+            logger.error(f"Ошибка скачивания изображения: {e}")
+            return None
 
-            # Используем requests.post с HTTP Basic Auth (api_key как username, пустой password)
-            # Не указываем Content-Type явно - requests сам установит multipart/form-data с boundary
-            response = requests.post(
+    def upload_attachment_stream(self, card_id: str, filename: str, chunks: Iterable[bytes],
+                                 content_type: str, content_length: Optional[int] = None) -> bool:
+        """Загружает вложение потоком: multipart/form-data собирается на лету из блоков"""
+        try:
+            url = f"{self.base_url}cards/{card_id}/attachments/{filename}"
+            boundary = uuid.uuid4().hex
+            preamble = (
+                f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                f'Content-Type: {content_type}\r\n\r\n'
+            ).encode('utf-8')
+            epilogue = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+            def multipart() -> Iterator[bytes]:
+                yield preamble
+                for chunk in chunks:
+                    if chunk:
+                        yield chunk
+                yield epilogue
+
+            data = multipart()
+            # Если размер известен, обходимся без chunked transfer encoding
+            if content_length is not None:
+                data = _SizedStream(data, len(preamble) + content_length + len(epilogue))
+
+            response = self.session.post(
                 url,
-                files=files,
+                data=data,
+                headers={'Content-Type': f'multipart/form-data; boundary={boundary}'},
                 auth=(self.api_key, ''),
                 timeout=30
             )
@@ -108,65 +348,64 @@ class MochiConnect:
             return True
         except Exception as e:
             logger.error(f"Ошибка загрузки вложения: {e}")
-            if hasattr(e, 'response'):
-                logger.error(f"Response status: {e.response.status_code}")
-                logger.error(f"Response body: {e.response.text}")
+            response = getattr(e, 'response', None)
+            if response is not None:
+                logger.error(f"Response status: {response.status_code}")
+                logger.error(f"Response body: {response.text}")
             return False
 
+    def _create_card_with_fields(self, deck_id: str, template: dict, front_field_id: Optional[str],
+                                 back_field_id: Optional[str], front_text: str, back_text: str) -> dict:
+        """Создает карточку по шаблону с заполненными полями front и back"""
+        card_fields = {}
+        if front_field_id:
+            card_fields[front_field_id] = {
+                "id": front_field_id,
+                "value": front_text
+            }
+        if back_field_id:
+            card_fields[back_field_id] = {
+                "id": back_field_id,
+                "value": back_text
+            }
+
+        # Создаем карточку с полями
+        logger.info(f"Создание карточки с полями: {card_fields}")
+        try:
+            card = self.client.cards.create_card(
+                content="",  # content не используется при работе с полями
+                deck_id=deck_id,
+                template_id=template['id'],
+                fields=card_fields
+            )
+            logger.info(f"Карточка успешно создана с ID: {card.get('id')}")
+            logger.debug(f"Полный ответ: {card}")
+            return card
+        except Exception as e:
+            logger.error(f"Ошибка создания карточки с полями: {e}")
+            raise
+
     def add_card(self, deck_id: str, front_text: str, back_text: str, image_url: Optional[str] = None) -> dict:
         """Добавляет карточку в Mochi с front и back полями"""
 
-        # Получаем шаблон Basic
-        template = self.get_basic_template()
-
-        # Инициализируем переменные
-        front_field_id = None
-        back_field_id = None
+        # Получаем шаблон Basic и ID его полей (из кэша)
+        template, front_field_id, back_field_id = self.get_template_fields()
 
         if template:
-            template_id = template['id']
-
-            # Получаем ID полей из шаблона
-            fields_info = template.get('fields', {})
-            logger.info(f"Поля шаблона: {fields_info}")
-
-            # Ищем ID полей "front" и "back" (или похожие)
-            for field_id, field_data in fields_info.items():
-                field_name = field_data.get('name', '').lower()
-                if 'front' in field_name or field_name == 'name':
-                    front_field_id = field_id
-                elif 'back' in field_name:
-                    back_field_id = field_id
-
-            logger.info(f"Front field ID: {front_field_id}, Back field ID: {back_field_id}")
-
-            # Формируем поля карточки
-            card_fields = {}
-            if front_field_id:
-                card_fields[front_field_id] = {
-                    "id": front_field_id,
-                    "value": front_text
-                }
-            if back_field_id:
-                card_fields[back_field_id] = {
-                    "id": back_field_id,
-                    "value": back_text
-                }
-
-            # Создаем карточку с полями
-            logger.info(f"Создание карточки с полями: {card_fields}")
             try:
-                card = self.client.cards.create_card(
-                    content="",  # content не используется при работе с полями
-                    deck_id=deck_id,
-                    template_id=template_id,
-                    fields=card_fields
-                )
-                logger.info(f"Карточка успешно создана с ID: {card.get('id')}")
-                logger.debug(f"Полный ответ: {card}")
-            except Exception as e:
-                logger.error(f"Ошибка создания карточки с полями: {e}")
-                raise
+                card = self._create_card_with_fields(deck_id, template, front_field_id, back_field_id,
+                                                     front_text, back_text)
+            except requests.HTTPError as e:
+                if not _is_not_found(e):
+                    raise
+                # Шаблон мог быть удален - сбрасываем кэш и пробуем еще раз
+                logger.warning("Mochi вернул 404, сбрасываем кэш шаблона и колод")
+                self.invalidate_cache()
+                template, front_field_id, back_field_id = self.get_template_fields()
+                if not template:
+                    raise
+                card = self._create_card_with_fields(deck_id, template, front_field_id, back_field_id,
+                                                     front_text, back_text)
         else:
             # Если шаблон не найден, создаем обычную карточку
             content = f"{front_text}\n---\n{back_text}"
@@ -174,19 +413,16 @@ class MochiConnect:
             card = self.client.cards.create_card(content=content, deck_id=deck_id)
             logger.info(f"Карточка создана: {card.get('id')}")
 
+        # Обновляем индекс дубликатов сразу после создания
+        self.card_index.add(deck_id, front_text)
+
         # Если есть изображение, загружаем его как вложение
         if image_url and card:
             try:
-                # Скачиваем изображение
-                img_response = requests.get(image_url, timeout=10)
-                img_response.raise_for_status()
-
-                # Генерируем уникальное имя файла
+                # Передаем изображение из источника в Mochi потоком
                 card_id = card['id']
-                filename = f"{uuid.uuid4().hex[:8]}.jpg"
-
-                # Загружаем вложение
-                if self.upload_attachment(card_id, filename, img_response.content):
+                filename = self.upload_image_from_url(card_id, image_url)
+                if filename:
                     # Обновляем front поле, добавив ссылку на изображение
                     if template and front_field_id:
                         # Добавляем изображение в начало front текста
@@ -214,8 +450,13 @@ class MochiConnect:
 
     def check_connection(self) -> bool:
         """Проверяет подключение к Mochi API"""
+        with self._lock:
+            if self._decks_loaded_at and self._fresh(self._decks_loaded_at):
+                return True
+
         try:
-            self.client.decks.list_decks()
+            # Заодно обновляем кэш колод для следующего get_or_create_deck
+            self._load_decks()
             return True
         except Exception as e:
             logger.error(f"Ошибка подключения к Mochi: {e}")
@@ -224,3 +465,4 @@ class MochiConnect:
     def close(self):
         """Закрывает соединение"""
         self.client.close()
+        self.session.close()
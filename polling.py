@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from telebot import apihelper
+from update_queue import UpdateQueue
+from update_dedup import UpdateDeduplicator
+from shared_state import run_io
+
+logger = logging.getLogger(__name__)
+
+
+class UpdatePoller:
+    """Получение обновлений через getUpdates вместо webhook.
+
+    Обновления запрашиваются пачками до limit штук с long polling до timeout
+    секунд и ставятся в ту же UpdateQueue, что и в режиме webhook. Offset
+    сдвигается только за подряд идущие обработанные обновления, поэтому
+    следующий getUpdates возвращает и еще обрабатываемые обновления - они
+    пропускаются, а новые сразу уходят в обработку, не дожидаясь медленных
+    обновлений предыдущей пачки.
+
+    Обновление, обработка которого завершилась ошибкой, запрашивается снова
+    (всего до max_attempts попыток). Обновления, уже обработанные до
+    перезапуска, отбрасывает окно дедупликации.
+    """
+
+    def __init__(self, token: str, queue: UpdateQueue, dedup: UpdateDeduplicator, limit: int = 100,
+                 timeout: int = 50, max_attempts: int = 3, poll_interval: float = 0.1, error_delay: float = 5,
+                 allowed_updates: Optional[List[str]] = None):
+        self.token = token
+        self.queue = queue
+        self.dedup = dedup
+        self.limit = max(1, min(100, limit))
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.error_delay = error_delay
+        self.allowed_updates = allowed_updates
+        self.offset: Optional[int] = None
+        self._committed: Optional[int] = None
+        # update_id -> future с результатом обработки (True - успех, False - ошибка);
+        # None - обновление ждет повторной доставки и задерживает offset
+        self._inflight: Dict[int, Optional[asyncio.Future]] = {}
+        self._attempts: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.batches_count = 0
+        self.updates_count = 0
+        self.retried_count = 0
+        self.errors_count = 0
+
+    def start(self) -> None:
+        """Запускает опрос в текущем event loop"""
+        self._task = asyncio.create_task(self._run(), name="update-poller")
+        logger.info(f"Режим polling: пачки до {self.limit} обновлений, long polling {self.timeout} с")
+
+    async def stop(self) -> None:
+        """Останавливает опрос и подтверждает обработанные обновления"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        await self._advance()
+        if self.offset is not None and self.offset != self._committed:
+            try:
+                # Запрос с новым offset подтверждает все обновления до него
+                await asyncio.to_thread(
+                    apihelper.get_updates, self.token, offset=self.offset, limit=1, long_polling_timeout=1
+                )
+                self._committed = self.offset
+            except Exception as e:
+                logger.error(f"Не удалось подтвердить обновления до {self.offset}: {e}")
+
+    async def _run(self) -> None:
+        # getUpdates не работает, пока установлен webhook
+        await asyncio.to_thread(apihelper.delete_webhook, self.token)
+
+        while True:
+            try:
+                updates = await asyncio.to_thread(
+                    apihelper.get_updates, self.token, offset=self.offset, limit=self.limit,
+                    allowed_updates=self.allowed_updates, long_polling_timeout=self.timeout
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors_count += 1
+                logger.error(f"Ошибка getUpdates: {e}")
+                await asyncio.sleep(self.error_delay)
+                continue
+
+            self._committed = self.offset
+            submitted, shed = await self._submit(updates)
+            await self._advance()
+            if shed:
+                # Очередь переполнена: даем воркерам время
+                await asyncio.sleep(self.error_delay)
+            elif not submitted:
+                # Новых обновлений нет, Telegram вернул только обрабатываемые: ждем завершения любого из них
+                pending = [future for future in self._inflight.values() if future is not None and not future.done()]
+                if pending:
+                    await asyncio.wait(pending, timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                await self._advance()
+
+    async def _submit(self, updates: List[dict]):
+        """Ставит в очередь новые обновления пачки. Возвращает (сколько поставлено, была ли очередь полна)"""
+        loop = asyncio.get_running_loop()
+        submitted = 0
+        shed = False
+        for update in updates:
+            update_id = update['update_id']
+            if shed:
+                break
+            if self._inflight.get(update_id) is not None:
+                continue
+
+            future = loop.create_future()
+            self._inflight[update_id] = future
+            # Окно дедупликации может быть в SQLite или Redis: обращение вне event loop
+            if not await run_io(self.dedup.first_seen, update_id):
+                # Обработано до перезапуска
+                future.set_result(True)
+            elif self.queue.submit(update, future):
+                submitted += 1
+            else:
+                # Очередь переполнена: обновление будет получено снова
+                await run_io(self.dedup.forget, update_id)
+                self._inflight[update_id] = None
+                shed = True
+
+        if submitted:
+            self.batches_count += 1
+            self.updates_count += submitted
+        return submitted, shed
+
+    async def _advance(self) -> None:
+        """Сдвигает offset за подряд идущие обработанные обновления"""
+        for update_id in sorted(self._inflight):
+            future = self._inflight[update_id]
+            if future is None or not future.done():
+                return
+
+            if not future.result():
+                attempts = self._attempts.get(update_id, 0) + 1
+                if attempts < self.max_attempts:
+                    self._attempts[update_id] = attempts
+                    self.retried_count += 1
+                    await run_io(self.dedup.forget, update_id)
+                    self._inflight[update_id] = None
+                    logger.warning(f"Обновление {update_id} будет обработано повторно (попытка {attempts + 1})")
+                    return
+                logger.error(f"Обновление {update_id} пропущено после {attempts} попыток")
+
+            del self._inflight[update_id]
+            self._attempts.pop(update_id, None)
+            self.offset = update_id + 1
+
+    def stats(self) -> dict:
+        return {
+            "offset": self.offset,
+            "in_flight": len(self._inflight),
+            "batches": self.batches_count,
+            "updates": self.updates_count,
+            "avg_batch": self.updates_count / self.batches_count if self.batches_count else 0.0,
+            "retried": self.retried_count,
+            "errors": self.errors_count
+        }
@@ -0,0 +1,297 @@
+import re
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Deque, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Пользователь, от имени которого выполняется текущая обработка (для справедливой очереди к LLM)
+current_user: ContextVar[Optional[int]] = ContextVar("current_user", default=None)
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, now: Optional[float] = None) -> float:
+        """Забирает токен. Возвращает 0 при успехе, иначе через сколько секунд токен появится"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+
+class UserRateLimiter:
+    """Ограничение частоты запросов каждого пользователя.
+
+    Хранит bucket только для max_users последних пользователей (LRU). С
+    backend (SQLiteCache, RedisCache) состояние bucket общее для всех
+    процессов бота и обновляется атомарно через backend.transform.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int, max_users: int = 10000, backend=None):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_users = max_users
+        self.backend = backend
+        self._buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        # Пользователи, которым уже отправлено предупреждение о лимите
+        self._notified = set()
+        self._lock = threading.Lock()
+        self.rejected_count = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, user_id: int) -> Tuple[float, bool]:
+        """Возвращает (через сколько секунд можно повторить, нужно ли предупредить пользователя).
+
+        0 - запрос разрешен. Предупреждение отправляется один раз до следующего разрешенного запроса.
+        """
+        if not self.enabled:
+            return 0.0, False
+        if self.backend is not None:
+            return self._check_shared(user_id)
+
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self._buckets[user_id] = bucket
+                while len(self._buckets) > self.max_users:
+                    evicted, _ = self._buckets.popitem(last=False)
+                    self._notified.discard(evicted)
+            self._buckets.move_to_end(user_id)
+
+            retry_after = bucket.try_acquire()
+            if not retry_after:
+                self._notified.discard(user_id)
+                return 0.0, False
+
+            self.rejected_count += 1
+            notify = user_id not in self._notified
+            self._notified.add(user_id)
+            return retry_after, notify
+
+    def _check_shared(self, user_id: int) -> Tuple[float, bool]:
+        def take(state):
+            # Состояние: [токены, время обновления (time.time), отправлено ли предупреждение]
+            now = time.time()
+            tokens, updated_at, notified = state if state is not None else (self.burst, now, False)
+            tokens = min(self.burst, tokens + max(0.0, now - updated_at) * self.rate)
+            if tokens >= 1:
+                return [tokens - 1, now, False], (0.0, False)
+            return [tokens, now, True], ((1 - tokens) / self.rate, not notified)
+
+        # Запись живет, пока bucket не наполнится заново
+        retry_after, notify = self.backend.transform(str(user_id), take, ttl=self.burst / self.rate)
+        if retry_after:
+            self.rejected_count += 1
+        return retry_after, notify
+
+    def stats(self) -> dict:
+        # Число пользователей в общем хранилище не считаем: для Redis это обход всех ключей (SCAN)
+        if self.backend is not None:
+            return {"rejected": self.rejected_count}
+        return {"users": len(self._buckets), "rejected": self.rejected_count}
+
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset(value: str) -> float:
+    """Разбирает x-ratelimit-reset-* OpenAI ("1s", "6m0s", "20ms") в секунды"""
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in _DURATION_RE.findall(value or ""))
+
+
+class _Waiter:
+    """Ожидающий слот запрос: поток (threading.Event) или корутина (asyncio.Future)"""
+
+    def __init__(self, future: Optional[asyncio.Future] = None):
+        self.future = future
+        self.loop = future.get_loop() if future is not None else None
+        self.event = threading.Event() if future is None else None
+        self.granted = False
+
+    def grant(self, release) -> None:
+        self.granted = True
+        if self.event is not None:
+            self.event.set()
+            return
+
+        def resolve():
+            # Корутину отменили, пока слот был в пути: возвращаем его
+            if self.future.done():
+                release()
+            else:
+                self.future.set_result(None)
+
+        self.loop.call_soon_threadsafe(resolve)
+
+
+class FairLLMScheduler:
+    """Справедливая очередь запросов к LLM.
+
+    Не больше max_concurrent запросов одновременно и не больше rate запросов
+    в секунду на всех (0 - без ограничения). Освободившийся слот получает
+    следующий по кругу пользователь, поэтому один пользователь с длинным
+    списком слов не задерживает остальных. По заголовкам x-ratelimit-*
+    ответов OpenAI очередь приостанавливается до сброса лимита, когда
+    остаток запросов или токенов подходит к концу.
+    """
+
+    def __init__(self, max_concurrent: int = 8, rate: float = 0, burst: int = 10,
+                 min_remaining_requests: int = 0, min_remaining_tokens: int = 0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.min_remaining_requests = min_remaining_requests
+        self.min_remaining_tokens = min_remaining_tokens
+        self._lock = threading.Lock()
+        self._active = 0
+        # Пользователь -> очередь его запросов; порядок ключей - порядок обхода по кругу
+        self._queues: "OrderedDict[Optional[int], Deque[_Waiter]]" = OrderedDict()
+        self._paused_until = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self.waited_count = 0
+        self.paused_count = 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def _enqueue(self, user_id: Optional[int], waiter: _Waiter) -> None:
+        with self._lock:
+            self._queues.setdefault(user_id, deque()).append(waiter)
+            self._dispatch()
+
+    def _remove(self, user_id: Optional[int], waiter: _Waiter) -> bool:
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is None or waiter not in queue:
+                return False
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[user_id]
+            return True
+
+    def _dispatch(self) -> None:
+        """Раздает свободные слоты по кругу. Вызывается под self._lock"""
+        while self._active < self.max_concurrent and self._queues:
+            now = time.monotonic()
+            delay = self._paused_until - now
+            if delay <= 0 and self.bucket is not None:
+                delay = self.bucket.try_acquire(now)
+            if delay > 0:
+                self._schedule(delay)
+                return
+
+            user_id, queue = self._queues.popitem(last=False)
+            waiter = queue.popleft()
+            if queue:
+                # Следующий запрос этого пользователя встает в конец круга
+                self._queues[user_id] = queue
+            self._active += 1
+            waiter.grant(self.release)
+
+    def _schedule(self, delay: float) -> None:
+        if self._timer is not None and self._timer.is_alive():
+            return
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def release(self) -> None:
+        with self._lock:
+            self._active -= 1
+            self._dispatch()
+
+    def pause(self, seconds: float) -> None:
+        """Не выдавать новые слоты seconds секунд"""
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._paused_until:
+                self._paused_until = until
+                self.paused_count += 1
+                logger.warning(f"Запросы к LLM приостановлены на {seconds:.1f} с")
+
+    def update_from_headers(self, headers) -> None:
+        """Приостанавливает очередь, если OpenAI сообщает об исчерпании лимита"""
+        for kind, minimum in (("requests", self.min_remaining_requests), ("tokens", self.min_remaining_tokens)):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is None or int(remaining) > minimum:
+                continue
+            reset = parse_reset(headers.get(f"x-ratelimit-reset-{kind}", ""))
+            if reset > 0:
+                self.pause(reset)
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Слот для синхронного запроса к LLM (пользователь берется из current_user)"""
+        user_id = current_user.get()
+        waiter = _Waiter()
+        self._enqueue(user_id, waiter)
+        if not waiter.granted:
+            self.waited_count += 1
+        waiter.event.wait()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def slot_async(self) -> AsyncIterator[None]:
+        """Слот для асинхронного запроса к LLM"""
+        user_id = current_user.get()
+        waiter = _Waiter(asyncio.get_running_loop().create_future())
+        self._enqueue(user_id, waiter)
+        if not waiter.granted:
+            self.waited_count += 1
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            # Слот уже выдан: возвращаем его (если future отменен, это сделает _Waiter.grant)
+            if not self._remove(user_id, waiter) and waiter.future.done() and not waiter.future.cancelled():
+                self.release()
+            raise
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": self._active,
+                "waiting": self.waiting,
+                "users_waiting": len(self._queues),
+                "waited": self.waited_count,
+                "paused": self.paused_count,
+                "paused_for": max(0.0, self._paused_until - time.monotonic())
+            }
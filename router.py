@@ -0,0 +1,193 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import subprocess
+import httpx
+import uvicorn
+from typing import List, Optional
+from update_queue import get_chat_id
+from dotenv import load_dotenv
+from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, Response
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateRouter:
+    """Распределение обновлений Telegram между процессами бота.
+
+    Обновления одного чата всегда уходят в один и тот же процесс (chat_id по
+    модулю числа процессов), поэтому внутри процесса сохраняется порядок
+    обработки чата, как у шардов UpdateQueue. Общее состояние процессов
+    (карточки, кэши, окно дедупликации, лимиты пользователей) хранится в
+    бэкенде SHARED_STATE_BACKEND, поэтому изменение числа процессов не
+    теряет данные.
+    """
+
+    def __init__(self, worker_urls: List[str], timeout: float = 10):
+        if not worker_urls:
+            raise ValueError("Не заданы адреса процессов бота (WORKER_URLS)")
+        self.worker_urls = [url.rstrip("/") for url in worker_urls]
+        self.client = httpx.AsyncClient(timeout=timeout)
+        self.forwarded_count = 0
+        self.errors_count = 0
+
+    def worker_url(self, update: dict) -> str:
+        """Процесс, который обрабатывает обновление"""
+        key = get_chat_id(update)
+        if key is None:
+            key = update.get("update_id", 0)
+        return self.worker_urls[key % len(self.worker_urls)]
+
+    async def forward(self, update: dict) -> int:
+        """Передает обновление процессу и возвращает его код ответа"""
+        url = self.worker_url(update)
+        try:
+            response = await self.client.post(f"{url}/webhook", json=update)
+        except httpx.HTTPError as e:
+            self.errors_count += 1
+            logger.error(f"Процесс {url} недоступен: {e}")
+            # Telegram повторит доставку позже
+            return 503
+        self.forwarded_count += 1
+        return response.status_code
+
+    async def worker_stats(self) -> dict:
+        """Статистика всех процессов (/stats каждого)"""
+        async def fetch(url: str):
+            try:
+                response = await self.client.get(f"{url}/stats")
+                return response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                return {"error": str(e)}
+
+        results = await asyncio.gather(*(fetch(url) for url in self.worker_urls))
+        return dict(zip(self.worker_urls, results))
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self.worker_urls),
+            "forwarded": self.forwarded_count,
+            "errors": self.errors_count
+        }
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+def create_update_router() -> UpdateRouter:
+    """Создает маршрутизатор по WORKER_URLS (адреса через запятую)"""
+    urls = [url.strip() for url in os.getenv("WORKER_URLS", "").split(",") if url.strip()]
+    router = UpdateRouter(urls, timeout=float(os.getenv("WORKER_TIMEOUT", "10")))
+    logger.info(f"Процессы бота: {router.worker_urls}")
+    return router
+
+
+app = FastAPI(title="Telegram Bot Router")
+update_router: Optional[UpdateRouter] = None
+
+
+@app.on_event("startup")
+async def startup():
+    global update_router
+    update_router = create_update_router()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if update_router is not None:
+        await update_router.aclose()
+
+
+@app.get("/")
+async def root():
+    return {"status": "Router is running", "workers": update_router.worker_urls}
+
+
+@app.post("/webhook")
+async def webhook(request: Request):
+    """Webhook Telegram: передаем обновление процессу его чата"""
+    try:
+        update = await request.json()
+    except ValueError:
+        return Response(status_code=400)
+    return Response(status_code=await update_router.forward(update))
+
+
+@app.get("/set-webhook")
+async def set_webhook():
+    """Установка webhook выполняется любым процессом: WEBHOOK_URL указывает на маршрутизатор"""
+    try:
+        response = await update_router.client.get(f"{update_router.worker_urls[0]}/set-webhook")
+        return JSONResponse(status_code=response.status_code, content=response.json())
+    except (httpx.HTTPError, ValueError) as e:
+        return JSONResponse(status_code=502, content={"error": str(e)})
+
+
+@app.get("/stats")
+async def stats():
+    """Счетчики маршрутизатора и всех процессов"""
+    return {"router": update_router.stats(), "workers": await update_router.worker_stats()}
+
+
+def spawn_workers(count: int, host: str, base_port: int) -> List[subprocess.Popen]:
+    """Запускает count процессов бота (uvicorn main:app) на портах base_port, base_port + 1, ..."""
+    env = dict(os.environ)
+    # Процессы делят состояние через общий файл SQLite, если не выбран другой бэкенд
+    env.setdefault("SHARED_STATE_BACKEND", "sqlite")
+    env["BOT_MODE"] = "webhook"
+
+    processes = []
+    for index in range(count):
+        port = base_port + index
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", host, "--port", str(port)],
+            env=env
+        ))
+        logger.info(f"Процесс бота {index + 1}/{count}: порт {port}")
+    return processes
+
+
+def wait_workers(urls: List[str], timeout: float = 60) -> None:
+    """Ждет готовности всех процессов (/ready)"""
+    deadline = time.monotonic() + timeout
+    for url in urls:
+        while True:
+            try:
+                if httpx.get(f"{url}/ready", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Процесс {url} не запустился за {timeout} с")
+            time.sleep(0.2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Маршрутизатор webhook между процессами бота")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000, help="порт маршрутизатора (webhook Telegram)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="запустить столько локальных процессов бота (0 - использовать WORKER_URLS)")
+    parser.add_argument("--worker-port", type=int, default=8100, help="порт первого локального процесса")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    processes = []
+    try:
+        if args.workers:
+            processes = spawn_workers(args.workers, "127.0.0.1", args.worker_port)
+            urls = [f"http://127.0.0.1:{args.worker_port + index}" for index in range(args.workers)]
+            os.environ["WORKER_URLS"] = ",".join(urls)
+            wait_workers(urls)
+        uvicorn.run(app, host=args.host, port=args.port)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
@@ -0,0 +1,64 @@
+import os
+import asyncio
+import logging
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from cache import MemoryCache, RedisCache, SQLiteCache
+
+logger = logging.getLogger(__name__)
+
+# Обращения к хранилищам из event loop идут через отдельный пул: запрос к SQLite может ждать
+# блокировку файла (busy timeout), пока ее держит другой процесс, запрос к Redis - ответа сети.
+# Пул не общий с asyncio.to_thread, поэтому занятые обработчики не задерживают ответы webhook
+_io_pool = ThreadPoolExecutor(max_workers=int(os.getenv("STATE_IO_THREADS", "8")), thread_name_prefix="state-io")
+
+# Имя бэкенда -> фабрика (namespace, max_entries, ttl) -> хранилище с интерфейсом SQLiteCache
+_BACKENDS: Dict[str, Callable[[str, int, Optional[float]], object]] = {}
+
+
+def register_backend(name: str, factory: Callable[[str, int, Optional[float]], object]) -> None:
+    """Подключает свой бэкенд общего состояния (например, другой сетевой KV)"""
+    _BACKENDS[name] = factory
+
+
+def _sqlite(namespace: str, max_entries: int, ttl: Optional[float]) -> SQLiteCache:
+    return SQLiteCache(os.getenv("CACHE_DB_PATH", "data/cache.sqlite3"), namespace=namespace, max_entries=max_entries, ttl=ttl)
+
+
+def _redis(namespace: str, max_entries: int, ttl: Optional[float]) -> RedisCache:
+    return RedisCache(
+        os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+        namespace=namespace,
+        ttl=ttl,
+        prefix=os.getenv("REDIS_PREFIX", "bot")
+    )
+
+
+register_backend("memory", lambda namespace, max_entries, ttl: MemoryCache(max_entries=max_entries, ttl=ttl))
+register_backend("sqlite", _sqlite)
+register_backend("redis", _redis)
+
+
+async def run_io(func: Callable[..., Any], *args) -> Any:
+    """Выполняет синхронное обращение к хранилищу в пуле потоков, не блокируя event loop"""
+    return await asyncio.get_running_loop().run_in_executor(_io_pool, partial(func, *args))
+
+
+def backend_name(setting: Optional[str] = None, default: str = "memory") -> str:
+    """Бэкенд из отдельной настройки хранилища, иначе из SHARED_STATE_BACKEND"""
+    return (os.getenv(setting) if setting else None) or os.getenv("SHARED_STATE_BACKEND") or default
+
+
+def storage_backend_name() -> str:
+    """Постоянный уровень кэшей: redis, если состояние общее по сети, иначе файл SQLite"""
+    return "redis" if backend_name() == "redis" else "sqlite"
+
+
+def create_backend(namespace: str, name: str, max_entries: int = 100000, ttl: Optional[float] = None):
+    """Создает хранилище namespace в бэкенде name"""
+    factory = _BACKENDS.get(name)
+    if factory is None:
+        raise ValueError(f"Неизвестный бэкенд общего состояния: {name}")
+    logger.info(f"Хранилище {namespace}: {name}")
+    return factory(namespace, max_entries, ttl)
@@ -0,0 +1,139 @@
+import logging
+from typing import Callable, List, Optional, Tuple
+from telebot import TeleBot
+from telebot.types import InputMediaPhoto, Message
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+
+def _is_stale_file_id(error: ApiTelegramException) -> bool:
+    """Ошибка из-за неверного или устаревшего file_id (остальные ошибки повтор по URL не исправит)"""
+    description = (error.description or "").lower()
+    return "file identifier" in description or "file_id" in description
+
+
+def _photo_file_id(message: Message) -> Optional[str]:
+    return message.photo[-1].file_id if message.photo else None
+
+
+def _animation_file_id(message: Message) -> Optional[str]:
+    if message.animation:
+        return message.animation.file_id
+    if message.document:
+        return message.document.file_id
+    return None
+
+
+class TelegramMediaCache:
+    """Отправка медиа с повторным использованием file_id.
+
+    При первой отправке по URL Telegram сам скачивает файл, а полученный file_id
+    сохраняется. Последующие отправки того же URL ссылаются на файл на сервере
+    Telegram и не зависят от скорости исходного хоста.
+    """
+
+    def __init__(self, bot: TeleBot, cache):
+        self.bot = bot
+        self.cache = cache
+        self.reused_count = 0
+        self.uploaded_count = 0
+        self.stale_count = 0
+
+    def _send(self, send: Callable[..., Message], extract: Callable[[Message], Optional[str]],
+              chat_id: int, url: str, **kwargs) -> Message:
+        file_id = self.cache.get(url)
+        if file_id:
+            try:
+                message = send(chat_id, file_id, **kwargs)
+                self.reused_count += 1
+                return message
+            except ApiTelegramException as e:
+                if not _is_stale_file_id(e):
+                    raise
+                # file_id устарел - отправляем заново по URL
+                self.stale_count += 1
+                logger.warning(f"Не удалось отправить по file_id, отправляем по URL: {e}")
+                self.cache.delete(url)
+
+        message = send(chat_id, url, **kwargs)
+        self.uploaded_count += 1
+        file_id = extract(message)
+        if file_id:
+            self.cache.set(url, file_id)
+        return message
+
+    def send_photo(self, chat_id: int, url: str, **kwargs) -> Message:
+        return self._send(self.bot.send_photo, _photo_file_id, chat_id, url, **kwargs)
+
+    def send_animation(self, chat_id: int, url: str, **kwargs) -> Message:
+        return self._send(self.bot.send_animation, _animation_file_id, chat_id, url, **kwargs)
+
+    def send_photo_group(self, chat_id: int, photos: List[Tuple[str, str]], parse_mode: Optional[str] = None,
+                         **kwargs) -> List[Message]:
+        """Отправляет альбом (URL, подпись), используя известные file_id"""
+        file_ids = [self.cache.get(url) for url, _ in photos]
+
+        def media(use_file_ids: bool) -> List[InputMediaPhoto]:
+            return [
+                InputMediaPhoto((file_id if use_file_ids else None) or url, caption=caption, parse_mode=parse_mode)
+                for (url, caption), file_id in zip(photos, file_ids)
+            ]
+
+        reused = sum(1 for file_id in file_ids if file_id)
+        try:
+            messages = self.bot.send_media_group(chat_id, media(True), **kwargs)
+        except ApiTelegramException as e:
+            if not reused or not _is_stale_file_id(e):
+                raise
+            # Один из file_id устарел - отправляем весь альбом по URL
+            self.stale_count += 1
+            logger.warning(f"Не удалось отправить альбом по file_id, отправляем по URL: {e}")
+            for url, _ in photos:
+                self.cache.delete(url)
+            file_ids = [None] * len(photos)
+            reused = 0
+            messages = self.bot.send_media_group(chat_id, media(False), **kwargs)
+
+        self.reused_count += reused
+        self.uploaded_count += len(photos) - reused
+        for (url, _), file_id, message in zip(photos, file_ids, messages):
+            new_file_id = _photo_file_id(message)
+            if not file_id and new_file_id:
+                self.cache.set(url, new_file_id)
+        return messages
+
+    def _bootstrap(self, send: Callable[..., Message], url: str, chat_id: int) -> Optional[str]:
+        """Отправляет файл в служебный чат и сразу удаляет сообщение, чтобы получить file_id заранее"""
+        file_id = self.cache.get(url)
+        if file_id:
+            return file_id
+
+        try:
+            message = send(chat_id, url, disable_notification=True)
+            try:
+                self.bot.delete_message(chat_id, message.message_id)
+            except Exception as e:
+                logger.error(f"Ошибка удаления служебного сообщения: {e}")
+            file_id = self.cache.get(url)
+            logger.info(f"Получен file_id для {url}: {file_id}")
+            return file_id
+        except Exception as e:
+            logger.error(f"Ошибка загрузки файла {url}: {e}")
+            return None
+
+    def bootstrap_animation(self, url: str, chat_id: int) -> Optional[str]:
+        """Загружает анимацию в служебный чат, чтобы получить file_id заранее"""
+        return self._bootstrap(self.send_animation, url, chat_id)
+
+    def bootstrap_photo(self, url: str, chat_id: int) -> Optional[str]:
+        """Загружает изображение в служебный чат, чтобы получить file_id заранее"""
+        return self._bootstrap(self.send_photo, url, chat_id)
+
+    def stats(self) -> dict:
+        return {
+            "reused": self.reused_count,
+            "uploaded": self.uploaded_count,
+            "stale": self.stale_count,
+            "cache": self.cache.stats()
+        }
@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+# main.py читает настройки при импорте: фиктивные токены и временные файлы вместо data/
+_DATA_DIR = tempfile.mkdtemp(prefix="bot-tests-")
+os.environ.update({
+    "TOKEN": "123456:test",
+    "OPENAI_API_KEY": "test",
+    "UNSPLASH_ACCESS_KEY": "test",
+    "CACHE_DB_PATH": os.path.join(_DATA_DIR, "cache.sqlite3"),
+    "EXPORT_QUEUE_PATH": os.path.join(_DATA_DIR, "export_queue.sqlite3"),
+    "LOADING_GIF_CHAT_ID": "",
+    "BOT_MODE": "webhook"
+})
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
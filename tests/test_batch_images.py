@@ -0,0 +1,22 @@
+import main
+from card import TranslationCard
+from rate_limit import current_user
+
+
+def test_batch_image_urls_keeps_current_user(monkeypatch):
+    seen = []
+
+    def keyword(text):
+        seen.append(current_user.get())
+        return text
+
+    monkeypatch.setattr(main, "get_image_search_keyword", keyword)
+    monkeypatch.setattr(main.image_search, "get_image_url", lambda query: f"https://img/{query}")
+
+    current_user.set(42)
+    cards = [TranslationCard("cat", "кот"), TranslationCard("dog", "собака", image_keyword="puppy")]
+    result = main.batch_image_urls(cards)
+
+    assert seen == [42]
+    assert [card.image_url for card in result] == ["https://img/cat", "https://img/puppy"]
+    assert result[0].image_keyword == "cat"
@@ -0,0 +1,32 @@
+import time
+import asyncio
+from shared_state import run_io
+
+
+def test_run_io_does_not_block_event_loop():
+    async def scenario():
+        ticks = []
+
+        async def ticker():
+            for _ in range(5):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        # Обращение к хранилищу, ждущее блокировку файла
+        slow = run_io(time.sleep, 0.2)
+        started = time.monotonic()
+        await asyncio.gather(slow, ticker())
+        return started, ticks
+
+    started, ticks = asyncio.run(scenario())
+    assert ticks[-1] - started < 0.15
+
+
+def test_run_io_returns_result_and_raises():
+    assert asyncio.run(run_io(sum, [1, 2, 3])) == 6
+    try:
+        asyncio.run(run_io(int, "x"))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ошибка не передана")
@@ -0,0 +1,50 @@
+from cache import MemoryCache, RedisCache
+from rate_limit import UserRateLimiter
+
+
+class NoScanClient:
+    """Клиент Redis, который не дает обходить ключи: stats должен обходиться без SCAN и STRLEN"""
+
+    def scan_iter(self, *args, **kwargs):
+        raise AssertionError("stats обходит ключи Redis")
+
+    def strlen(self, key):
+        raise AssertionError("stats читает размер значений Redis")
+
+
+def redis_cache(namespace: str) -> RedisCache:
+    # Пакет redis для теста не нужен: подменяется только клиент
+    cache = RedisCache.__new__(RedisCache)
+    cache.namespace = namespace
+    cache.ttl = None
+    cache._prefix = f"test:{namespace}:"
+    cache._client = NoScanClient()
+    cache.hits = cache.misses = cache.evictions = 0
+    return cache
+
+
+def test_redis_cache_stats_use_local_counters():
+    cache = redis_cache("translations")
+    cache.hits = 3
+    assert cache.stats() == {"hits": 3, "misses": 0, "evictions": 0}
+    assert not hasattr(cache, "approx_bytes")
+
+
+def test_user_rate_limiter_stats_do_not_scan_shared_backend():
+    limiter = UserRateLimiter(rate_per_minute=60, burst=1, backend=redis_cache("rate_limit"))
+    limiter.rejected_count = 2
+    assert limiter.stats() == {"rejected": 2}
+
+
+def test_user_rate_limiter_stats_count_local_users():
+    limiter = UserRateLimiter(rate_per_minute=60, burst=1)
+    limiter.check(1)
+    limiter.check(2)
+    assert limiter.stats() == {"users": 2, "rejected": 0}
+
+
+def test_memory_backend_still_works():
+    limiter = UserRateLimiter(rate_per_minute=60, burst=1, backend=MemoryCache())
+    assert limiter.check(1) == (0.0, False)
+    assert limiter.check(1)[0] > 0
+    assert limiter.stats() == {"rejected": 1}
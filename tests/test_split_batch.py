@@ -0,0 +1,30 @@
+import pytest
+from main import split_batch
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("apple\npear\nplum", ["apple", "pear", "plum"]),
+    ("1. apple\n2. pear", ["apple", "pear"]),
+    ("- кот\n- собака", ["кот", "собака"]),
+    ("take off\nlook after", ["take off", "look after"]),
+    ("apple, pear, plum", ["apple", "pear", "plum"]),
+    ("apple\nApple\npear", ["apple", "pear"]),
+])
+def test_word_lists(text, expected):
+    assert split_batch(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "Hello,\nworld",
+    "Dear John,\nI miss you.\nLove, Ann",
+    "Как дела?\nВсе хорошо",
+    "I was walking down the street\nwhen it started to rain",
+    "Thank you, sir",
+    "yes, please",
+    "Ну, ладно",
+    "How are you, my friend?",
+    "apple",
+    "apple\n\n",
+])
+def test_phrases_are_not_split(text):
+    assert split_batch(text) is None
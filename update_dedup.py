@@ -0,0 +1,53 @@
+import os
+import logging
+from shared_state import backend_name, create_backend
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """Окно недавно принятых update_id.
+
+    Telegram повторяет доставку обновления, если webhook ответил ошибкой или
+    не уложился в таймаут. Повтор подтверждается без повторной обработки.
+    Бэкенд - MemoryCache (один процесс), SQLiteCache (общий файл для
+    нескольких процессов) или RedisCache (несколько машин).
+    """
+
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.duplicates_count = 0
+
+    @staticmethod
+    def _key(update_id: int) -> str:
+        return str(update_id)
+
+    def first_seen(self, update_id: int) -> bool:
+        """Отмечает update_id принятым. False, если он уже встречался в окне"""
+        if self.backend.add(self._key(update_id), 1, ttl=self.ttl):
+            return True
+        self.duplicates_count += 1
+        return False
+
+    def forget(self, update_id: int) -> None:
+        """Снимает отметку, например если обновление не удалось поставить в очередь"""
+        self.backend.delete(self._key(update_id))
+
+    def stats(self) -> dict:
+        stats = self.backend.stats()
+        stats["duplicates"] = self.duplicates_count
+        return stats
+
+
+def create_update_dedup() -> UpdateDeduplicator:
+    """Создает окно дедупликации по настройкам окружения (UPDATE_DEDUP_BACKEND или SHARED_STATE_BACKEND)"""
+    ttl = float(os.getenv("UPDATE_DEDUP_TTL", str(24 * 3600)))
+    backend = create_backend(
+        "update_ids",
+        backend_name("UPDATE_DEDUP_BACKEND"),
+        max_entries=int(os.getenv("UPDATE_DEDUP_MAX_ENTRIES", "100000")),
+        ttl=ttl
+    )
+    logger.info(f"Дедупликация обновлений: окно {ttl} с")
+    return UpdateDeduplicator(backend, ttl)
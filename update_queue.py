@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def get_chat_id(update: dict) -> Optional[int]:
+    """Извлекает chat_id из сырого обновления Telegram"""
+    if 'message' in update:
+        return update['message'].get('chat', {}).get('id')
+    if 'callback_query' in update:
+        callback_query = update['callback_query']
+        message = callback_query.get('message') or {}
+        chat_id = message.get('chat', {}).get('id')
+        if chat_id is not None:
+            return chat_id
+        return callback_query.get('from', {}).get('id')
+    return None
+
+
+class UpdateQueue:
+    """Очередь обновлений Telegram с пулом воркеров.
+
+    Обновления одного чата всегда попадают в один и тот же шард и обрабатываются
+    строго по порядку, разные чаты обрабатываются параллельно.
+    """
+
+    def __init__(self, handler: Callable[[dict], Awaitable[None]], workers: int = 4, max_size: int = 1000):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_size = max_size
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._size = 0
+        self._closing = False
+        self.processed_count = 0
+        self.failed_count = 0
+        self.shed_count = 0
+
+    @property
+    def size(self) -> int:
+        """Количество обновлений, ожидающих обработки"""
+        return self._size
+
+    def start(self) -> None:
+        """Запускает воркеры в текущем event loop"""
+        self._closing = False
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        self._tasks = [
+            asyncio.create_task(self._worker(queue), name=f"update-worker-{index}")
+            for index, queue in enumerate(self._queues)
+        ]
+        logger.info(f"Запущено воркеров обработки обновлений: {self.workers}")
+
+    def submit(self, update: dict, done: Optional[asyncio.Future] = None) -> bool:
+        """Ставит обновление в очередь. Возвращает False, если очередь переполнена или закрывается.
+
+        done получает результат True после успешной обработки и False после ошибки.
+        """
+        if self._closing or not self._queues:
+            self.shed_count += 1
+            logger.warning(f"Очередь закрыта, обновление {update.get('update_id')} отклонено")
+            return False
+
+        if self._size >= self.max_size:
+            self.shed_count += 1
+            logger.warning(
+                f"Очередь переполнена ({self._size}/{self.max_size}), "
+                f"обновление {update.get('update_id')} отклонено"
+            )
+            return False
+
+        chat_id = get_chat_id(update)
+        shard_key = chat_id if chat_id is not None else update.get('update_id', 0)
+        self._size += 1
+        self._queues[hash(shard_key) % self.workers].put_nowait((update, done))
+        return True
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            update, done = await queue.get()
+            success = False
+            try:
+                await self.handler(update)
+                self.processed_count += 1
+                success = True
+            except Exception as e:
+                self.failed_count += 1
+                logger.error(f"Ошибка обработки обновления {update.get('update_id')}: {e}", exc_info=True)
+            finally:
+                if done is not None and not done.done():
+                    done.set_result(success)
+                self._size -= 1
+                queue.task_done()
+
+    async def stop(self, timeout: float = 30) -> None:
+        """Перестает принимать обновления, дожидается обработки очереди и останавливает воркеры"""
+        self._closing = True
+        if self._queues:
+            logger.info(f"Ожидание обработки {self._size} обновлений перед остановкой")
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(queue.join() for queue in self._queues)),
+                    timeout=timeout
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"Не удалось дождаться обработки очереди, потеряно обновлений: {self._size}")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
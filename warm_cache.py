@@ -0,0 +1,229 @@
+import os
+import re
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import List, Optional
+from card import TranslationCard
+from rate_limit import current_user
+
+logger = logging.getLogger(__name__)
+
+# Строки лога обработчиков перевода (см. translate_word* в main.py)
+_LOG_RE = re.compile(r"translate_word(?:_async|_streaming)? called for: (.+)$")
+
+# Пользователь, от имени которого прогрев стоит в очереди к LLM
+WARMUP_USER_ID = 0
+
+
+def read_word_list(path: str) -> List[str]:
+    """Слова из файла по одному в строке (TSV - первый столбец), в порядке частоты"""
+    words = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            word = line.split("\t", 1)[0].strip()
+            if word and not word.startswith("#"):
+                words.append(word)
+    return words
+
+
+def read_log_words(paths: List[str]) -> List[str]:
+    """Запрошенные пользователями слова из логов бота, от частых к редким"""
+    counter = Counter()
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                match = _LOG_RE.search(line.rstrip("\n"))
+                if match:
+                    counter[" ".join(match.group(1).lower().split())] += 1
+    return [word for word, _ in counter.most_common()]
+
+
+def collect_words(args) -> List[str]:
+    """Объединяет источники без повторов и оставляет первые top слов"""
+    words = []
+    for path in args.words or []:
+        words.extend(read_word_list(path))
+    if args.logs:
+        words.extend(read_log_words(args.logs))
+
+    unique = list(dict.fromkeys(word for word in words if len(word.split()) <= args.max_words))
+    return unique[:args.top] if args.top else unique
+
+
+class CacheWarmer:
+    """Заполняет кэши переводов, ключевых слов, изображений и file_id для списка слов.
+
+    Повторный запуск обновляет только отсутствующие записи и переводы, которым
+    осталось жить меньше min_ttl секунд. Запросы к LLM идут через общий
+    планировщик бота (лимиты LLM_MAX_CONCURRENCY, LLM_RATE_LIMIT и заголовки
+    x-ratelimit-*), поиск изображений останавливается, когда квота Unsplash
+    опускается до unsplash_reserve, а загрузка в служебный чат идет не чаще
+    одной отправки в telegram_interval секунд.
+    """
+
+    def __init__(self, bot_module, concurrency: int = 4, min_ttl: float = 0,
+                 chat_id: Optional[int] = None, unsplash_reserve: int = 10, telegram_interval: float = 1.0):
+        self.main = bot_module
+        self.concurrency = concurrency
+        self.min_ttl = min_ttl
+        self.chat_id = chat_id
+        self.unsplash_reserve = unsplash_reserve
+        self.telegram_interval = telegram_interval
+        self._telegram_lock = asyncio.Lock()
+        self._images_exhausted = False
+        self.counts = Counter()
+
+    def _fresh(self, expires_at: Optional[float]) -> bool:
+        return expires_at is None or expires_at - time.time() > self.min_ttl
+
+    async def _translation(self, text: str) -> TranslationCard:
+        main = self.main
+        entry = main.translation_cache.get_entry(main.translation_cache_key(text))
+        if entry is not None and self._fresh(entry[1]):
+            self.counts["cached"] += 1
+            return TranslationCard.load(entry[0], word=text)
+
+        # Слова из офлайн-словаря не требуют запроса к LLM
+        card = main.local_translation(text) if entry is None else None
+        if card is not None:
+            self.counts["dictionary"] += 1
+            return card
+
+        self.counts["translated"] += 1
+        return await main.refresh_translation_async(text)
+
+    async def _keyword(self, text: str, card: TranslationCard) -> str:
+        if card.image_keyword:
+            return card.image_keyword
+
+        main = self.main
+        keyword = await main.get_image_search_keyword_async(text)
+        self.counts["keywords"] += 1
+        # Ключевое слово сохраняется вместе с переводом, как в структурированном ответе
+        key = main.translation_cache_key(text)
+        entry = main.translation_cache.get_entry(key)
+        if entry is not None:
+            ttl = entry[1] - time.time() if entry[1] is not None else None
+            cached = TranslationCard.load(entry[0], word=text)
+            cached.image_keyword = keyword
+            main.translation_cache.set(key, cached.dump(), ttl=ttl)
+        return keyword
+
+    async def _image_url(self, keyword: str) -> Optional[str]:
+        image_search = self.main.image_search
+        remaining = image_search.ratelimit_remaining
+        if remaining is not None and remaining <= self.unsplash_reserve:
+            if not self._images_exhausted:
+                self._images_exhausted = True
+                logger.warning(f"Квота Unsplash почти исчерпана ({remaining}), изображения больше не ищем")
+            # Кэшированные URL по-прежнему доступны
+            cached = image_search.cache.get(image_search._cache_key(keyword))
+            return cached["url"] if cached else None
+        return await image_search.get_image_url_async(keyword)
+
+    async def _file_id(self, image_url: str) -> None:
+        media_cache = self.main.media_cache
+        if media_cache.cache.get(image_url):
+            return
+        async with self._telegram_lock:
+            file_id = await asyncio.to_thread(media_cache.bootstrap_photo, image_url, self.chat_id)
+            if file_id:
+                self.counts["file_ids"] += 1
+            await asyncio.sleep(self.telegram_interval)
+
+    async def warm_word(self, text: str) -> None:
+        try:
+            card = await self._translation(text)
+            keyword = await self._keyword(text, card)
+            image_url = await self._image_url(keyword)
+            if image_url:
+                self.counts["images"] += 1
+                if self.chat_id is not None:
+                    await self._file_id(image_url)
+        except Exception as e:
+            self.counts["errors"] += 1
+            logger.error(f"Ошибка прогрева {text}: {e}")
+
+    async def run(self, words: List[str]) -> Counter:
+        self.counts = Counter()
+        current_user.set(WARMUP_USER_ID)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def worker(text: str) -> None:
+            async with semaphore:
+                await self.warm_word(text)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(word) for word in words))
+        logger.info(
+            f"Прогрев {len(words)} слов за {time.perf_counter() - started:.1f} с: {dict(self.counts)}"
+        )
+        return self.counts
+
+
+def next_run(schedule: str, now: datetime) -> datetime:
+    """Ближайшее время запуска по расписанию ЧЧ:ММ (локальное время)"""
+    hour, minute = (int(part) for part in schedule.split(":"))
+    run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return run_at if run_at > now else run_at + timedelta(days=1)
+
+
+async def main_async(args) -> None:
+    # Настройки очереди к LLM читаются при импорте бота, поэтому импорт после разбора аргументов
+    if args.llm_rate is not None:
+        os.environ["LLM_RATE_LIMIT"] = str(args.llm_rate)
+    import main as bot_module
+
+    chat_id = args.chat_id or os.getenv("WARMUP_CHAT_ID") or os.getenv("LOADING_GIF_CHAT_ID")
+    warmer = CacheWarmer(
+        bot_module,
+        concurrency=args.concurrency,
+        min_ttl=args.min_ttl,
+        chat_id=int(chat_id) if chat_id else None,
+        unsplash_reserve=args.unsplash_reserve,
+        telegram_interval=args.telegram_interval
+    )
+    try:
+        while True:
+            if args.schedule:
+                run_at = next_run(args.schedule, datetime.now())
+                logger.info(f"Следующий прогрев: {run_at:%Y-%m-%d %H:%M}")
+                await asyncio.sleep((run_at - datetime.now()).total_seconds())
+
+            words = collect_words(args)
+            logger.info(f"Слов для прогрева: {len(words)}")
+            await warmer.run(words)
+            if not args.schedule:
+                break
+    finally:
+        await bot_module.http_clients.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Прогрев кэшей бота для частых слов")
+    parser.add_argument("--words", action="append", help="файл со словами по частоте (по одному в строке или TSV)")
+    parser.add_argument("--logs", nargs="+", help="логи бота: берутся самые запрашиваемые слова")
+    parser.add_argument("--top", type=int, default=1000, help="сколько слов прогревать (0 - все)")
+    parser.add_argument("--max-words", type=int, default=3, help="пропускать фразы длиннее этого числа слов")
+    parser.add_argument("--concurrency", type=int, default=4, help="слов одновременно")
+    parser.add_argument("--llm-rate", type=float, help="запросов к LLM в секунду (по умолчанию LLM_RATE_LIMIT)")
+    parser.add_argument("--min-ttl", type=float, default=24 * 3600,
+                        help="обновлять переводы, которым осталось жить меньше стольких секунд")
+    parser.add_argument("--chat-id", type=int, help="служебный чат для получения file_id (WARMUP_CHAT_ID)")
+    parser.add_argument("--unsplash-reserve", type=int, default=10, help="остаток квоты Unsplash, который не тратить")
+    parser.add_argument("--telegram-interval", type=float, default=1.0, help="секунд между отправками в служебный чат")
+    parser.add_argument("--schedule", help="запускать ежедневно в ЧЧ:ММ (например 04:00) вместо однократного запуска")
+    args = parser.parse_args()
+    if not args.words and not args.logs:
+        parser.error("нужен --words или --logs")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    try:
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        print("Прогрев остановлен", file=sys.stderr)